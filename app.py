@@ -1,32 +1,76 @@
+import os
+from functools import partial
 import streamlit as st
-from classes.document_search_facade import DocumentSearchFacade
-from classes.pdf_processor import PDFProcessor
-from functions import process_text
+from classes.metrics import metrics
+from classes.passage_index import PassageIndex
+from classes.search_client import SearchClient
+from classes.search_service import SearchService
 from functions.evaluation import evaluate_recommendations, ndcg
 
-# Instanciar la fachada y el procesador de PDFs
-facade = DocumentSearchFacade()
-process = PDFProcessor()
+
+@st.cache_resource
+def get_search_service():
+    """
+    Servicio de búsqueda del proceso: el modelo de spaCy, el vectorizador, la
+    matriz y los clusters se cargan una sola vez y los comparten todas las
+    sesiones y ejecuciones del script. El servicio sustituye el índice cuando
+    cambia su sello de versión (documentos procesados o clustering).
+    """
+    return SearchService()
+
+
+# Con SEARCH_SERVER_URL la aplicación es un cliente del servidor de búsqueda
+# (server.py); sin ella, la búsqueda se realiza en este mismo proceso
+server_url = os.environ.get("SEARCH_SERVER_URL")
+service = SearchClient(server_url) if server_url else get_search_service()
+
+# Panel de depuración: tiempos y contadores por etapa de la última búsqueda.
+# Las métricas se activan solo durante las búsquedas de esta sesión
+debug = st.sidebar.checkbox("Panel de depuración")
+
 
 # Título de la aplicación
 st.title("Buscador y Procesador de Documentos PDF")
 
 # Sección para procesar PDFs
 st.header("Procesar documentos PDF")
+workers = st.number_input(
+    "Procesos para la ingesta:", min_value=1, max_value=os.cpu_count() or 1, value=1)
 if st.button("Procesar PDFs"):
+    # Importar la ingesta solo al usarla (carga su propio modelo de spaCy)
+    from functions import process_text
     pdf_files = process_text.get_pdf_files()  # Obtener los archivos PDF
     if pdf_files:
         st.write("Procesando documentos...")
         # Llamar a la función para procesar los PDFs
-        process_text.process_pdfs(pdf_files)
+        changes = process_text.process_pdfs(pdf_files, workers=int(workers))
         st.success(
             "¡Todos los PDFs han sido procesados y guardados en la carpeta 'processed_files'!")
+        st.write(
+            f"Nuevos: {len(changes['added'])} - Modificados: {len(changes['updated'])} - "
+            f"Eliminados: {len(changes['removed'])} - Sin cambios: {len(changes['unchanged'])}")
+        if server_url and service.reindex():
+            st.success("El servidor de búsqueda actualizó el índice.")
     else:
         st.warning("No se encontraron archivos PDF en la carpeta 'files'.")
 
 # Sección para realizar búsquedas
 st.header("Realizar una búsqueda")
 request = st.text_input("Introduce tu consulta:", "")
+search_modes = {"Similitud de coseno": "cosine", "Índice invertido": "inverted",
+                "Mejor pasaje": "passage", "Semántica (LSA)": "dense",
+                "Híbrida (léxica + semántica)": "hybrid"}
+search_mode = st.selectbox("Modo de búsqueda:", list(search_modes))
+scorers = {"TF-IDF (coseno)": "tfidf", "BM25": "bm25", "BM25F (título y contenido)": "bm25f"}
+scorer = st.selectbox("Algoritmo de puntuación:", list(scorers))
+n_probe = st.number_input(
+    "Clusters a explorar por consulta:", min_value=1, value=1)
+clusterings = {"DBSCAN": "dbscan", "SVD + MiniBatchKMeans": "svd_kmeans"}
+clustering_config = {
+    "clustering": clusterings[st.selectbox("Algoritmo de clustering:", list(clusterings))]}
+if clustering_config["clustering"] == "svd_kmeans":
+    clustering_config["n_clusters"] = int(st.number_input(
+        "Número de clusters:", min_value=2, value=8))
 
 # Inicializar el estado de la sesión para resultados, opciones y selección
 if "results" not in st.session_state:
@@ -35,18 +79,10 @@ if "options" not in st.session_state:
     st.session_state["options"] = []
 if "selected_option" not in st.session_state:
     st.session_state["selected_option"] = "Selecciona un documento"
-if "vectorizer" not in st.session_state:
-    st.session_state["vectorizer"] = None
-if "document_matrix" not in st.session_state:
-    st.session_state["document_matrix"] = None
-if "processed_documents" not in st.session_state:
-    st.session_state["processed_documents"] = []
-if "clusters" not in st.session_state:
-    st.session_state["clusters"] = None
 if "clusters_scores" not in st.session_state:
-    st.session_state["clusters_scores"] = []
-if "clustered_documents" not in st.session_state:
-    st.session_state["clustered_documents"] = {}
+    st.session_state["clusters_scores"] = {}
+if "cluster_summary" not in st.session_state:
+    st.session_state["cluster_summary"] = {}
 if "recommendations" not in st.session_state:
     st.session_state["recommendations"] = []
 if "recommended_docs" not in st.session_state:
@@ -56,25 +92,26 @@ if "relevant_docs" not in st.session_state:
 
 if st.button("Buscar"):
     if request.strip():
-        # Procesar e indexar los documentos antes de buscar
-        st.write("Procesando e indexando documentos...")
-        facade.add_documents()
-        st.success("Documentos procesados e indexados con éxito.")
-
-        # Realizar clustering de los documentos
-        st.write("Generando clusters de documentos...")
-        facade.perform_clustering()
-        st.success("Clusters generados con éxito.")
-
-        # Realizar la búsqueda
-        results = facade.search_documents(request)
+        # Cargar el índice persistido; solo se reconstruye (TF-IDF y clustering)
+        # si los documentos procesados cambiaron desde la última indexación. Si
+        # el almacén del corpus y la configuración no cambiaron, la comprobación
+        # es una sola consulta a la fecha de su tabla de documentos
+        if service.reindex(**clustering_config):
+            st.success("Documentos indexados y clusters generados con éxito.")
+
+        # Realizar la búsqueda registrando los eventos de sus etapas
+        with metrics.trace(enable=debug) as events:
+            results, clusters_scores = service.search(
+                request, mode=search_modes[search_mode], scorer=scorers[scorer],
+                n_probe=int(n_probe))
+        st.session_state["trace"] = events
         
-        # Guardar resultados en el estado de la sesión
+        # Guardar resultados (y la consulta, para los pasajes) en el estado de la sesión
         st.session_state["results"] = results
-        # Guardar los clusters en el estado de la sesión
-        st.session_state["clusters"] = facade.clusters
-        st.session_state["clustered_documents"] = facade.clustered_documents
-        st.session_state["clusters_scores"] = facade.clusters_scores
+        st.session_state["query"] = request
+        # Guardar el resumen de los clusters en el estado de la sesión
+        st.session_state["cluster_summary"] = service.clusters()
+        st.session_state["clusters_scores"] = clusters_scores
 
         # Restablecer la selección actual
         st.session_state["selected_option"] = "Selecciona un documento"
@@ -82,7 +119,7 @@ if st.button("Buscar"):
         # Crear una lista de opciones para el radio con relevancia y resumen
         options = ["Selecciona un documento"] + [
             f"Documento {i+1}: Relevancia {score:.4f}"
-            for i, (doc,score, pdf, title) in enumerate(results)
+            for i, (doc, score, pdf, title, doc_id) in enumerate(results)
         ]
         # Guardar opciones en el estado de la sesión
         st.session_state["options"] = options
@@ -112,57 +149,61 @@ if st.session_state["options"]:
         # Obtener el índice del documento seleccionado
         selected_index = st.session_state["options"].index(
             selected_option) - 1
-        selected_doc, selected_score, selected_pdf, selected_title = st.session_state["results"][selected_index]
+        selected_doc, selected_score, selected_pdf, selected_title, selected_id = st.session_state["results"][selected_index]
         
         st.write(f"📄 {selected_title}")
         
-        # Boton para descargar el PDF
-        with open(selected_pdf, "rb") as file:
-            pdf_bytes = file.read()
-            st.download_button(
-                label="📥 Descargar PDF",
-                data=pdf_bytes,
-                file_name=selected_pdf,
-                mime="application/pdf"
-            )
+        # Boton para descargar el PDF: se lee solo al pulsarlo
+        st.download_button(
+            label="📥 Descargar PDF",
+            data=partial(service.pdf, selected_id),
+            file_name=os.path.basename(selected_pdf),
+            mime="application/pdf"
+        )
         # Mostrar información del documento seleccionado
         st.success(f"Has seleccionado el documento {selected_index + 1}.")
         st.write(f"**Relevancia:** {selected_score:.4f}")
-        st.write(f"**Documento:** {selected_doc[:300]}...")
+        # Mejores pasajes del documento para la consulta, con sus términos resaltados
+        passages = service.passages(
+            st.session_state.get("query", request), [selected_id], n=3)[selected_id]
+        if passages:
+            for passage in passages:
+                page = f"Página {passage['page']}" if passage["page"] else "Pasaje"
+                st.markdown(f"**{page}:** ..." + PassageIndex.highlight(
+                    passage["text"], passage["highlights"]) + "...")
+        else:
+            st.write(f"**Documento:** {selected_doc[:300]}...")
 
+        similarity_modes = {"Términos en común (TF-IDF)": "sparse", "Semántica (LSA)": "dense"}
+        similarity_mode = similarity_modes[st.selectbox("Similitud:", list(similarity_modes))]
         # Botón para buscar documentos similares
         if st.button("Buscar documentos similares") or st.session_state["recommendations"]:
-            # Verificar si los datos necesarios están en el estado de la sesión
-            if "vectorizer" in st.session_state and "document_matrix" in st.session_state:
-                # Verificar si la matriz de documentos no está vacía
-                if st.session_state["document_matrix"].shape[0] > 0:
-                    recommendations = facade.recommend_similar_documents(
-                        selected_doc)
-                    # Guardar las recomendaciones en el estado de la sesión
-                    st.session_state["recommendations"] = recommendations
-
-                    st.subheader("Documentos similares:")
-                    if recommendations:
-                        for similar_doc, similarity_score, similarity_pdf in recommendations:
-                            st.write(f"**Similitud:** {similarity_score:.4f}")
-                            st.write(f"**Documento:** {similar_doc[:300]}...")
-                            with open(similarity_pdf, "rb") as file:
-                                pdf_bytes = file.read()
-                                st.download_button(
-                                    label="📥 Descargar PDF",
-                                    data=pdf_bytes,
-                                    file_name=similarity_pdf,
-                                    mime="application/pdf"
-                                )
-                            st.write("---")
-                    else:
-                        st.warning("No se encontraron documentos similares.")
-                else:
-                    st.error(
-                        "La matriz de documentos está vacía. Por favor, realiza una búsqueda primero.")
+            # Reutilizar las recomendaciones guardadas del mismo documento
+            if (st.session_state["recommendations"]
+                    and st.session_state.get("recommendations_for") == (selected_id, similarity_mode)):
+                recommendations = st.session_state["recommendations"]
+            else:
+                recommendations = service.similar(
+                    selected_id, mode=similarity_mode)
+            # Guardar las recomendaciones en el estado de la sesión
+            st.session_state["recommendations"] = recommendations
+            st.session_state["recommendations_for"] = (selected_id, similarity_mode)
+
+            st.subheader("Documentos similares:")
+            if recommendations:
+                for similar_doc, similarity_score, similarity_pdf, similar_id in recommendations:
+                    st.write(f"**Similitud:** {similarity_score:.4f}")
+                    st.write(f"**Documento:** {similar_doc[:300]}...")
+                    st.download_button(
+                        label="📥 Descargar PDF",
+                        data=partial(service.pdf, similar_id),
+                        file_name=os.path.basename(similarity_pdf),
+                        mime="application/pdf",
+                        key=f"download_{similar_id}"
+                    )
+                    st.write("---")
             else:
-                st.error(
-                    "Los datos necesarios no están disponibles. Por favor, realiza una búsqueda primero.")
+                st.warning("No se encontraron documentos similares.")
 
         # Evaluar las recomendaciones
         if st.button("Evaluar recomendaciones"):
@@ -170,33 +211,27 @@ if st.session_state["options"]:
             if "recommendations" in st.session_state:
                 recommendations = st.session_state["recommendations"]
 
-                # Obtener los documentos procesados
-                processed_documents = st.session_state["processed_documents"]
-
-                # Consulta actual
-                query = request.lower()
-
-                # Definir documentos relevantes basados en reglas
-                relevant_docs = [
-                    doc for doc in processed_documents if query in doc.lower()]
+                # Definir documentos relevantes basados en reglas: los que
+                # contienen la consulta actual (por id de documento)
+                relevant_docs = service.relevant(request)
                 # Guardar en session_state
                 st.session_state["relevant_docs"] = relevant_docs
                 
                 
-                # Extraer solo los textos de los documentos recomendados
-                recommended_docs = [doc for doc, _, _ in recommendations]
+                # Extraer solo los ids de los documentos recomendados
+                recommended_docs = [doc_id for _, _, _, doc_id in recommendations]
                 # Guardar en session_state
                 st.session_state["recommended_docs"] = recommended_docs
 
                 # Evaluar las recomendaciones
-                metrics = evaluate_recommendations(
+                scores = evaluate_recommendations(
                     recommended_docs, relevant_docs)
 
                 # Mostrar las métricas
                 st.subheader("Evaluación de las recomendaciones:")
-                st.write(f"**Precisión:** {metrics['precision']:.4f}")
-                st.write(f"**Cobertura:** {metrics['recall']:.4f}")
-                st.write(f"**F1-Score:** {metrics['f1_score']:.4f}")
+                st.write(f"**Precisión:** {scores['precision']:.4f}")
+                st.write(f"**Cobertura:** {scores['recall']:.4f}")
+                st.write(f"**F1-Score:** {scores['f1_score']:.4f}")
             else:
                 st.warning(
                     "No hay recomendaciones disponibles para evaluar. Por favor, busca documentos similares primero.")
@@ -216,11 +251,33 @@ if st.session_state["options"]:
 
 # Sección para mostrar estadísticas de clusters
 st.header("Estadísticas de Clusters")
-if "clusters" in st.session_state and "clustered_documents" in st.session_state:
-    clustered_documents = st.session_state["clustered_documents"]
-    for cluster_id, docs in clustered_documents.items():
-        st.write(f"Cluster {cluster_id}: {len(docs)} documentos - Similitud promedio: {st.session_state['clusters_scores'][cluster_id]:.5f}")
+if st.session_state["cluster_summary"]:
+    for cluster_id, summary in st.session_state["cluster_summary"].items():
+        st.write(f"Cluster {cluster_id}: {summary['size']} documentos - Similitud promedio: {st.session_state['clusters_scores'][cluster_id]:.5f}")
+        if summary["titles"]:
+            with st.expander(f"Títulos del cluster {cluster_id}"):
+                for title in summary["titles"]:
+                    st.write(f"📄 {title}")
 else:
     st.warning(
         "No se han generado clusters. Procesa e indexa los documentos primero."
     )
+
+# Panel de depuración con las métricas de la última búsqueda y del proceso
+if debug:
+    st.sidebar.subheader("Última búsqueda")
+    events = st.session_state.get("trace", [])
+    if events:
+        st.sidebar.table([
+            {"etapa": event["stage"], "ms": round(event["seconds"] * 1000, 3),
+             "RSS MB": round(event["rss_mb"], 1)}
+            for event in events if "stage" in event
+        ])
+        st.sidebar.table([
+            {"contador": event["counter"], "valor": event["value"]}
+            for event in events if "counter" in event
+        ])
+    elif server_url:
+        st.sidebar.info("Las etapas de cada búsqueda se registran en el servidor (--metrics).")
+    with st.sidebar.expander("Métricas del proceso (Prometheus)"):
+        st.code(service.metrics_text())
@@ -0,0 +1,278 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+import fitz
+import numpy as np
+
+from classes.corpus_store import CorpusStore
+from classes.document_search_facade import DocumentSearchFacade
+from classes.metadata_store import MetadataStore
+from classes.pdf_processor import PDFProcessor
+from functions import benchmark, process_text
+
+# Etapas del pipeline en el orden en que se ejecutan
+STAGES = ["ingest", "index", "cluster", "save", "load", "search", "search_many", "recommend"]
+
+
+def corpus_vocabulary(processed_folder_path="./processed_files"):
+    """
+    Palabras del corpus incluido y su frecuencia relativa, para generar
+    documentos y consultas sintéticos con una distribución realista.
+    """
+    store = DocumentSearchFacade._open_store(processed_folder_path)
+    counts, vocabulary = store.counts(store.keys())
+    words = np.array(sorted(vocabulary, key=vocabulary.get))
+    frequencies = np.asarray(counts.sum(axis=0), dtype=np.float64).ravel()
+    return words, frequencies / frequencies.sum()
+
+
+def generate_corpus(pdf_folder, processed_folder, n_documents, doc_words, as_pdf, rng):
+    """
+    Genera un corpus sintético de n_documents documentos de unas doc_words
+    palabras. Con as_pdf se escriben PDFs (para medir también la ingesta);
+    si no, directamente los textos procesados (en el almacén del corpus) y sus metadatos.
+    """
+    words, frequencies = corpus_vocabulary()
+    metadata = MetadataStore(os.path.join(processed_folder, "metadata.json"))
+    store = CorpusStore(os.path.join(processed_folder, "corpus"))
+    for number in range(n_documents):
+        length = max(1, int(rng.lognormal(np.log(doc_words), 0.5)))
+        text = " ".join(rng.choice(words, size=length, p=frequencies))
+        title = f"Documento sintético {number}"
+        key = f"synthetic_{number:06d}"
+        if as_pdf:
+            document = fitz.open()
+            page_words = text.split()
+            for start in range(0, len(page_words), 400):
+                page = document.new_page()
+                page_text = " ".join(page_words[start:start + 400])
+                if start == 0:
+                    page_text = title + "\n" + page_text
+                page.insert_textbox(fitz.Rect(50, 50, 550, 800), page_text, fontsize=8)
+            document.save(os.path.join(pdf_folder, key + ".pdf"))
+            document.close()
+        else:
+            store.add_text(key, text)
+            metadata.put(key, {"title": title, "pages": 1 + length // 400})
+    metadata.save()
+    store.save()
+
+
+def prepare_corpus(args, work_dir, rng):
+    """
+    Prepara las carpetas de PDFs y de textos procesados de la ejecución y
+    apunta a ellas las rutas de process_text. Devuelve (carpeta de PDFs,
+    carpeta de textos procesados).
+    """
+    processed_folder = os.path.join(work_dir, "processed_files")
+    os.makedirs(processed_folder)
+    if args.synthetic:
+        pdf_folder = os.path.join(work_dir, "files")
+        os.makedirs(pdf_folder)
+        generate_corpus(pdf_folder, processed_folder, args.synthetic, args.doc_words,
+                        not args.skip_ingest, rng)
+    else:
+        pdf_folder = args.files
+        if args.skip_ingest:
+            DocumentSearchFacade._open_store(args.processed)
+            shutil.copytree(os.path.join(args.processed, "corpus"),
+                            os.path.join(processed_folder, "corpus"))
+            for file_name in ("metadata.json", "lemmas.json"):
+                if os.path.exists(os.path.join(args.processed, file_name)):
+                    shutil.copy(os.path.join(args.processed, file_name), processed_folder)
+
+    process_text.folder_path = pdf_folder
+    process_text.processed_folder_path = processed_folder
+    process_text.corpus_path = os.path.join(processed_folder, "corpus")
+    process_text.manifest_path = os.path.join(processed_folder, "manifest.json")
+    process_text.metadata_path = os.path.join(processed_folder, "metadata.json")
+    process_text.lemmas_path = os.path.join(processed_folder, "lemmas.json")
+    return pdf_folder, processed_folder
+
+
+def load_queries(args, facade, rng):
+    """
+    Consultas del archivo indicado (una por línea) o, si no hay, consultas
+    de 1 a 3 palabras tomadas al azar del vocabulario del índice.
+    """
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as file:
+            return [line.strip() for line in file if line.strip()]
+    vocabulary = np.array(list(facade.indexer.vectorizer.vocabulary_))
+    return [" ".join(rng.choice(vocabulary, size=rng.integers(1, 4)))
+            for _ in range(args.n_queries)]
+
+
+def configure(facade, args):
+    facade.clustering = args.clustering
+    facade.eps = args.eps
+    facade.n_clusters = args.n_clusters
+    facade.dense_components = args.dense_components
+    facade.dense_quantize = args.dense_quantize
+    facade.n_shards = args.shards
+
+
+def run(args):
+    """
+    Ejecuta todas las etapas sobre un corpus aislado en una carpeta temporal
+    y devuelve los resultados.
+    """
+    rng = np.random.default_rng(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="benchmark_")
+    stages = {}
+    try:
+        pdf_folder, processed_folder = prepare_corpus(args, work_dir, rng)
+        processor = PDFProcessor(lazy=True)
+        process_text.process = processor
+
+        if not args.skip_ingest:
+            pdf_files = process_text.get_pdf_files()
+            stages["ingest"] = benchmark.run_batch_stage(
+                lambda: process_text.process_pdfs(pdf_files, workers=args.workers), len(pdf_files))
+
+        index_path = os.path.join(work_dir, "index")
+        facade = DocumentSearchFacade(index_path, processor=processor)
+        configure(facade, args)
+        n_documents = len(facade._open_store(processed_folder))
+        stages["index"] = benchmark.run_batch_stage(
+            lambda: facade.add_documents(processed_folder), n_documents)
+        stages["cluster"] = benchmark.run_batch_stage(facade.perform_clustering, n_documents)
+
+        def save():
+            facade.indexer.signature = facade._signature(facade.store)
+            facade.indexer.n_shards = facade.n_shards
+            facade.indexer.save()
+        stages["save"] = benchmark.run_batch_stage(save, n_documents)
+
+        loaded = DocumentSearchFacade(index_path, processor=processor)
+        configure(loaded, args)
+        stages["load"] = benchmark.run_batch_stage(
+            lambda: loaded.load_index(processed_folder), n_documents)
+
+        def search(query):
+            # Medir la búsqueda completa, sin las cachés de consultas
+            for cache in loaded.caches.values():
+                cache.clear()
+            loaded.search_documents(query, threshold=args.threshold, mode=args.mode, k=args.k,
+                                    scorer=args.scorer, n_probe=args.n_probe)
+
+        def search_many():
+            for cache in loaded.caches.values():
+                cache.clear()
+            loaded.search_many(queries, threshold=args.threshold, mode=args.mode, k=args.k,
+                               scorer=args.scorer, n_probe=args.n_probe)
+
+        # Las consultas se enrutan a clusters: sin clusters válidos (todo
+        # ruido de DBSCAN) se omiten las etapas de búsqueda en lugar de abortar
+        if loaded.clustered_documents:
+            queries = load_queries(args, loaded, rng)
+            search(queries[0])  # Calentamiento (carga perezosa de spaCy si hace falta)
+            stages["search"] = benchmark.run_item_stage(search, queries)
+            stages["search_many"] = benchmark.run_batch_stage(search_many, len(queries))
+        else:
+            print("Sin clusters válidos (pruebe --clustering svd_kmeans): "
+                  "se omiten las etapas search y search_many", file=sys.stderr)
+
+        doc_ids = rng.choice(loaded.indexer.registry.ids, size=args.n_queries).tolist()
+        stages["recommend"] = benchmark.run_item_stage(
+            loaded.recommend_similar_documents, doc_ids)
+        loaded.close()
+    finally:
+        if args.keep:
+            print(f"Archivos de la ejecución en {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    config = {name: getattr(args, name) for name in (
+        "synthetic", "doc_words", "skip_ingest", "workers", "clustering", "eps", "n_clusters",
+        "dense_components", "dense_quantize", "shards", "scorer", "mode", "n_probe", "k", "threshold", "n_queries", "seed")}
+    return {"environment": benchmark.environment(), "config": config,
+            "corpus": {"documents": n_documents,
+                       "source": "synthetic" if args.synthetic else "bundled"},
+            "stages": stages}
+
+
+def print_results(results):
+    print(f"Documentos: {results['corpus']['documents']} ({results['corpus']['source']})")
+    print(f"{'etapa':<10} {'elem/s':>10} {'total s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'RSS MB':>8}")
+    for stage in STAGES:
+        metrics = results["stages"].get(stage)
+        if metrics is None:
+            continue
+        latency = [f"{metrics[name]:>9.2f}" if name in metrics else f"{'-':>9}"
+                   for name in ("p50_ms", "p95_ms", "p99_ms")]
+        print(f"{stage:<10} {metrics['throughput']:>10.1f} {metrics['seconds']:>9.3f} "
+              f"{' '.join(latency)} {metrics['peak_rss_mb']:>8.1f}")
+
+
+def print_comparison(rows):
+    print(f"{'etapa':<10} {'métrica':<12} {'base':>12} {'nuevo':>12} {'cambio':>9}")
+    for stage, metric, old, new, change, regression in rows:
+        print(f"{stage:<10} {metric:<12} {old:>12.3f} {new:>12.3f} {change:>+8.1f}%"
+              + ("  <-- empeora" if regression else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de ingesta, indexación, clustering, búsqueda y recomendación")
+    parser.add_argument("--files", default="./files", help="Carpeta de PDFs del corpus incluido")
+    parser.add_argument("--processed", default="./processed_files",
+                        help="Textos procesados del corpus incluido (con --skip-ingest)")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Generar un corpus sintético con este número de documentos")
+    parser.add_argument("--doc-words", type=int, default=2000,
+                        help="Palabras medias por documento sintético")
+    parser.add_argument("--skip-ingest", action="store_true",
+                        help="No medir la ingesta de PDFs (usa los textos ya procesados)")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos para la ingesta")
+    parser.add_argument("--clustering", choices=["dbscan", "svd_kmeans"],
+                        help="Por defecto dbscan; svd_kmeans con --synthetic (DBSCAN no "
+                             "encuentra clusters en textos sintéticos, todos igual de dispersos)")
+    parser.add_argument("--eps", type=float, default=0.816)
+    parser.add_argument("--n-clusters", type=int, default=8)
+    parser.add_argument("--scorer", default="tfidf", choices=["tfidf", "bm25", "bm25f"])
+    parser.add_argument("--mode", default="cosine",
+                        choices=["cosine", "inverted", "passage", "dense", "hybrid"])
+    parser.add_argument("--dense-components", type=int, default=100,
+                        help="Dimensiones del índice denso (LSA); 0 lo desactiva")
+    parser.add_argument("--dense-quantize", action="store_true",
+                        help="Guardar los vectores densos en int8")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Particiones del índice, cada una buscada en su propio proceso")
+    parser.add_argument("--n-probe", type=int, default=1)
+    parser.add_argument("--k", type=int, default=None)
+    parser.add_argument("--threshold", type=float, default=0.009)
+    parser.add_argument("--queries", help="Archivo con una consulta por línea")
+    parser.add_argument("--n-queries", type=int, default=200,
+                        help="Consultas y recomendaciones a medir si no se da --queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Guardar los resultados en este archivo JSON")
+    parser.add_argument("--keep", action="store_true", help="Conservar la carpeta temporal")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NUEVO"),
+                        help="Comparar dos archivos de resultados en lugar de ejecutar")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="Empeoramiento máximo permitido (%%) al comparar")
+    args = parser.parse_args()
+
+    if args.compare:
+        rows = benchmark.compare_results(
+            benchmark.load_results(args.compare[0]), benchmark.load_results(args.compare[1]),
+            args.tolerance)
+        print_comparison(rows)
+        # Código de salida distinto de cero si alguna métrica empeora
+        sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+    if args.clustering is None:
+        args.clustering = "svd_kmeans" if args.synthetic else "dbscan"
+    results = run(args)
+    print_results(results)
+    if args.output:
+        benchmark.save_results(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
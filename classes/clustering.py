@@ -0,0 +1,103 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.cluster import DBSCAN, MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+
+class DBSCANClustering:
+    """ Clustering con DBSCAN y distancia coseno sobre la matriz TF-IDF (O(n²)) """
+
+    name = "dbscan"
+    # DBSCAN no puede asignar documentos nuevos sin volver a ajustarse
+    incremental = False
+
+    def __init__(self, eps=0.816, min_samples=2):
+        self.params = {"eps": eps, "min_samples": min_samples}
+
+    def fit_predict(self, document_matrix, vocabulary):
+        dbscan = DBSCAN(
+            eps=self.params["eps"], min_samples=self.params["min_samples"], metric="cosine")
+        return dbscan.fit_predict(document_matrix)
+
+    def assign(self, document_matrix, vocabulary):
+        raise NotImplementedError("DBSCAN no permite asignar documentos sin reajustar")
+
+
+class SVDKMeansClustering:
+    """
+    Clustering escalable: reducción de dimensionalidad con TruncatedSVD y
+    MiniBatchKMeans sobre los vectores reducidos, procesados por bloques para
+    acotar la memoria. Los documentos nuevos se asignan al centroide más
+    cercano sin volver a ajustar el modelo.
+    """
+
+    name = "svd_kmeans"
+    incremental = True
+
+    def __init__(self, n_clusters=8, n_components=100, batch_size=1024, random_state=0):
+        self.params = {"n_clusters": n_clusters, "n_components": n_components}
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.svd = None
+        self.kmeans = None
+        self.vocabulary = None
+
+    def fit_predict(self, document_matrix, vocabulary):
+        n_documents, n_terms = document_matrix.shape
+        n_components = max(1, min(self.params["n_components"], n_terms - 1, n_documents - 1))
+        self.svd = TruncatedSVD(n_components=n_components, random_state=self.random_state)
+        self.svd.fit(document_matrix)
+        self.vocabulary = dict(vocabulary)
+
+        self.kmeans = MiniBatchKMeans(
+            n_clusters=min(self.params["n_clusters"], n_documents),
+            batch_size=self.batch_size, random_state=self.random_state, n_init=3)
+        blocks = list(self._reduced_blocks(document_matrix))
+        if len(blocks) == 1:
+            self.kmeans.fit(blocks[0])
+        else:
+            for block in blocks:
+                self.kmeans.partial_fit(block)
+        return np.concatenate([self.kmeans.predict(block) for block in blocks])
+
+    def assign(self, document_matrix, vocabulary):
+        """
+        Asigna documentos al cluster más cercano. Las columnas se alinean con el
+        vocabulario usado al ajustar el modelo (los términos nuevos se ignoran).
+        """
+        document_matrix = self._align(document_matrix, vocabulary)
+        return np.concatenate([
+            self.kmeans.predict(block) for block in self._reduced_blocks(document_matrix)
+        ] or [np.empty(0, dtype=np.int64)])
+
+    def _reduced_blocks(self, document_matrix):
+        """
+        Genera los vectores reducidos y normalizados por bloques de filas.
+        """
+        for start in range(0, document_matrix.shape[0], self.batch_size):
+            block = document_matrix[start:start + self.batch_size]
+            yield normalize(self.svd.transform(block))
+
+    def _align(self, document_matrix, vocabulary):
+        """
+        Reordena las columnas de la matriz según el vocabulario del ajuste.
+        """
+        if vocabulary == self.vocabulary:
+            return document_matrix
+        columns = np.full(len(vocabulary), -1, dtype=np.int64)
+        for term, column in vocabulary.items():
+            columns[column] = self.vocabulary.get(term, -1)
+        document_matrix = csr_matrix(document_matrix)
+        known = columns[document_matrix.indices] >= 0
+        rows = np.repeat(np.arange(document_matrix.shape[0]), np.diff(document_matrix.indptr))
+        return csr_matrix(
+            (document_matrix.data[known], (rows[known], columns[document_matrix.indices[known]])),
+            shape=(document_matrix.shape[0], len(self.vocabulary)))
+
+
+# Algoritmos de clustering disponibles, por nombre
+CLUSTERINGS = {
+    DBSCANClustering.name: DBSCANClustering,
+    SVDKMeansClustering.name: SVDKMeansClustering,
+}
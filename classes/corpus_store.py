@@ -0,0 +1,366 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer
+from functions.disk_arrays import batch_ranges, empty_array, index_dtype
+
+# Tokenizador del índice: el almacén guarda exactamente los términos que
+# CountVectorizer extraería del texto procesado (minúsculas, 2 o más caracteres)
+ANALYZER = CountVectorizer().build_analyzer()
+
+
+class TokenEncoder:
+    """
+    Codifica textos como arreglos de ids de términos con un vocabulario local.
+    Lo usan los procesos de la ingesta; CorpusStore.add traduce después los
+    ids locales al vocabulario común del almacén.
+    """
+
+    def __init__(self):
+        self.terms = []
+        self._ids = {}
+
+    def encode(self, text):
+        ids = self._ids
+        return np.array([
+            ids[term] if term in ids else self._add(term) for term in ANALYZER(text)
+        ], dtype=np.uint32)
+
+    def _add(self, term):
+        self._ids[term] = len(self.terms)
+        self.terms.append(term)
+        return self._ids[term]
+
+
+class StoredDocuments:
+    """
+    Secuencia de solo lectura con los textos de los documentos indicados; cada
+    texto se reconstruye desde el almacén al accederlo, sin tenerlos en memoria.
+    """
+
+    def __init__(self, store, keys):
+        self.store = store
+        self.keys = list(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getitem__(self, row):
+        return self.store.text(self.keys[row])
+
+    def __iter__(self):
+        return (self.store.text(key) for key in self.keys)
+
+
+class CorpusStore:
+    """
+    Almacén compacto de los documentos procesados: cada documento es un rango
+    de ids de términos dentro de un segmento (arreglo .npy, abierto como
+    memoria mapeada) y todos comparten un único vocabulario. Cada guardado
+    añade como mucho un segmento; cuando los rangos obsoletos (documentos
+    eliminados o reemplazados) superan a los vigentes, el almacén se compacta
+    en un solo segmento.
+    """
+
+    def __init__(self, path="./processed_files/corpus"):
+        self.path = path
+        self.terms = []  # id -> término
+        self._term_ids = {}  # término -> id
+        self.documents = {}  # clave -> [segmento, inicio, fin, hash, inicio de cada página]
+        self.next_segment = 0
+        self._segments = {}  # segmento -> arreglo (memoria mapeada)
+        self._pending = {}  # clave -> ids de los documentos añadidos sin guardar
+        self._pending_pages = {}  # clave -> inicio de cada página de los documentos sin guardar
+        self._order = None  # ids de los términos en orden alfabético
+        if self.exists():
+            # La tabla de documentos se lee antes que el vocabulario: al guardar
+            # se escribe después, así que el vocabulario leído siempre la cubre
+            with open(os.path.join(path, "documents.json"), "r", encoding="utf-8") as file:
+                data = json.load(file)
+            self.documents = data["documents"]
+            self.next_segment = data["next_segment"]
+            with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as file:
+                self.terms = json.load(file)
+            self._term_ids = {term: term_id for term_id, term in enumerate(self.terms)}
+            # Mapear ya todos los segmentos: si otro proceso compacta el almacén
+            # y borra segmentos, este sigue leyendo los que tenía abiertos
+            for segment in self._segment_numbers():
+                self._segment(segment)
+
+    @classmethod
+    def open(cls, path, legacy_folder_path=None):
+        """
+        Abre el almacén; si todavía no existe, lo crea importando los .txt de
+        legacy_folder_path (formato anterior de processed_files).
+        """
+        store = cls(path)
+        if not store.exists() and legacy_folder_path and os.path.isdir(legacy_folder_path):
+            store.import_folder(legacy_folder_path)
+        return store
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, "documents.json"))
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return key in self._pending or (key in self.documents and self.documents[key] is not None)
+
+    def keys(self):
+        """
+        Claves (nombre del PDF sin extensión) de los documentos, ordenadas.
+        """
+        return sorted(key for key in set(self.documents) | set(self._pending) if key in self)
+
+    def stamp(self, key):
+        """
+        Hash del contenido de un documento; cambia si el documento se reprocesa con otro resultado.
+        """
+        if key in self._pending:
+            return self._hash(self._pending[key])
+        return self.documents[key][3]
+
+    def token_ids(self, key):
+        if key in self._pending:
+            return self._pending[key]
+        segment, start, end = self.documents[key][:3]
+        return self._segment(segment)[start:end]
+
+    def pages(self, key):
+        """
+        Posición (en tokens) donde empieza cada página del documento; vacía si
+        no se conocen sus páginas (documentos importados de .txt).
+        """
+        if key in self._pending:
+            return self._pending_pages[key]
+        entry = self.documents[key]
+        return entry[4] if len(entry) > 4 else []
+
+    def text(self, key):
+        """
+        Texto procesado de un documento (sus términos separados por espacios).
+        """
+        terms = self.terms
+        return " ".join([terms[term_id] for term_id in self.token_ids(key).tolist()])
+
+    def preview(self, key, length=300):
+        """
+        Comienzo del texto procesado de un documento (como mucho length
+        caracteres), reconstruido solo a partir de sus primeros términos.
+        """
+        # Cada término ocupa al menos 3 caracteres con su espacio (2 o más caracteres)
+        term_ids = self.token_ids(key)[:length // 3 + 1]
+        return " ".join([self.terms[term_id] for term_id in term_ids.tolist()])[:length]
+
+    def add(self, key, ids, terms=None, pages=None):
+        """
+        Añade (o reemplaza) un documento a partir de sus ids de términos. Si se
+        pasan terms, los ids se refieren a esa lista (vocabulario local de un
+        TokenEncoder) y se traducen al vocabulario del almacén. pages es la
+        posición donde empieza cada página, si se conoce.
+        """
+        ids = np.asarray(ids, dtype=np.uint32)
+        if terms is not None:
+            ids = self._global_ids(terms)[ids]
+        self._pending[key] = ids
+        self._pending_pages[key] = [int(start) for start in pages or []]
+
+    def add_text(self, key, text):
+        """
+        Añade (o reemplaza) un documento a partir de su texto procesado.
+        """
+        encoder = TokenEncoder()
+        self.add(key, encoder.encode(text), encoder.terms)
+
+    def remove(self, key):
+        self._pending.pop(key, None)
+        self._pending_pages.pop(key, None)
+        if key in self.documents:
+            self.documents[key] = None
+
+    def save(self):
+        """
+        Escribe los documentos pendientes en un segmento nuevo y guarda el
+        vocabulario y la tabla de documentos. documents.json se reemplaza al
+        final de forma atómica, por lo que una escritura interrumpida no deja
+        el almacén inconsistente.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        if self._pending:
+            segment = self.next_segment
+            self.next_segment += 1
+            keys = sorted(self._pending)
+            lengths = [len(self._pending[key]) for key in keys]
+            tokens = np.concatenate([self._pending[key] for key in keys])
+            np.save(self._segment_path(segment), tokens.astype(self._dtype()))
+            for key, start, end in zip(keys, np.cumsum([0] + lengths[:-1]), np.cumsum(lengths)):
+                self.documents[key] = [segment, int(start), int(end),
+                                       self._hash(self._pending[key]), self._pending_pages[key]]
+            self._pending, self._pending_pages = {}, {}
+        self.documents = {key: entry for key, entry in self.documents.items() if entry is not None}
+
+        live = sum(entry[2] - entry[1] for entry in self.documents.values())
+        stored = sum(np.load(self._segment_path(segment), mmap_mode="r").shape[0]
+                     for segment in self._segment_numbers())
+        if stored > 2 * live:
+            self.compact()
+            return
+        self._write_tables()
+        self._remove_unused_segments()
+
+    def compact(self):
+        """
+        Reescribe todos los documentos vigentes en un único segmento.
+        """
+        for key in list(self.documents):
+            self._pending_pages[key] = self.pages(key)
+            self._pending[key] = np.array(self.token_ids(key))
+        self.documents = {}
+        self._segments = {}
+        self.save()
+
+    def counts(self, keys, path=None, batch_tokens=1 << 20):
+        """
+        Matriz dispersa de frecuencias (documentos x términos) de los documentos
+        indicados, construida directamente desde los ids sin volver a tokenizar.
+        Solo incluye los términos que aparecen en esos documentos, con las
+        columnas en orden alfabético como CountVectorizer. Devuelve (matriz, vocabulario).
+        Los documentos se recorren por lotes de como mucho batch_tokens tokens
+        en dos pasadas: la primera obtiene el vocabulario y el tamaño de cada
+        fila y la segunda escribe las filas en su lugar, así que solo los ids
+        de un lote están en memoria. Con path, la matriz se escribe en disco (counts_*.npy) y se
+        devuelve abierta como memoria mapeada.
+        """
+        keys = list(keys)
+        batches = list(batch_ranges([len(self.token_ids(key)) for key in keys], batch_tokens))
+        present = np.zeros(len(self.terms), dtype=bool)
+        row_sizes = np.zeros(len(keys), dtype=np.int64)
+        for start, end in batches:
+            rows, term_ids, _ = self._batch_pairs(keys[start:end], None, len(self.terms))
+            present[term_ids] = True
+            row_sizes[start:end] = np.bincount(rows, minlength=end - start)
+
+        alphabetical = self._alphabetical()
+        used = alphabetical[present[alphabetical]]
+        columns = np.empty(len(self.terms), dtype=np.int64)
+        columns[used] = np.arange(len(used))
+
+        nnz = int(row_sizes.sum())
+        dtype = index_dtype(max(nnz, len(keys), len(used)))
+        indptr = empty_array(len(keys) + 1, dtype, path, "counts_indptr")
+        indptr[0] = 0
+        indptr[1:] = np.cumsum(row_sizes)
+        indices = empty_array(nnz, dtype, path, "counts_indices")
+        data = empty_array(nnz, np.int32, path, "counts_data")
+        for start, end in batches:
+            _, batch_columns, frequencies = self._batch_pairs(keys[start:end], columns, len(used))
+            indices[indptr[start]:indptr[end]] = batch_columns
+            data[indptr[start]:indptr[end]] = frequencies
+
+        counts = csr_matrix((data, indices, indptr), shape=(len(keys), len(used)), copy=False)
+        vocabulary = {self.terms[term_id]: column for column, term_id in enumerate(used.tolist())}
+        return counts, vocabulary
+
+    def _batch_pairs(self, keys, columns, n_columns):
+        """
+        Pares (fila dentro del lote, columna) distintos de los documentos
+        indicados, ordenados por fila y columna, con su frecuencia. columns
+        traduce los ids del almacén a columnas (None: la columna es el id).
+        """
+        token_ids = [np.asarray(self.token_ids(key), dtype=np.int64) for key in keys]
+        if not token_ids:
+            return (np.empty(0, dtype=np.int64),) * 3
+        lengths = np.array([len(ids) for ids in token_ids], dtype=np.int64)
+        batch_columns = np.concatenate(token_ids)
+        if columns is not None:
+            batch_columns = columns[batch_columns]
+        rows = np.repeat(np.arange(len(keys), dtype=np.int64), lengths)
+        pairs, frequencies = np.unique(rows * n_columns + batch_columns, return_counts=True)
+        return pairs // n_columns, pairs % n_columns, frequencies
+
+    def import_folder(self, processed_folder_path):
+        """
+        Importa los .txt del formato anterior de processed_files (un archivo de
+        texto por PDF) y guarda el almacén. Devuelve el número de documentos importados.
+        """
+        txt_files = sorted(file for file in os.listdir(processed_folder_path) if file.endswith(".txt"))
+        encoder = TokenEncoder()
+        for txt_file in txt_files:
+            with open(os.path.join(processed_folder_path, txt_file), "r", encoding="utf-8") as file:
+                ids = encoder.encode(file.read())
+            self.add(os.path.splitext(txt_file)[0], ids, encoder.terms)
+        self.save()
+        return len(txt_files)
+
+    def columns(self, vocabulary):
+        """
+        Traduce los ids del almacén a columnas de un vocabulario (término -> columna);
+        los términos que no están en él quedan en -1.
+        """
+        columns = np.full(len(self.terms), -1, dtype=np.int64)
+        for term, column in vocabulary.items():
+            term_id = self._term_ids.get(term)
+            if term_id is not None:
+                columns[term_id] = column
+        return columns
+
+    def _global_ids(self, terms):
+        """
+        Traduce un vocabulario local a ids del almacén, añadiendo los términos nuevos.
+        """
+        mapping = np.empty(len(terms), dtype=np.uint32)
+        for local_id, term in enumerate(terms):
+            term_id = self._term_ids.get(term)
+            if term_id is None:
+                term_id = self._term_ids[term] = len(self.terms)
+                self.terms.append(term)
+            mapping[local_id] = term_id
+        return mapping
+
+    def _alphabetical(self):
+        """
+        Ids de todos los términos en orden alfabético; se recalcula solo si el vocabulario creció.
+        """
+        if self._order is None or len(self._order) != len(self.terms):
+            self._order = np.argsort(np.array(self.terms, dtype=str), kind="stable")
+        return self._order
+
+    def _dtype(self):
+        # Ids de 16 bits mientras el vocabulario lo permita
+        return np.uint16 if len(self.terms) <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+    @staticmethod
+    def _hash(ids):
+        return hashlib.sha1(np.asarray(ids, dtype=np.uint32).tobytes()).hexdigest()
+
+    def _segment(self, segment):
+        if segment not in self._segments:
+            self._segments[segment] = np.load(self._segment_path(segment), mmap_mode="r")
+        return self._segments[segment]
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, f"segment_{segment:05d}.npy")
+
+    def _segment_numbers(self):
+        return sorted({entry[0] for entry in self.documents.values()})
+
+    def _write_tables(self):
+        for name, data in (("terms.json", self.terms),
+                           ("documents.json", {"next_segment": self.next_segment,
+                                               "documents": self.documents})):
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(data, file, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, os.path.join(self.path, name))
+
+    def _remove_unused_segments(self):
+        used = set(self._segment_numbers())
+        for file_name in os.listdir(self.path):
+            if file_name.startswith("segment_") and file_name.endswith(".npy"):
+                if int(file_name[len("segment_"):-len(".npy")]) not in used:
+                    self._segments.pop(int(file_name[len("segment_"):-len(".npy")]), None)
+                    os.remove(os.path.join(self.path, file_name))
@@ -0,0 +1,215 @@
+import json
+import os
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from functions.disk_arrays import empty_array
+
+
+class DenseIndex:
+    """
+    Índice semántico latente (LSA): proyecta la matriz TF-IDF con TruncatedSVD
+    en vectores densos normalizados de n_components dimensiones, de modo que
+    documentos que comparten temas puntúan aunque no compartan lemas. Los
+    vectores se guardan en float32 o, con quantize=True, en int8 con una
+    escala por documento (4 veces menos memoria) y se abren como memoria mapeada.
+    Para no recorrer todos los documentos, se agrupan en listas (IVF): cada
+    documento pertenece a la lista del centroide más cercano y una búsqueda
+    solo puntúa los documentos de las n_probe listas más cercanas a la consulta.
+    """
+
+    def __init__(self, n_components=100, quantize=False, batch_size=1024, random_state=0, fit_size=10000):
+        self.params = {"n_components": n_components, "quantize": quantize}
+        self.batch_size = batch_size
+        self.fit_size = fit_size  # Documentos de la muestra con la que se ajustan la SVD y las listas
+        self.random_state = random_state
+        self.projection = None  # términos x dimensiones (components_ traspuesta de la SVD)
+        self.vectors = None  # documentos x dimensiones, float32 o int8
+        self.scales = None  # Escala de cada documento cuantizado (None en float32)
+        self.centroids = None  # Centroide normalizado de cada lista
+        self.lists = None  # fila -> lista
+        # Filas de la lista l: list_rows[list_indptr[l]:list_indptr[l + 1]]
+        self.list_indptr = None
+        self.list_rows = None
+
+    def __len__(self):
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def build(self, document_matrix, path=None):
+        """
+        Ajusta la SVD sobre la matriz TF-IDF, proyecta todos los documentos por
+        bloques de filas y los reparte en listas con MiniBatchKMeans
+        (aproximadamente la raíz cuadrada del número de documentos). Con más de
+        fit_size documentos, la SVD y MiniBatchKMeans se ajustan con una muestra
+        de fit_size filas; con path, los vectores se escriben en disco.
+        """
+        n_documents, n_terms = document_matrix.shape
+        n_components = max(1, min(self.params["n_components"], n_terms - 1, n_documents - 1))
+        sample = None
+        if n_documents > self.fit_size:
+            sample = np.sort(np.random.default_rng(self.random_state).choice(
+                n_documents, self.fit_size, replace=False))
+        svd = TruncatedSVD(n_components=n_components, random_state=self.random_state)
+        svd.fit(document_matrix if sample is None else document_matrix[sample])
+        self.projection = svd.components_.T.astype(np.float32)
+
+        quantize = self.params["quantize"]
+        self.vectors = empty_array((n_documents, n_components), np.int8 if quantize else np.float32,
+                                   path, "dense_vectors")
+        self.scales = empty_array(n_documents, np.float32, path, "dense_scales") if quantize else None
+        for start, end in self._blocks(n_documents):
+            vectors, scales = self._quantized(self.transform(document_matrix[start:end]))
+            self.vectors[start:end] = vectors
+            if quantize:
+                self.scales[start:end] = scales
+
+        n_lists = max(1, min(int(np.sqrt(n_documents)), n_documents))
+        kmeans = MiniBatchKMeans(n_clusters=n_lists, batch_size=self.batch_size,
+                                 random_state=self.random_state, n_init=3)
+        kmeans.fit(self.vectors_at(np.arange(n_documents) if sample is None else sample))
+        self.centroids = normalize(kmeans.cluster_centers_).astype(np.float32)
+        self._set_lists(np.concatenate([np.empty(0, dtype=np.int32)] + [
+            self._nearest_lists(self.vectors_at(np.arange(start, end)))
+            for start, end in self._blocks(n_documents)]))
+
+    def update(self, removed_rows, added_matrix, old_vocabulary, vocabulary):
+        """
+        Elimina las filas indicadas y añade al final los documentos nuevos
+        proyectados con la SVD ya ajustada (fold-in) y asignados a su lista más
+        cercana. La proyección se lleva al vocabulario nuevo: los términos que
+        no existían al ajustar no aportan. Los vectores guardados no se
+        recalculan con el nuevo IDF; si cambia gran parte del corpus conviene
+        volver a construir el índice.
+        """
+        projection = np.zeros((len(vocabulary), self.projection.shape[1]), dtype=np.float32)
+        for term, column in vocabulary.items():
+            old_column = old_vocabulary.get(term)
+            if old_column is not None:
+                projection[column] = self.projection[old_column]
+        self.projection = projection
+
+        keep = np.ones(len(self), dtype=bool)
+        keep[np.asarray(removed_rows, dtype=np.int64)] = False
+        added = self.transform(added_matrix)
+        vectors = np.vstack([self.vectors_at(np.flatnonzero(keep)), added])
+        lists = np.concatenate([np.asarray(self.lists)[keep], self._nearest_lists(added)])
+        self._set_vectors(vectors)
+        self._set_lists(lists)
+
+    def transform(self, matrix):
+        """
+        Vectores densos normalizados (float32) de filas TF-IDF sobre el vocabulario del índice.
+        """
+        blocks = [
+            normalize(np.asarray(matrix[start:end] @ self.projection))
+            for start, end in self._blocks(matrix.shape[0])
+        ]
+        if not blocks:
+            return np.empty((0, self.projection.shape[1]), dtype=np.float32)
+        return np.vstack(blocks).astype(np.float32)
+
+    def vectors_at(self, rows):
+        """
+        Vectores (float32) de las filas indicadas, decuantizados si hace falta.
+        """
+        vectors = np.asarray(self.vectors[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors *= np.asarray(self.scales[rows])[:, None]
+        return vectors
+
+    def search(self, vector, n_probe=4):
+        """
+        Similitud de coseno entre el vector de la consulta y los documentos de
+        las n_probe listas más cercanas. Devuelve (filas ordenadas, puntajes).
+        """
+        if not len(self) or not np.any(vector):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        list_scores = self.centroids @ vector
+        probed = np.argsort(-list_scores, kind="stable")[:max(1, n_probe)]
+        rows = np.sort(np.concatenate([
+            self.list_rows[self.list_indptr[lst]:self.list_indptr[lst + 1]] for lst in probed]))
+        return rows.astype(np.int64), (self.vectors_at(rows) @ vector).astype(np.float64)
+
+    def similar(self, row, k=20, n_probe=4):
+        """
+        Los k documentos más cercanos (coseno) al de la fila indicada, sin
+        incluirlo. Devuelve (filas, similitudes) de mayor a menor.
+        """
+        rows, scores = self.search(self.vectors_at(np.array([row]))[0], n_probe)
+        other = rows != row
+        rows, scores = rows[other], scores[other]
+        order = np.lexsort((rows, -scores))[:k]
+        return rows[order], scores[order]
+
+    def _blocks(self, n_rows):
+        """
+        Rangos (inicio, fin) de como mucho batch_size filas.
+        """
+        return [(start, min(start + self.batch_size, n_rows))
+                for start in range(0, n_rows, self.batch_size)]
+
+    def _quantized(self, vectors):
+        """
+        Devuelve (vectores, escalas): cuantizados a int8 con una escala por
+        fila si se pidió; si no, los mismos vectores y None.
+        """
+        if not self.params["quantize"]:
+            return vectors, None
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def _set_vectors(self, vectors):
+        """
+        Guarda los vectores, cuantizados a int8 con una escala por fila si se pidió.
+        """
+        self.vectors, self.scales = self._quantized(vectors)
+
+    def _set_lists(self, lists):
+        self.lists = np.asarray(lists, dtype=np.int32)
+        self.list_rows = np.argsort(self.lists, kind="stable").astype(np.int64)
+        self.list_indptr = np.concatenate([
+            [0], np.cumsum(np.bincount(self.lists, minlength=len(self.centroids)))]).astype(np.int64)
+
+    def _nearest_lists(self, vectors):
+        if not len(vectors):
+            return np.empty(0, dtype=np.int32)
+        return np.argmax(vectors @ self.centroids.T, axis=1)
+
+    def save(self, path):
+        np.save(os.path.join(path, "dense_projection.npy"), self.projection)
+        np.save(os.path.join(path, "dense_vectors.npy"), self.vectors)
+        if self.scales is not None:
+            np.save(os.path.join(path, "dense_scales.npy"), self.scales)
+        np.save(os.path.join(path, "dense_centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "dense_lists.npy"), self.lists)
+        np.save(os.path.join(path, "dense_list_indptr.npy"), self.list_indptr)
+        np.save(os.path.join(path, "dense_list_rows.npy"), self.list_rows)
+        with open(os.path.join(path, "dense.json"), "w", encoding="utf-8") as file:
+            json.dump(self.params, file)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Carga el índice denso guardado como memoria mapeada; None si el índice no lo tiene.
+        """
+        params_path = os.path.join(path, "dense.json")
+        if not os.path.exists(params_path):
+            return None
+        with open(params_path, "r", encoding="utf-8") as file:
+            dense = cls(**json.load(file))
+
+        def load_array(name):
+            return np.load(os.path.join(path, f"dense_{name}.npy"), mmap_mode="r")
+
+        dense.projection = load_array("projection")
+        dense.vectors = load_array("vectors")
+        if dense.params["quantize"]:
+            dense.scales = load_array("scales")
+        dense.centroids = np.load(os.path.join(path, "dense_centroids.npy"))
+        dense.lists = load_array("lists")
+        dense.list_indptr = np.load(os.path.join(path, "dense_list_indptr.npy"))
+        dense.list_rows = load_array("list_rows")
+        return dense
@@ -1,11 +1,386 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import joblib
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+from classes.dense_index import DenseIndex
+from classes.document_registry import DocumentRegistry
+from classes.index_shard import IndexShard, shard_path
+from classes.inverted_index import InvertedIndex
+from classes.metrics import metrics
+from classes.neighbor_graph import NeighborGraph
+from classes.passage_index import PassageIndex
+from classes.scorers import SCORERS
+from functions.disk_arrays import batch_ranges, empty_array
+
+# Versión del formato del índice persistido. Cambiarla invalida los índices
+# guardados con una versión anterior y obliga a reconstruirlos.
+INDEX_VERSION = 13
 
 
 class DocumentIndexer:
     """ Clase que maneja la representación vectorial de los documentos y su búsqueda """
 
-    def __init__(self):
+    def __init__(self, index_path="./index"):
         self.vectorizer = TfidfVectorizer()
         self.document_matrix = None
-        self.documents = []
+        self.term_counts = None  # Frecuencias brutas, permiten actualizar el índice
+        self.document_frequency = None
+        self.inverted_index = None
+        self.scorers = {name: scorer() for name, scorer in SCORERS.items()}
+        self.registry = DocumentRegistry()
+        self.neighbors = NeighborGraph()
+        self.passages = PassageIndex()  # Posiciones de los términos, pasajes y páginas
+        self.dense = None  # Índice denso (LSA) opcional, lo construye la fachada
         self.documents_as_arrays = []
+        self.clusters = None
+        self.clustering = None  # Algoritmo de clustering ajustado
+        self.centroids = None  # Centroides TF-IDF de cada cluster (clusters x términos)
+        self._scorer_centroids = {}
+        self.index_path = index_path
+        self.signature = None
+        self.n_shards = 1  # Particiones que se guardan para la búsqueda en varios procesos
+        self.batch_tokens = 1 << 20  # Tokens (o elementos de la matriz) por lote al construir el índice
+        self.work_path = None  # Carpeta temporal con los arreglos de la construcción
+
+    @staticmethod
+    def corpus_signature(stamps, params=None):
+        """
+        Calcula una firma del corpus a partir de la clave y el sello (hash del
+        contenido en el almacén del corpus) de cada documento procesado y de
+        los parámetros del índice. Si la firma cambia, el índice guardado deja de ser válido.
+        """
+        digest = hashlib.sha1(str(INDEX_VERSION).encode("utf-8"))
+        for key in sorted(stamps):
+            digest.update(f"{key}:{stamps[key]}\n".encode("utf-8"))
+        digest.update(json.dumps(params or {}, sort_keys=True).encode("utf-8"))
+        return digest.hexdigest()
+
+    def build(self, term_counts, vocabulary, path=None):
+        """
+        Genera la matriz TF-IDF a partir de las frecuencias de términos de los
+        documentos (ya tokenizados en el almacén del corpus) y su vocabulario.
+        Con path, los pesos TF-IDF, los postings y los pesos de los algoritmos
+        se escriben en disco por bloques de filas.
+        """
+        with metrics.timer("indexer.vectorize"):
+            self.term_counts = term_counts.tocsr()
+            counts = self.term_counts
+            self.document_frequency = np.zeros(counts.shape[1], dtype=np.int64)
+            for start, end in self.row_batches(counts):
+                self.document_frequency += np.bincount(
+                    counts.indices[counts.indptr[start]:counts.indptr[end]], minlength=counts.shape[1])
+        metrics.count("indexer.documents", self.term_counts.shape[0])
+        self._reweight(vocabulary, path)
+        with metrics.timer("indexer.neighbors"):
+            self.neighbors.build(self.document_matrix, self.registry.ids, self.inverted_index)
+
+    def update(self, removed_rows, added_counts, added_vocabulary):
+        """
+        Actualiza el índice sin reconstruirlo: elimina las filas indicadas y
+        añade al final las frecuencias de los documentos nuevos (con su propio
+        vocabulario, que se incorpora al del índice). Las frecuencias de
+        documento se ajustan de forma incremental y los pesos TF-IDF resultantes
+        son los mismos que se obtendrían ajustando el vectorizador sobre todo el corpus.
+        """
+        vocabulary = dict(self.vectorizer.vocabulary_)
+        counts = self.term_counts
+        document_frequency = self.document_frequency.copy()
+
+        if len(removed_rows):
+            removed = counts[np.asarray(removed_rows)]
+            document_frequency -= np.bincount(
+                removed.indices, minlength=counts.shape[1])
+            keep = np.ones(counts.shape[0], dtype=bool)
+            keep[np.asarray(removed_rows)] = False
+            counts = counts[keep]
+
+        n_added = added_counts.shape[0]
+        if n_added:
+            # Llevar las columnas de los documentos nuevos al vocabulario del índice, ampliándolo
+            columns = np.empty(len(added_vocabulary), dtype=np.int64)
+            for term, column in added_vocabulary.items():
+                columns[column] = vocabulary.setdefault(term, len(vocabulary))
+            added = added_counts.tocoo()
+            added = csr_matrix(
+                (added.data.astype(counts.dtype), (added.row, columns[added.col])),
+                shape=(n_added, len(vocabulary)))
+            counts = csr_matrix(
+                (counts.data, counts.indices, counts.indptr),
+                shape=(counts.shape[0], len(vocabulary)))
+            counts = vstack([counts, added], format="csr")
+            document_frequency = np.concatenate([
+                document_frequency,
+                np.zeros(len(vocabulary) - len(document_frequency), dtype=document_frequency.dtype),
+            ]) + np.bincount(added.indices, minlength=len(vocabulary))
+
+        # Quitar los términos que ya no aparecen en ningún documento
+        used = document_frequency > 0
+        if not used.all():
+            terms = sorted(vocabulary, key=vocabulary.get)
+            counts = counts[:, np.flatnonzero(used)]
+            document_frequency = document_frequency[used]
+            vocabulary = {term: column for column, term in enumerate(
+                term for term, keep in zip(terms, used) if keep)}
+
+        self.term_counts = counts.tocsr()
+        self.document_frequency = document_frequency
+        self._reweight(vocabulary)
+
+        # Los documentos nuevos ocupan las últimas filas del registro
+        changed_ids = self.registry.ids[len(self.registry) - n_added:]
+        metrics.count("indexer.documents", n_added)
+        with metrics.timer("indexer.neighbors"):
+            self.neighbors.update(
+                self.document_matrix, self.registry.ids, changed_ids, self.inverted_index)
+
+    def _reweight(self, vocabulary, path=None):
+        """
+        Calcula el IDF suavizado a partir de las frecuencias de documento y
+        genera la matriz TF-IDF normalizada, igual que TfidfVectorizer. Con
+        path, la matriz, los postings y los pesos de los algoritmos se escriben en disco.
+        """
+        with metrics.timer("indexer.reweight"):
+            n_documents = self.term_counts.shape[0]
+            idf = np.log((1 + n_documents) / (1 + self.document_frequency)) + 1
+            self.vectorizer = TfidfVectorizer()
+            self.vectorizer.vocabulary_ = vocabulary
+            self.vectorizer.idf_ = idf
+            self.document_matrix = self._tfidf(idf, path)
+            self.inverted_index = InvertedIndex.from_matrix(
+                self.document_matrix, path, batch_tokens=self.batch_tokens)
+        with metrics.timer("indexer.scorers"):
+            self.fit_scorers(path)
+
+    def _tfidf(self, idf, path=None):
+        """
+        Matriz TF-IDF normalizada por filas. Tiene el mismo patrón que la matriz
+        de frecuencias (comparte sus indices e indptr), así que solo se calculan
+        los pesos, por bloques de filas con como mucho batch_tokens elementos;
+        con path se escriben en disco.
+        """
+        counts = self.term_counts
+        data = empty_array(counts.nnz, np.float64, path, "data")
+        for start, end in self.row_batches(counts):
+            begin, finish = counts.indptr[start], counts.indptr[end]
+            block = csr_matrix(
+                (counts.data[begin:finish] * idf[counts.indices[begin:finish]],
+                 counts.indices[begin:finish], counts.indptr[start:end + 1] - begin),
+                shape=(end - start, counts.shape[1]))
+            data[begin:finish] = normalize(block, copy=False).data
+        return csr_matrix((data, counts.indices, counts.indptr), shape=counts.shape, copy=False)
+
+    def create_work_path(self):
+        """
+        Crea una carpeta temporal, junto al índice, para los arreglos que la
+        construcción escribe en disco. Se borra al guardar el índice.
+        """
+        self.release_work_path()
+        parent = self.index_path + ".build"
+        os.makedirs(parent, exist_ok=True)
+        self.work_path = tempfile.mkdtemp(dir=parent)
+        return self.work_path
+
+    def release_work_path(self):
+        """
+        Borra la carpeta temporal de la construcción, si la hay.
+        """
+        if self.work_path is not None:
+            shutil.rmtree(self.work_path, ignore_errors=True)
+            self.work_path = None
+
+    def row_batches(self, matrix):
+        """
+        Rangos (inicio, fin) de filas de la matriz con como mucho batch_tokens elementos cada uno.
+        """
+        return list(batch_ranges(np.diff(matrix.indptr), self.batch_tokens))
+
+    def fit_scorers(self, path=None):
+        """
+        Precalcula los pesos de todos los algoritmos de puntuación (en disco si se indica path).
+        """
+        for scorer in self.scorers.values():
+            scorer.fit(self, path)
+
+    def get_scorer(self, name):
+        """
+        Devuelve el algoritmo de puntuación indicado ("tfidf", "bm25" o "bm25f").
+        """
+        if name not in self.scorers:
+            raise ValueError(f"Algoritmo de puntuación desconocido: {name}")
+        return self.scorers[name]
+
+    def title_counts(self):
+        """
+        Frecuencias de los términos de los títulos (ya lematizados en la tabla
+        de documentos) sobre el vocabulario del índice.
+        """
+        counter = CountVectorizer(vocabulary=self.vectorizer.vocabulary_)
+        n_documents = self.term_counts.shape[0]
+        titles = [record.get("title_text", "") for record in self.registry]
+        if len(titles) != n_documents:
+            titles = [""] * n_documents
+        return counter.transform(titles).tocsr()
+
+    def compute_centroids(self):
+        """
+        Calcula el centroide de cada cluster (media de sus vectores TF-IDF)
+        con un único producto disperso. Los documentos de ruido (-1) se ignoran.
+        """
+        self.centroids = (self._cluster_indicator() @ self.document_matrix).tocsr()
+        self._scorer_centroids = {}
+
+    def get_centroids(self, scorer):
+        """
+        Centroides de los clusters en el espacio de pesos del algoritmo de
+        puntuación: el producto con la consulta es el puntaje medio del cluster.
+        Los de TF-IDF se guardan con el índice; los demás se calculan una vez.
+        """
+        if scorer.name == "tfidf":
+            return self.centroids
+        if scorer.name not in self._scorer_centroids:
+            self._scorer_centroids[scorer.name] = (
+                self._cluster_indicator() @ scorer.weights).tocsr()
+        return self._scorer_centroids[scorer.name]
+
+    def _cluster_indicator(self):
+        """
+        Matriz dispersa clusters x documentos con 1 / tamaño del cluster en las
+        posiciones de sus documentos; multiplicada por una matriz de pesos da las medias.
+        """
+        labels = np.asarray(self.clusters)
+        in_cluster = np.flatnonzero(labels >= 0)
+        n_clusters = labels.max() + 1 if in_cluster.size else 0
+        sizes = np.bincount(labels[in_cluster], minlength=n_clusters)
+        return csr_matrix(
+            (1.0 / sizes[labels[in_cluster]], (labels[in_cluster], in_cluster)),
+            shape=(n_clusters, len(labels)))
+
+    def save(self):
+        """
+        Guarda el índice en disco: vectorizador (vocabulario e IDF), matriz CSR
+        por componentes, pesos de los algoritmos de puntuación, tabla de
+        vecinos más similares, índice posicional de pasajes, índice denso (si
+        está activado), modelo de clustering con sus etiquetas y centroides, el
+        registro de documentos y, con n_shards > 1, las particiones del índice
+        para la búsqueda en varios procesos.
+        Se escribe primero en una carpeta temporal para no dejar un índice a medias.
+        """
+        tmp_path = self.index_path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        joblib.dump(self.vectorizer, os.path.join(tmp_path, "vectorizer.joblib"))
+        matrix = self.document_matrix
+        np.save(os.path.join(tmp_path, "data.npy"), matrix.data)
+        np.save(os.path.join(tmp_path, "indices.npy"), matrix.indices)
+        np.save(os.path.join(tmp_path, "indptr.npy"), matrix.indptr)
+        np.save(os.path.join(tmp_path, "counts_data.npy"), self.term_counts.data)
+        np.save(os.path.join(tmp_path, "counts_indices.npy"), self.term_counts.indices)
+        np.save(os.path.join(tmp_path, "counts_indptr.npy"), self.term_counts.indptr)
+        np.save(os.path.join(tmp_path, "document_frequency.npy"), self.document_frequency)
+        np.save(os.path.join(tmp_path, "postings_indptr.npy"), self.inverted_index.indptr)
+        np.save(os.path.join(tmp_path, "postings_indices.npy"), self.inverted_index.indices)
+        np.save(os.path.join(tmp_path, "postings_data.npy"), self.inverted_index.data)
+        for scorer in self.scorers.values():
+            scorer.save(tmp_path)
+        self.neighbors.save(tmp_path)
+        self.passages.save(tmp_path)
+        if self.dense is not None:
+            self.dense.save(tmp_path)
+        clusters = self.clusters if self.clusters is not None else np.full(
+            matrix.shape[0], -1)
+        np.save(os.path.join(tmp_path, "clusters.npy"), np.asarray(clusters))
+        joblib.dump(self.clustering, os.path.join(tmp_path, "clustering.joblib"))
+        if self.centroids is not None:
+            np.save(os.path.join(tmp_path, "centroids_data.npy"), self.centroids.data)
+            np.save(os.path.join(tmp_path, "centroids_indices.npy"), self.centroids.indices)
+            np.save(os.path.join(tmp_path, "centroids_indptr.npy"), self.centroids.indptr)
+
+        if self.n_shards > 1:
+            for shard in range(self.n_shards):
+                IndexShard.from_indexer(self, shard, self.n_shards).save(
+                    shard_path(tmp_path, shard), self.signature)
+
+        with open(os.path.join(tmp_path, "documents.json"), "w", encoding="utf-8") as file:
+            json.dump(self.registry.to_dict(), file, ensure_ascii=False)
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump({
+                "version": INDEX_VERSION,
+                "signature": self.signature,
+                "shape": list(matrix.shape),
+                "passage_size": self.passages.passage_size,
+                "n_shards": self.n_shards,
+            }, file)
+
+        shutil.rmtree(self.index_path, ignore_errors=True)
+        os.replace(tmp_path, self.index_path)
+        if self.work_path is not None:
+            # Pasar a los arreglos guardados para poder borrar los de la construcción
+            self.load()
+            self.release_work_path()
+
+    def load(self):
+        """
+        Carga el índice guardado en disco. Los arreglos de la matriz se abren
+        como memoria mapeada, por lo que la carga no depende del tamaño del corpus.
+        Devuelve False si no existe un índice compatible.
+        """
+        meta_path = os.path.join(self.index_path, "meta.json")
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("version") != INDEX_VERSION:
+            return False
+
+        self.vectorizer = joblib.load(
+            os.path.join(self.index_path, "vectorizer.joblib"))
+        arrays = [
+            np.load(os.path.join(self.index_path, name), mmap_mode="r")
+            for name in ("data.npy", "indices.npy", "indptr.npy")
+        ]
+        self.document_matrix = csr_matrix(
+            tuple(arrays), shape=tuple(meta["shape"]), copy=False)
+        counts = [
+            np.load(os.path.join(self.index_path, name), mmap_mode="r")
+            for name in ("counts_data.npy", "counts_indices.npy", "counts_indptr.npy")
+        ]
+        self.term_counts = csr_matrix(
+            tuple(counts), shape=tuple(meta["shape"]), copy=False)
+        self.document_frequency = np.load(
+            os.path.join(self.index_path, "document_frequency.npy"))
+        postings = [
+            np.load(os.path.join(self.index_path, name), mmap_mode="r")
+            for name in ("postings_indptr.npy", "postings_indices.npy", "postings_data.npy")
+        ]
+        self.inverted_index = InvertedIndex(*postings, meta["shape"][0])
+        for scorer in self.scorers.values():
+            scorer.load(self.index_path, self)
+        self.neighbors.load(self.index_path)
+        self.passages.load(self.index_path, meta["passage_size"])
+        self.dense = DenseIndex.load(self.index_path)
+        self.clusters = np.load(
+            os.path.join(self.index_path, "clusters.npy"), mmap_mode="r")
+        self.clustering = joblib.load(
+            os.path.join(self.index_path, "clustering.joblib"))
+        self.centroids = None
+        self._scorer_centroids = {}
+        if os.path.exists(os.path.join(self.index_path, "centroids_data.npy")):
+            centroids = [
+                np.load(os.path.join(self.index_path, name), mmap_mode="r")
+                for name in ("centroids_data.npy", "centroids_indices.npy", "centroids_indptr.npy")
+            ]
+            self.centroids = csr_matrix(
+                tuple(centroids), shape=(len(centroids[2]) - 1, meta["shape"][1]), copy=False)
+        with open(os.path.join(self.index_path, "documents.json"), "r", encoding="utf-8") as file:
+            self.registry = DocumentRegistry.from_dict(json.load(file))
+        self.signature = meta["signature"]
+        self.n_shards = meta["n_shards"]
+        return True
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class DocumentRegistry:
+    """
+    Tabla central de documentos: id estable <-> PDF <-> documento procesado <-> fila
+    de la matriz. Todos los componentes identifican los documentos por su id
+    entero, de modo que las búsquedas en la tabla son operaciones O(1).
+    """
+
+    def __init__(self, records=None, next_id=0):
+        # Registros por fila de la matriz: id, clave, rutas, título, páginas...
+        self.records = []
+        self.next_id = next_id
+        self._rows = {}  # id -> fila
+        self._keys = {}  # clave (nombre sin extensión) -> id
+        self.ids = np.empty(0, dtype=np.int64)  # fila -> id
+        self.set_records(records or [])
+
+    def set_records(self, records):
+        """
+        Reemplaza la tabla. Los registros sin id reciben uno nuevo (o el que ya
+        tenía un documento con la misma clave); los ids nunca se reutilizan.
+        """
+        previous_keys = self._keys
+        self.records = []
+        self._rows = {}
+        self._keys = {}
+        for record in records:
+            if record.get("id") is None:
+                record["id"] = previous_keys.get(record["key"])
+                if record["id"] is None:
+                    record["id"] = self.next_id
+                    self.next_id += 1
+            self.next_id = max(self.next_id, record["id"] + 1)
+            self._rows[record["id"]] = len(self.records)
+            self._keys[record["key"]] = record["id"]
+            self.records.append(record)
+        self.ids = np.array([record["id"] for record in self.records], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._rows
+
+    def row(self, doc_id):
+        """
+        Fila de la matriz de un documento.
+        """
+        return self._rows[doc_id]
+
+    def record(self, doc_id):
+        """
+        Registro (rutas, título...) de un documento.
+        """
+        return self.records[self._rows[doc_id]]
+
+    def at_row(self, row):
+        """
+        Registro del documento de una fila de la matriz.
+        """
+        return self.records[row]
+
+    def id_for_key(self, key):
+        """
+        Id del documento con la clave indicada, o None si no está registrado.
+        """
+        return self._keys.get(key)
+
+    def to_dict(self):
+        return {"next_id": self.next_id, "documents": self.records}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["documents"], data["next_id"])
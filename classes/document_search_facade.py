@@ -1,98 +1,364 @@
 import os
 import re
-import streamlit as st
-from sklearn.cluster import DBSCAN
+import numpy as np
+from scipy.sparse import vstack
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from classes.clustering import CLUSTERINGS, DBSCANClustering, SVDKMeansClustering
+from classes.corpus_store import ANALYZER, CorpusStore, StoredDocuments
+from classes.dense_index import DenseIndex
 from classes.document_indexer import DocumentIndexer
+from classes.index_shard import ShardPool
+from classes.inverted_index import InvertedIndex
+from classes.lemma_table import LemmaTable
+from classes.metadata_store import MetadataStore
+from classes.metrics import metrics
 from classes.pdf_processor import PDFProcessor
+from classes.query_cache import QueryCache
 from functions import process_text
 
+# Caracteres del comienzo del texto procesado que se guardan con cada documento
+# para mostrarlos en los resultados sin reconstruir su texto completo
+PREVIEW_LENGTH = 300
+
+# Modos de búsqueda de search_documents y search_many
+SEARCH_MODES = ("cosine", "inverted", "passage", "dense", "hybrid")
+
 
 class DocumentSearchFacade:
     """ Fachada que centraliza la extracción, preprocesamiento, indexación y búsqueda """
 
-    def __init__(self):
-        self.processor = PDFProcessor()
-        self.indexer = DocumentIndexer()
+    def __init__(self, index_path="./index", processor=None, caches=None):
+        # El procesador (y su modelo de spaCy) puede compartirse entre fachadas
+        self.processor = processor or PDFProcessor()
+        # Cachés de consultas: texto normalizado -> lemas, lemas -> vector y
+        # parámetros de la búsqueda -> resultados. Se indexan por la versión del
+        # índice (la tabla de lemas se carga con él), así que una reindexación
+        # las invalida; pueden compartirse entre fachadas sucesivas del mismo proceso
+        self.caches = caches or {
+            "lemmas": QueryCache(max_size=4096),
+            "vectors": QueryCache(max_size=1024),
+            "results": QueryCache(max_size=1024, ttl=600),
+        }
+        self.indexer = DocumentIndexer(index_path)
+        self.store = None  # Almacén del corpus procesado (ids de términos)
         self.processed_documents = []
         self.clusters = None  # Para almacenar los clusters
         self.clusters_scores = []
         self.pdf_files = []
         self.pdf_titles = {}
+        self.clustered_documents = {}
+        self.clustered_pdfs = {}
+        self.clustered_ids = {}
+        self.metadata = None
+        # Tabla forma -> lema de la ingesta para lematizar las consultas sin spaCy
+        self.lemma_table = LemmaTable(None)
         
+        self.clustering = DBSCANClustering.name  # "dbscan" o "svd_kmeans"
         self.eps = 0.816 # Radio de vecindad para DBSCAN
         self.min_samples = 2  # Número mínimo de puntos para formar un cluster
+        self.n_clusters = 8  # Número de clusters para SVD + MiniBatchKMeans
+        self.n_components = 100  # Dimensiones de la reducción TruncatedSVD
+        self.dense_components = 100  # Dimensiones del índice denso (LSA); 0 lo desactiva
+        self.dense_quantize = False  # Guardar los vectores densos en int8
+        self.dense_probe = 4  # Listas del índice denso exploradas por consulta
+        self.hybrid_weight = 0.5  # Peso de la puntuación dispersa en mode="hybrid"
+        # Particiones del índice; con más de una, cada partición se busca en su propio proceso
+        self.n_shards = 1
+        self.shards = None  # Procesos de búsqueda de las particiones (ShardPool)
+        # Consultas puntuadas juntas en search_many: acota la matriz densa de puntajes
+        self.query_block_size = 128
    
-        
-    def add_documents(self, processed_folder_path="./processed_files"):
+    def load_index(self, processed_folder_path="./processed_files"):
         """
-        Obtiene todos los archivos .txt de la carpeta processed_files,
-        lee su contenido y generan una matriz de representación numérica
-        de los documentos mediante TF-IDF.
+        Carga el índice persistido si corresponde al corpus actual de
+        processed_files; en caso contrario lo actualiza solo con los documentos
+        que cambiaron (o lo construye si no existe), vuelve a generar los
+        clusters y lo guarda en disco para las siguientes búsquedas.
+        Devuelve True si el índice se reconstruyó.
         """
-        # Lista para almacenar el contenido de los documentos procesados
-        self.processed_documents = []
+        self.store = self._open_store(processed_folder_path)
+        self.metadata = MetadataStore(
+            os.path.join(processed_folder_path, "metadata.json"))
+        self.lemma_table = LemmaTable(os.path.join(processed_folder_path, "lemmas.json"))
+        signature = self._signature(self.store)
+
+        with metrics.timer("index.load"):
+            loaded = self.indexer.load()
+        if loaded and self.indexer.signature == signature:
+            with metrics.timer("index.load_documents"):
+                self._load_documents()
+                self.clusters = self.indexer.clusters
+                self._group_clusters()
+            self._start_shards()
+            return False
+
+        if loaded:
+            # Solo se vectorizan los documentos nuevos o modificados y, si el
+            # algoritmo lo permite, solo esos documentos se asignan a un cluster
+            previous_labels = dict(zip(
+                self.indexer.registry.ids.tolist(), np.asarray(self.indexer.clusters).tolist()))
+            with metrics.timer("index.update"):
+                changed_ids = self.update_documents()
+            with metrics.timer("index.cluster"):
+                self.perform_clustering(previous_labels, changed_ids)
+        else:
+            with metrics.timer("index.build"):
+                self.add_documents(processed_folder_path)
+            with metrics.timer("index.cluster"):
+                self.perform_clustering()
+        self.indexer.signature = signature
+        self.indexer.n_shards = self.n_shards
+        with metrics.timer("index.save"):
+            self.indexer.save()
+        self._start_shards()
+        return True
+
+    def _start_shards(self):
+        """
+        Arranca un proceso de búsqueda por partición del índice guardado si
+        n_shards es mayor que 1.
+        """
+        self.close()
+        if self.n_shards > 1:
+            with metrics.timer("index.start_shards"):
+                self.shards = ShardPool(self.indexer.index_path, self.n_shards)
+
+    def close(self):
+        """
+        Detiene los procesos de búsqueda de las particiones, si los hay, y
+        borra los arreglos temporales de una construcción sin guardar.
+        """
+        if self.shards is not None:
+            self.shards.close()
+            self.shards = None
+        self.indexer.release_work_path()
+
+    def is_current(self, processed_folder_path="./processed_files"):
+        """
+        Indica si el índice cargado corresponde al corpus actual de
+        processed_files y a la configuración de clustering.
+        """
+        return (self.indexer.signature is not None and self.indexer.signature
+                == self._signature(self._open_store(processed_folder_path)))
+
+    @staticmethod
+    def _open_store(processed_folder_path):
+        """
+        Abre el almacén del corpus de processed_files, importando los .txt del
+        formato anterior la primera vez.
+        """
+        return CorpusStore.open(
+            os.path.join(processed_folder_path, "corpus"), processed_folder_path)
+
+    def _signature(self, store):
+        return DocumentIndexer.corpus_signature(
+            {key: store.stamp(key) for key in store.keys()},
+            {"clustering": self.clustering, **self._clustering_backend().params,
+             "dense_components": self.dense_components, "dense_quantize": self.dense_quantize,
+             "n_shards": self.n_shards})
 
-        # Obtener todos los archivos .txt de la carpeta processed_files
-        txt_files = [os.path.join(processed_folder_path, file) for file in os.listdir(
-            processed_folder_path) if file.endswith(".txt")]
+    def update_documents(self):
+        """
+        Actualiza el índice cargado con los cambios del almacén del corpus:
+        elimina las filas de los documentos borrados o modificados y añade
+        los documentos nuevos o modificados, sin volver a leer el resto.
+        """
+        store = self.store
+        removed_rows = []
+        kept_documents = []
+        for row, record in enumerate(self.indexer.registry):
+            if record["key"] in store and store.stamp(record["key"]) == record["stamp"]:
+                kept_documents.append(record)
+            else:
+                removed_rows.append(row)
+
+        known_keys = {record["key"] for record in kept_documents}
+        new_keys = [key for key in store.keys() if key not in known_keys]
+        if not kept_documents and not new_keys:
+            raise ValueError(
+                "No se encontraron documentos procesados para indexar.")
+
+        # El registro se actualiza antes que la matriz porque BM25F usa los títulos.
+        # Los documentos modificados conservan su id.
+        self.indexer.registry.set_records(kept_documents + self._document_entries(new_keys))
+        old_vocabulary = self.indexer.vectorizer.vocabulary_
+        self.indexer.update(removed_rows, *store.counts(new_keys))
+        self._index_passages()
+        self._index_dense(removed_rows, len(new_keys), old_vocabulary)
+        self._load_documents()
+
+        # Ids de los documentos nuevos o modificados (últimas filas del registro)
+        return self.indexer.registry.ids[len(kept_documents):].tolist()
+
+    def _document_entries(self, keys):
+        """
+        Crea los registros de los documentos procesados: clave (nombre sin extensión),
+        PDF de origen, título (y título lematizado, todos en una sola llamada a
+        nlp.pipe), número de páginas, vista previa (comienzo del texto
+        procesado) y sello (hash del contenido en el almacén del corpus). Los
+        metadatos se toman del almacén generado en la ingesta; solo se abre el
+        PDF si no están disponibles. El id entero lo asigna el registro de documentos.
+        """
+        entries = []
+        for key in keys:
+            pdf_file = os.path.join(
+                process_text.folder_path, key + ".pdf").replace("\\", "/")
+            metadata = self.metadata.get(key) if self.metadata else None
+            if metadata is None:
+                metadata = (self.processor.extract_metadata(pdf_file) if os.path.exists(pdf_file)
+                            else {"title": "Título no disponible", "pages": 0})
+            entries.append({"key": key, "pdf": pdf_file, "title": metadata["title"],
+                            "pages": metadata.get("pages", 0),
+                            "preview": self.store.preview(key, PREVIEW_LENGTH),
+                            "stamp": self.store.stamp(key)})
+        titles = self.processor.preprocess_texts([entry["title"] for entry in entries])
+        for entry, title_text in zip(entries, titles):
+            entry["title_text"] = title_text
+        return entries
+
+    def _load_documents(self):
+        """
+        Asocia los textos procesados (leídos del almacén solo al usarlos) y las
+        rutas de los PDFs según el registro de documentos del índice.
+        """
+        self.processed_documents = StoredDocuments(
+            self.store, [record["key"] for record in self.indexer.registry])
+        self.pdf_files = [record["pdf"] for record in self.indexer.registry]
 
-        # Leer el contenido de cada archivo .txt
-        for txt_file in txt_files:
-            with open(txt_file, "r", encoding="utf-8") as file:
-                # Leer el contenido del archivo como cadena
-                processed_text = file.read()
-                # Agregar el texto procesado (cadena) a la lista de documentos procesados
-                self.processed_documents.append(processed_text)
+    def add_documents(self, processed_folder_path="./processed_files"):
+        """
+        Indexa todos los documentos del almacén del corpus de processed_files:
+        genera la matriz TF-IDF directamente a partir de los ids de términos
+        guardados, sin volver a tokenizar los textos. El almacén se recorre por
+        lotes y las matrices y el índice posicional se escriben en disco a
+        medida que se construyen, así que ni los textos ni los ids de todo el
+        corpus están en memoria a la vez.
+        """
+        self.store = self._open_store(processed_folder_path)
+        self.metadata = MetadataStore(
+            os.path.join(processed_folder_path, "metadata.json"))
 
+        keys = self.store.keys()
         # Verificar si hay documentos procesados
-        if not self.processed_documents:
+        if not keys:
             raise ValueError(
                 "No se encontraron documentos procesados para indexar.")
 
-        # Ajustar el vectorizador TF-IDF con los documentos procesados
-        self.indexer.vectorizer.fit(self.processed_documents)
+        # Registro de documentos: id <-> fila de la matriz <-> documento procesado, PDF y título
+        self.indexer.registry.set_records(self._document_entries(keys))
+        self._load_documents()
 
-        # Crear la matriz de documentos
-        self.indexer.document_matrix = self.indexer.vectorizer.transform(
-            self.processed_documents)
+        # Crear la matriz de documentos a partir de las frecuencias del almacén
+        work_path = self.indexer.create_work_path()
+        self.indexer.build(
+            *self.store.counts(keys, work_path, self.indexer.batch_tokens), path=work_path)
+        self._index_passages(work_path)
+        self._index_dense(path=work_path)
 
-        # Guardar el vectorizador y la matriz en el estado de la sesión
-        st.session_state["vectorizer"] = self.indexer.vectorizer
-        st.session_state["document_matrix"] = self.indexer.document_matrix
-        st.session_state["processed_documents"] = self.processed_documents
+    def _index_passages(self, path=None):
+        """
+        Construye el índice posicional de pasajes a partir de los ids de
+        términos del almacén (sin leer los textos). Tras una actualización
+        incremental se vuelve a construir completo: solo ordena las posiciones.
+        Con path, las posiciones se escriben en disco.
+        """
+        keys = [record["key"] for record in self.indexer.registry]
+        vocabulary = self.indexer.vectorizer.vocabulary_
+        with metrics.timer("indexer.passages"):
+            self.indexer.passages.build(
+                [self.store.token_ids(key) for key in keys], self.store.columns(vocabulary),
+                len(vocabulary), [self.store.pages(key) for key in keys],
+                path, self.indexer.batch_tokens)
 
-    def perform_clustering(self):
+    def _index_dense(self, removed_rows=None, n_added=0, old_vocabulary=None, path=None):
         """
-        Realiza clustering de los documentos indexados usando DBSCAN.
+        Construye el índice denso (LSA) si está activado. Tras una actualización
+        incremental, si el índice guardado tiene los mismos parámetros, solo se
+        proyectan los documentos nuevos con la SVD ya ajustada; se vuelve a
+        ajustar si cambia más de la mitad del corpus. Con path, los vectores se
+        escriben en disco.
+        """
+        if not self.dense_components:
+            self.indexer.dense = None
+            return
+        matrix = self.indexer.document_matrix
+        dense = DenseIndex(self.dense_components, self.dense_quantize)
+        fitted = self.indexer.dense
+        with metrics.timer("indexer.dense"):
+            if (old_vocabulary is not None and fitted is not None and fitted.params == dense.params
+                    and n_added + len(removed_rows) <= matrix.shape[0] // 2):
+                fitted.update(removed_rows, matrix[matrix.shape[0] - n_added:],
+                              old_vocabulary, self.indexer.vectorizer.vocabulary_)
+            else:
+                dense.build(matrix, path)
+                self.indexer.dense = dense
+
+    def _clustering_backend(self):
+        """
+        Crea el algoritmo de clustering configurado con sus parámetros.
+        """
+        if self.clustering == SVDKMeansClustering.name:
+            return SVDKMeansClustering(
+                n_clusters=self.n_clusters, n_components=self.n_components)
+        if self.clustering not in CLUSTERINGS:
+            raise ValueError(f"Algoritmo de clustering desconocido: {self.clustering}")
+        return DBSCANClustering(eps=self.eps, min_samples=self.min_samples)
+
+    def perform_clustering(self, previous_labels=None, changed_ids=None):
+        """
+        Realiza clustering de los documentos indexados con el algoritmo
+        configurado (DBSCAN o SVD + MiniBatchKMeans).
+        Si se pasan las etiquetas anteriores (id -> cluster) y el modelo guardado
+        permite asignar documentos, solo los documentos de changed_ids se asignan
+        a los clusters existentes, sin volver a ajustar el modelo.
         """
         if not self.processed_documents:
             raise ValueError(
                 "No hay documentos procesados para realizar clustering.")
 
         tfidf_matrix = self.indexer.document_matrix
-        
-        self.pdf_files = process_text.get_pdf_files()
+        vocabulary = self.indexer.vectorizer.vocabulary_
+        backend = self._clustering_backend()
+        fitted = self.indexer.clustering
+
+        if (previous_labels is not None and fitted is not None and fitted.incremental
+                and fitted.name == backend.name and fitted.params == backend.params):
+            ids = self.indexer.registry.ids
+            changed_rows = np.flatnonzero(np.isin(ids, changed_ids or []))
+            self.clusters = np.array(
+                [previous_labels.get(doc_id, -1) for doc_id in ids.tolist()], dtype=np.int64)
+            if len(changed_rows):
+                self.clusters[changed_rows] = fitted.assign(
+                    tfidf_matrix[changed_rows], vocabulary)
+        else:
+            # Configurar y ajustar el algoritmo de clustering
+            self.clusters = np.asarray(backend.fit_predict(tfidf_matrix, vocabulary))
+            self.indexer.clustering = backend
+        self.indexer.clusters = self.clusters
+        self.indexer.compute_centroids()
 
-        # Configurar y ajustar DBSCAN
-        dbscan = DBSCAN(
-            eps=self.eps, min_samples=self.min_samples, metric="cosine")
-        self.clusters = dbscan.fit_predict(tfidf_matrix)
+        self._group_clusters()
 
-        # Asociar documentos a clusters
+    def _group_clusters(self):
+        """
+        Asocia las filas de los documentos, sus PDFs, títulos e ids a su cluster
+        a partir de las etiquetas.
+        """
         self.clustered_documents = {}
         self.clustered_pdfs = {}
+        self.clustered_ids = {}
         self.pdf_titles = {}
         null_docs = 0
         for idx, cluster_id in enumerate(self.clusters):
+            cluster_id = int(cluster_id)
             if cluster_id == -1:
                 null_docs += 1  # Contar documentos de ruido
-                # Ignorar puntos etiquetados como ruidodocument_vectors
+                # Ignorar puntos etiquetados como ruido
                 continue
             if cluster_id not in self.clustered_documents:
                 self.clustered_documents[cluster_id] = []
-            self.clustered_documents[cluster_id].append(
-                self.processed_documents[idx])
+            self.clustered_documents[cluster_id].append(idx)
             if cluster_id not in self.clustered_pdfs:
                 self.clustered_pdfs[cluster_id] = []
             self.clustered_pdfs[cluster_id].append(
@@ -100,96 +366,479 @@ class DocumentSearchFacade:
             if cluster_id not in self.pdf_titles:
                 self.pdf_titles[cluster_id] = []
             self.pdf_titles[cluster_id].append(
-               self.processor.extract_title(self.pdf_files[idx]))
-        
-        # Guardar los clusters en el estado de la sesión
-        st.session_state["clusters"] = self.clusters
-        st.session_state["clustered_documents"] = self.clustered_documents
+                self.indexer.registry.at_row(idx)["title"])
+            if cluster_id not in self.clustered_ids:
+                self.clustered_ids[cluster_id] = []
+            self.clustered_ids[cluster_id].append(
+                int(self.indexer.registry.ids[idx]))
 
-    def search_documents(self, query, threshold=0.009):
+    def search_documents(self, query, threshold=0.009, mode="cosine", k=None, scorer="tfidf", n_probe=1):
         """
         Realiza una búsqueda en los documentos más relevantes basados en clustering.
+        La consulta se dirige a los clusters con mayor puntaje medio, calculado
+        con un producto contra los centroides de los clusters.
+        n_probe indica cuántos clusters se exploran (1 = solo el mejor); más
+        clusters mejoran la cobertura a costa de puntuar más documentos.
+        mode="cosine" puntúa todos los documentos de los clusters elegidos;
+        mode="inverted" usa el índice invertido y solo recorre los documentos que
+        comparten términos con la consulta, con los mismos resultados.
+        mode="passage" puntúa cada documento por su mejor pasaje (índice posicional).
+        mode="dense" usa el índice semántico (LSA) y encuentra documentos
+        relacionados aunque no compartan lemas con la consulta; mode="hybrid"
+        combina sus puntajes con los del algoritmo de puntuación (índice invertido).
+        Las frases entre comillas ("red neuronal") deben aparecer completas y
+        en orden en los documentos devueltos.
+        k limita el número de resultados devueltos.
+        scorer elige el algoritmo de puntuación: "tfidf" (coseno), "bm25" o "bm25f".
         """
+        self._check_mode(mode)
+        scorer = self.indexer.get_scorer(scorer)
+        version = self.indexer.signature
+        query = self.normalize_query(query)
+
+        # Reutilizar los resultados de una búsqueda idéntica sobre la misma versión del índice
+        results_key = (version, query, threshold, mode, k, scorer.name, n_probe)
+        cached = self.caches["results"].get(results_key)
+        metrics.count("search.queries")
+        if cached is not None:
+            metrics.count("search.results_cache_hits")
+            results, clusters_scores = cached
+            self.clusters_scores = dict(clusters_scores)
+            return list(results)
+
         # Preprocesar la consulta
-        query = self.processor.preprocess_text(query)
+        with metrics.timer("search.preprocess"):
+            lemmas = self._lemmatize(query)
+            phrases = self._phrases(query)
         # Vectorizar la consulta
-        query_vector = self.indexer.vectorizer.transform([query])
-        similarities = cosine_similarity(
-            query_vector, self.indexer.document_matrix).flatten()
-        
-        # Calcular el puntaje acumulado por cluster
-        cluster_scores = {i: 0 for i in self.clustered_documents.keys()}
-        cluster_counts = {i: 0 for i in self.clustered_documents.keys()} 
-        for idx, cluster_id in enumerate(self.clusters):
-            if cluster_id != -1:  # Ignorar puntos de ruido
-                cluster_scores[cluster_id] += similarities[idx]
-                cluster_counts[cluster_id] += 1 # Contar documentos en cada cluster
-                
-        for cluster_id in cluster_scores.keys():
-            if cluster_counts[cluster_id] > 0:  # Evitar división por cero
-                cluster_scores[cluster_id] /= cluster_counts[cluster_id]
-                
+        with metrics.timer("search.vectorize"):
+            vector_key = (version, scorer.name, lemmas)
+            query_vector = self.caches["vectors"].get(vector_key)
+            if query_vector is None:
+                query_vector = scorer.query_vector(self.indexer, lemmas)
+                self.caches["vectors"].put(vector_key, query_vector)
+
+        # Seleccionar los clusters más relevantes
+        with metrics.timer("search.route"):
+            probed = self._route(query_vector, scorer, n_probe)
+
+        with metrics.timer("search.score"):
+            # Con frases, el corte en k se hace después de filtrarlas
+            rows, scores = self._score(
+                query_vector, scorer, mode, probed, threshold, None if phrases else k)
+        metrics.count("search.docs_scanned", len(rows))
+
+        results = self._rank(rows, scores, phrases, threshold, k)
+        self.caches["results"].put(results_key, (results, dict(self.clusters_scores)))
+        return list(results)
+
+    def search_many(self, queries, threshold=0.009, mode="cosine", k=None, scorer="tfidf", n_probe=1):
+        """
+        Busca varias consultas con los mismos parámetros y devuelve la lista de
+        resultados de cada una, idénticos a llamar a search_documents por
+        separado pero con mucho más rendimiento: las consultas se lematizan
+        juntas (una sola llamada a nlp.pipe), se vectorizan en una única matriz
+        dispersa y, con mode="cosine", se puntúan contra todos los documentos
+        con un producto disperso por bloque de query_block_size consultas.
+        Al terminar, clusters_scores tiene los puntajes de la última consulta.
+        """
+        self._check_mode(mode)
+        scorer = self.indexer.get_scorer(scorer)
+        version = self.indexer.signature
+        queries = [self.normalize_query(query) for query in queries]
+        metrics.count("search.queries", len(queries))
+
+        # Resultados ya en caché; las consultas repetidas se buscan una vez
+        searched, pending = {}, []
+        for query in dict.fromkeys(queries):
+            cached = self.caches["results"].get(
+                (version, query, threshold, mode, k, scorer.name, n_probe))
+            if cached is None:
+                pending.append(query)
+            else:
+                metrics.count("search.results_cache_hits")
+                searched[query] = cached
+
+        if pending:
+            with metrics.timer("search.preprocess"):
+                # Las frases se lematizan en el mismo lote que las consultas
+                phrase_texts = [text for query in pending for text in re.findall(r'"([^"]+)"', query)]
+                lemmas = self._lemmatize_many(pending + phrase_texts)[:len(pending)]
+                phrases = [self._phrases(query) for query in pending]
+            with metrics.timer("search.vectorize"):
+                query_vectors = self._query_vectors(scorer, version, lemmas)
+            with metrics.timer("search.route"):
+                routes = self._route_many(query_vectors, scorer, n_probe)
+
+            labels = np.asarray(self.clusters)
+            # Con particiones, cada consulta se reparte entre sus procesos
+            blocked = mode == "cosine" and self.shards is None
+            for start in range(0, len(pending), self.query_block_size):
+                block = query_vectors[start:start + self.query_block_size]
+                with metrics.timer("search.score"):
+                    if blocked:
+                        # Puntajes de todas las consultas del bloque contra todos los documentos
+                        if scorer.name == "tfidf":
+                            block_scores = cosine_similarity(block, self.indexer.document_matrix)
+                        else:
+                            block_scores = np.asarray((scorer.weights @ block.T).todense()).T
+                for offset in range(block.shape[0]):
+                    index = start + offset
+                    probed, clusters_scores = routes[index]
+                    with metrics.timer("search.score"):
+                        if blocked:
+                            rows = np.flatnonzero(np.isin(labels, probed))
+                            scores = block_scores[offset, rows]
+                        else:
+                            rows, scores = self._score(
+                                block[offset], scorer, mode, probed, threshold,
+                                None if phrases[index] else k)
+                    metrics.count("search.docs_scanned", len(rows))
+                    results = self._rank(rows, scores, phrases[index], threshold, k)
+                    searched[pending[index]] = (results, clusters_scores)
+                    self.caches["results"].put(
+                        (version, pending[index], threshold, mode, k, scorer.name, n_probe),
+                        (results, dict(clusters_scores)))
+
+        if queries:
+            self.clusters_scores = dict(searched[queries[-1]][1])
+        return [list(searched[query][0]) for query in queries]
+
+    @staticmethod
+    def _check_mode(mode):
+        """
+        Comprueba que el modo de búsqueda sea uno de SEARCH_MODES.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Modo de búsqueda desconocido: {mode}")
+
+    def _rank(self, rows, scores, phrases, threshold, k):
+        """
+        Filtra los documentos candidatos por frases y umbral, los ordena y
+        devuelve los resultados (vista previa del texto, puntaje, PDF, título,
+        id). La vista previa se guarda en el registro al indexar, así que el
+        coste no depende de la longitud de los documentos devueltos.
+        """
+        if phrases:
+            # Conservar solo los documentos que contienen todas las frases
+            with metrics.timer("search.phrases"):
+                matched = np.isin(rows, self._phrase_rows(phrases))
+                rows, scores = rows[matched], scores[matched]
+
+        # Filtrar resultados por umbral y ordenar
+        with metrics.timer("search.rank"):
+            selected = scores >= threshold
+            rows, scores = InvertedIndex.top_k(rows[selected], scores[selected], k)
+
+            registry = self.indexer.registry
+            return [
+                (registry.at_row(row)["preview"], score, self.pdf_files[row],
+                 registry.at_row(row)["title"], int(registry.ids[row]))
+                for row, score in zip(rows, scores)
+            ]
+
+    def _score(self, query_vector, scorer, mode, probed, threshold, k=None):
+        """
+        Puntúa los documentos de los clusters elegidos (probed) y devuelve
+        (filas, puntajes) de los documentos candidatos. Con particiones, los
+        modos "cosine" e "inverted" se reparten entre sus procesos, que
+        devuelven solo sus k mejores documentos; los demás modos usan
+        estadísticas de toda la consulta y se puntúan en este proceso.
+        """
+        if self.shards is not None and mode in ("cosine", "inverted"):
+            return self.shards.score(query_vector, scorer.name, mode, probed, threshold, k)
+        labels = np.asarray(self.clusters)
+        if mode in ("inverted", "passage", "dense", "hybrid"):
+            # Documentos tocados por la consulta dentro de los clusters elegidos
+            if mode == "inverted":
+                rows, scores = scorer.inverted_index.score(query_vector)
+            elif mode == "passage":
+                terms = np.unique(query_vector.tocsr().indices)
+                rows, scores = self.indexer.passages.document_scores(
+                    terms, self.indexer.vectorizer.idf_[terms])
+            elif mode == "dense":
+                rows, scores = self._dense_scores(query_vector, scorer)
+            else:
+                rows, scores = self._hybrid_scores(query_vector, scorer)
+            in_probed = np.isin(labels[rows], probed)
+            rows, scores = rows[in_probed], scores[in_probed]
+            if threshold <= 0 and mode in ("inverted", "passage"):
+                # Los documentos sin términos en común también cumplen el umbral
+                missing = np.setdiff1d(np.flatnonzero(np.isin(labels, probed)), rows)
+                rows = np.concatenate([rows, missing])
+                scores = np.concatenate([scores, np.zeros(len(missing))])
+        else:
+            rows = np.flatnonzero(np.isin(labels, probed))
+            if scorer.name == "tfidf":
+                # Calcular similitud de coseno dentro de los clusters
+                scores = cosine_similarity(
+                    query_vector, self.indexer.document_matrix[rows]).flatten()
+            else:
+                scores = np.asarray(
+                    (scorer.weights[rows] @ query_vector.T).todense()).ravel()
+        return rows, scores
+
+    def _dense_index(self):
+        if self.indexer.dense is None:
+            raise ValueError("El índice denso está desactivado (dense_components=0).")
+        return self.indexer.dense
+
+    def _dense_scores(self, query_vector, scorer):
+        """
+        Similitud de coseno en el espacio LSA entre la consulta y los documentos
+        de las listas más cercanas del índice denso. La consulta se proyecta
+        desde su vector TF-IDF, sea cual sea el algoritmo de puntuación.
+        """
+        dense = self._dense_index()
+        if scorer.name != "tfidf":
+            # Los demás algoritmos vectorizan la consulta con sus frecuencias
+            query_vector = normalize(query_vector.multiply(self.indexer.vectorizer.idf_).tocsr())
+        return dense.search(dense.transform(query_vector)[0], self.dense_probe)
+
+    def _hybrid_scores(self, query_vector, scorer):
+        """
+        Combina los puntajes del índice invertido y del índice denso, cada uno
+        dividido por su máximo para que sean comparables: hybrid_weight * disperso
+        + (1 - hybrid_weight) * denso. Los puntajes densos negativos cuentan como 0.
+        """
+        sparse_rows, sparse_scores = scorer.inverted_index.score(query_vector)
+        dense_rows, dense_scores = self._dense_scores(query_vector, scorer)
+        rows = np.union1d(sparse_rows, dense_rows)
+        scores = np.zeros(len(rows))
+        for part_rows, part_scores, weight in (
+                (sparse_rows, sparse_scores, self.hybrid_weight),
+                (dense_rows, np.maximum(dense_scores, 0), 1 - self.hybrid_weight)):
+            if len(part_scores) and part_scores.max() > 0:
+                scores[np.searchsorted(rows, part_rows)] += weight * part_scores / part_scores.max()
+        return rows, scores
+
+    def _lemmatize(self, text):
+        """
+        Lemas de un texto de consulta normalizado, con caché por versión del
+        índice: otra versión puede venir con otra tabla de lemas.
+        """
+        key = (self.indexer.signature, text)
+        lemmas = self.caches["lemmas"].get(key)
+        if lemmas is None:
+            lemmas = self.lemma_table.lemmatize(text, self.processor)
+            self.caches["lemmas"].put(key, lemmas)
+        return lemmas
+
+    def _lemmatize_many(self, texts):
+        """
+        Lemas de varios textos de consulta normalizados; los que no están en la
+        caché se lematizan juntos.
+        """
+        version = self.indexer.signature
+        lemmas = [self.caches["lemmas"].get((version, text)) for text in texts]
+        missing = list(dict.fromkeys(text for text, lemma in zip(texts, lemmas) if lemma is None))
+        if missing:
+            computed = dict(zip(missing, self.lemma_table.lemmatize_many(missing, self.processor)))
+            for text, lemma in computed.items():
+                self.caches["lemmas"].put((version, text), lemma)
+            lemmas = [computed[text] if lemma is None else lemma for text, lemma in zip(texts, lemmas)]
+        return lemmas
+
+    def _query_vectors(self, scorer, version, lemmas):
+        """
+        Matriz dispersa con el vector de cada consulta (una fila por consulta),
+        con caché; los vectores que faltan se calculan en una sola llamada.
+        """
+        vectors = [self.caches["vectors"].get((version, scorer.name, text)) for text in lemmas]
+        missing = list(dict.fromkeys(text for text, vector in zip(lemmas, vectors) if vector is None))
+        if missing:
+            matrix = scorer.query_matrix(self.indexer, missing)
+            computed = {text: matrix[row] for row, text in enumerate(missing)}
+            for text, vector in computed.items():
+                self.caches["vectors"].put((version, scorer.name, text), vector)
+            vectors = [computed[text] if vector is None else vector
+                       for text, vector in zip(lemmas, vectors)]
+        return vstack(vectors, format="csr")
+
+    def _query_terms(self, lemmas):
+        """
+        Columnas del vocabulario del índice de los términos de la consulta, en
+        orden; None en los términos que no están en el índice.
+        """
+        vocabulary = self.indexer.vectorizer.vocabulary_
+        return [vocabulary.get(term) for term in ANALYZER(lemmas)]
+
+    def _phrases(self, query):
+        """
+        Frases entre comillas de la consulta, cada una como lista de columnas del vocabulario.
+        """
+        phrases = [self._query_terms(self._lemmatize(phrase))
+                   for phrase in re.findall(r'"([^"]+)"', query)]
+        return [terms for terms in phrases if terms]
+
+    def _phrase_rows(self, phrases, rows=None):
+        """
+        Filas de los documentos que contienen todas las frases.
+        """
+        for terms in phrases:
+            if None in terms:
+                # Un término que no está en el índice: la frase no aparece en ningún documento
+                return np.empty(0, dtype=np.int64)
+            rows = np.unique(self.indexer.passages.phrase_matches(terms, rows)[0])
+        return rows
+
+    def passages(self, query, doc_ids, n=1):
+        """
+        Mejores pasajes de cada documento para la consulta, calculados con el
+        índice posicional sin recorrer el texto de los documentos. Devuelve
+        {id: [{"page", "start", "score", "text", "highlights"}]}, donde text es el
+        texto procesado (lemas) del pasaje, page su página (None si no se conoce)
+        y highlights los rangos de caracteres de los términos de la consulta.
+        Si la consulta tiene frases entre comillas, solo se devuelven pasajes
+        donde empieza alguna de ellas.
+        """
+        query = self.normalize_query(query)
+        registry = self.indexer.registry
+        passage_index = self.indexer.passages
+        rows = np.array([registry.row(doc_id) for doc_id in doc_ids], dtype=np.int64)
+        lemmas = self._lemmatize(query)
+        terms = np.unique(np.array(
+            [term for term in self._query_terms(lemmas) if term is not None], dtype=np.int64))
+
+        with metrics.timer("search.passages"):
+            passage_rows, numbers, scores = passage_index.score_passages(
+                terms, self.indexer.vectorizer.idf_[terms], rows)
+            phrases = [phrase for phrase in self._phrases(query) if None not in phrase]
+            if phrases:
+                keys = (passage_rows << 32) | numbers
+                phrase_keys = np.concatenate([
+                    (match_rows << 32) | (offsets // passage_index.passage_size)
+                    for match_rows, offsets in (
+                        passage_index.phrase_matches(phrase, rows) for phrase in phrases)])
+                matched = np.isin(keys, phrase_keys)
+                passage_rows, numbers, scores = (
+                    passage_rows[matched], numbers[matched], scores[matched])
+
+        highlighted = set(ANALYZER(lemmas))
+        passages = {int(doc_id): [] for doc_id in doc_ids}
+        for index in np.lexsort((numbers, -scores)):
+            doc_passages = passages[int(registry.ids[passage_rows[index]])]
+            if len(doc_passages) < n:
+                doc_passages.append(self._passage(
+                    int(passage_rows[index]), int(numbers[index]), float(scores[index]), highlighted))
+        return passages
+
+    def _passage(self, row, number, score, highlighted):
+        """
+        Texto de un pasaje con la posición de los términos resaltados.
+        """
+        passage_index = self.indexer.passages
+        start = number * passage_index.passage_size
+        token_ids = self.store.token_ids(self.indexer.registry.at_row(row)["key"])
+        words = [self.store.terms[term_id]
+                 for term_id in token_ids[start:start + passage_index.passage_size].tolist()]
+        highlights, position = [], 0
+        for word in words:
+            if word in highlighted:
+                highlights.append((position, position + len(word)))
+            position += len(word) + 1
+        return {"page": passage_index.page(row, start), "start": start, "score": score,
+                "text": " ".join(words), "highlights": highlights}
+
+    @staticmethod
+    def normalize_query(query):
+        """
+        Normaliza la consulta (minúsculas y espacios simples) para usarla como
+        clave de las cachés; el preprocesamiento ya ignora esas diferencias.
+        """
+        return " ".join(query.lower().split())
+
+    def cache_stats(self):
+        """
+        Aciertos y fallos de cada caché de consultas.
+        """
+        return {name: cache.stats() for name, cache in self.caches.items()}
+
+    def _route(self, query_vector, scorer, n_probe=1):
+        """
+        Calcula el puntaje medio de cada cluster como el producto de la consulta
+        con su centroide y devuelve los n_probe clusters con mayor puntaje.
+        """
+        probed, self.clusters_scores = self._route_many(query_vector, scorer, n_probe)[0]
+        return probed
+
+    def _route_many(self, query_vectors, scorer, n_probe=1):
+        """
+        Igual que _route para una matriz de consultas, con un solo producto
+        contra los centroides. Devuelve, por consulta, (clusters elegidos,
+        puntaje de cada cluster).
+        """
         # Verificar si hay clusters válidos
-        if not cluster_scores:
+        if not self.clustered_documents:
             raise ValueError(
-                "No se generaron clusters válidos. Verifica los parámetros de DBSCAN.")
-
-        # Seleccionar el cluster más relevante
-        best_cluster = max(cluster_scores, key=cluster_scores.get)
-        
-        self.clusters_scores = cluster_scores
-        
-        # Filtrar documentos del cluster más relevante
-        cluster_docs = self.clustered_documents[best_cluster]
-        cluster_pdfs = self.clustered_pdfs[best_cluster]
-        cluster_titles = self.pdf_titles[best_cluster]
-        cluster_vectors = self.indexer.document_matrix[self.clusters == best_cluster]
-        
-        # Calcular similitud de coseno dentro del cluster
-        cluster_similarities = cosine_similarity(
-            query_vector, cluster_vectors).flatten()
-        top_indices = cluster_similarities.argsort()[::-1]
-
-        # Filtrar resultados por umbral
-        filtered_results = [
-            (cluster_docs[i], cluster_similarities[i], cluster_pdfs[i], cluster_titles[i])
-            for i in top_indices if cluster_similarities[i] >= threshold
-        ]
+                "No se generaron clusters válidos. Verifica los parámetros del clustering.")
 
-        return filtered_results
+        centroids = self.indexer.get_centroids(scorer)
+        all_scores = np.asarray((centroids @ query_vectors.T).todense())
+        routes = []
+        for cluster_scores in all_scores.T:
+            clusters_scores = {
+                cluster_id: cluster_scores[cluster_id] for cluster_id in self.clustered_documents}
+            ranked = sorted(clusters_scores, key=clusters_scores.get, reverse=True)
+            routes.append((ranked[:max(1, n_probe)], clusters_scores))
+        return routes
 
-    def recommend_similar_documents(self, selected_document, threshold=0.1):
+    def recommend_similar_documents(self, doc_id, threshold=0.1, mode="sparse"):
         """
-        Recomienda documentos similares al documento seleccionado.
-        Calcula la similitud de coseno entre el documento seleccionado y todos los demás documentos.
+        Recomienda documentos similares al documento seleccionado (por su id).
+        Con mode="sparse" consulta la tabla de vecinos precalculada en la
+        indexación, que guarda los documentos con mayor similitud de coseno a
+        cada documento; con mode="dense" busca los vecinos en el espacio LSA
+        del índice denso (documentos relacionados aunque no compartan lemas).
         Filtra los resultados para aquellos cuya similitud sea mayor al umbral.
+        Devuelve (vista previa del texto, similitud, PDF, id) de cada documento.
         """
-        # Verificar si el vectorizador y la matriz están en el estado de la sesión
-        if "vectorizer" not in st.session_state or "document_matrix" not in st.session_state:
+        if mode not in ("sparse", "dense"):
+            raise ValueError(f"Modo de similitud desconocido: {mode}")
+        # Verificar si el índice está cargado
+        if self.indexer.document_matrix is None:
             raise ValueError(
                 "El vectorizador TF-IDF o la matriz de documentos no están disponibles.")
 
-        vectorizer = st.session_state["vectorizer"]
-        document_matrix = st.session_state["document_matrix"]
-        processed_documents = st.session_state["processed_documents"]
-        pdf_files = process_text.get_pdf_files()
+        neighbors = self.indexer.neighbors
+        registry = self.indexer.registry
 
-        # Vectorizar el documento seleccionado
-        selected_vector = vectorizer.transform([selected_document])
+        # Vecinos del documento seleccionado, ya ordenados de mayor a menor similitud
+        with metrics.timer("recommend.lookup"):
+            if mode == "dense":
+                rows, similarities = self._dense_index().similar(
+                    registry.row(doc_id), neighbors.k, self.dense_probe)
+                selected = similarities >= threshold
+                similar_ids, similarities = registry.ids[rows[selected]], similarities[selected]
+            else:
+                similar_ids, similarities = neighbors.lookup(
+                    doc_id, registry.row(doc_id), threshold)
 
-        # Calcular la similitud de coseno con todos los documentos
-        similarities = cosine_similarity(
-            selected_vector, document_matrix).flatten()
+        similar_documents = []
+        for similar_id, similarity in zip(similar_ids, similarities):
+            record = registry.record(int(similar_id))
+            similar_documents.append(
+                (record["preview"], similarity, record["pdf"], int(similar_id)))
 
-        # Ordenar los documentos por puntaje de similitud (de mayor a menor)
-        similar_indices = similarities.argsort()[::-1]
+        # Retornar los documentos similares que cumplen con el umbral
+        return similar_documents
 
-        # Excluir el documento seleccionado y filtrar por umbral
-        similar_documents = [
-            (processed_documents[i], similarities[i], pdf_files[i])
-            for i in similar_indices
-            if processed_documents[i] != selected_document and similarities[i] >= threshold
-        ]
+    def cluster_summary(self):
+        """
+        Resumen de los clusters: número de documentos y títulos de cada cluster.
+        """
+        return {
+            cluster_id: {"size": len(ids), "titles": self.pdf_titles.get(cluster_id, [])}
+            for cluster_id, ids in self.clustered_ids.items()
+        }
 
-        # Retornar todos los documentos similares que cumplen con el umbral
-        return similar_documents
+    def relevant_documents(self, query):
+        """
+        Ids de los documentos cuyo texto procesado contiene la consulta; se usan
+        como documentos relevantes al evaluar las recomendaciones.
+        """
+        query = query.lower()
+        return [
+            int(doc_id) for doc_id, doc in zip(self.indexer.registry.ids, self.processed_documents)
+            if query in doc.lower()
+        ]
@@ -0,0 +1,83 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+
+class FileCache:
+    """
+    Caché LRU de archivos (PDFs) abiertos como memoria mapeada, acotada por el
+    total de bytes mapeados. Un archivo solo se abre cuando se pide; el sistema
+    operativo carga de disco únicamente las páginas que se leen, así que servir
+    un rango no lee el archivo completo. Los archivos mayores que max_bytes se
+    mapean para la petición pero no se guardan. Las entradas se invalidan si
+    cambia el tamaño o la fecha de modificación del archivo.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0  # Bytes mapeados en la caché
+        self._entries = OrderedDict()  # ruta -> ((tamaño, fecha), mapa)
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        """
+        Contenido del archivo como mmap de solo lectura (b"" si está vacío).
+        Lanza FileNotFoundError si no existe.
+        """
+        stat = os.stat(path)
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self._remove(path)
+
+        if not stat.st_size:
+            return b""
+        with open(path, "rb") as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if stat.st_size <= self.max_bytes:
+            with self._lock:
+                if path in self._entries:
+                    self._remove(path)
+                self._entries[path] = (stamp, mapping)
+                self.size += stat.st_size
+                # Los mapas expulsados no se cierran: una descarga en curso puede
+                # seguir usándolos y se liberan al dejar de estar referenciados
+                while self.size > self.max_bytes:
+                    self._remove(next(iter(self._entries)))
+        return mapping
+
+    def read(self, path, start=0, end=None):
+        """
+        Bytes del archivo entre start y end (sin incluir), por defecto todo.
+        """
+        return bytes(self.get(path)[start:end])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Aciertos, fallos, tasa de aciertos y bytes mapeados de la caché.
+        """
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": self.size, "max_size": self.max_bytes, "files": len(self._entries)}
+
+    def _remove(self, path):
+        (size, _), _ = self._entries.pop(path)
+        self.size -= size
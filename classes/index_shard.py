@@ -0,0 +1,199 @@
+import json
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.metrics.pairwise import cosine_similarity
+from classes.inverted_index import InvertedIndex
+
+
+def shard_path(index_path, shard):
+    return os.path.join(index_path, "shards", f"shard_{shard:03d}")
+
+
+class IndexShard:
+    """
+    Partición del índice con los documentos cuyo id cumple id % n_shards == shard.
+    Guarda, para sus documentos, la fila global, la etiqueta de cluster y las
+    filas de la matriz de pesos de cada algoritmo de puntuación con sus
+    postings. Los pesos se calculan sobre todo el corpus (IDF, longitudes
+    medias, normalización), así que cada documento puntúa exactamente igual
+    que en el índice completo y un proceso puede atender consultas cargando
+    solo su partición.
+    """
+
+    def __init__(self):
+        self.rows = np.empty(0, dtype=np.int64)  # fila local -> fila global
+        self.labels = np.empty(0, dtype=np.int64)  # fila local -> cluster
+        self.weights = {}  # algoritmo -> matriz de pesos de la partición
+        self.inverted_indexes = {}  # algoritmo -> postings de la partición
+
+    @classmethod
+    def from_indexer(cls, indexer, shard, n_shards):
+        """
+        Extrae la partición indicada de un índice construido y agrupado en clusters.
+        """
+        index_shard = cls()
+        index_shard.rows = np.flatnonzero(indexer.registry.ids % n_shards == shard)
+        index_shard.labels = np.asarray(indexer.clusters, dtype=np.int64)[index_shard.rows]
+        for name, scorer in indexer.scorers.items():
+            weights = scorer.weights[index_shard.rows].tocsr()
+            index_shard.weights[name] = weights
+            index_shard.inverted_indexes[name] = InvertedIndex.from_matrix(weights)
+        return index_shard
+
+    def score(self, query_vector, scorer, mode, probed, threshold, k=None):
+        """
+        Puntúa los documentos de la partición en los clusters elegidos igual
+        que DocumentSearchFacade._score (modos "cosine" e "inverted") y
+        devuelve (filas globales, puntajes) de sus k mejores que cumplen el umbral.
+        """
+        in_probed = np.isin(self.labels, probed)
+        if mode == "inverted":
+            rows, scores = self.inverted_indexes[scorer].score(query_vector)
+            selected = in_probed[rows]
+            rows, scores = rows[selected], scores[selected]
+            if threshold <= 0:
+                # Los documentos sin términos en común también cumplen el umbral
+                missing = np.setdiff1d(np.flatnonzero(in_probed), rows)
+                rows = np.concatenate([rows, missing])
+                scores = np.concatenate([scores, np.zeros(len(missing))])
+        else:
+            rows = np.flatnonzero(in_probed)
+            if not len(rows):
+                scores = np.empty(0)
+            elif scorer == "tfidf":
+                scores = cosine_similarity(query_vector, self.weights[scorer][rows]).flatten()
+            else:
+                scores = np.asarray(
+                    (self.weights[scorer][rows] @ query_vector.T).todense()).ravel()
+        selected = scores >= threshold
+        return InvertedIndex.top_k(self.rows[rows[selected]], scores[selected], k)
+
+    def save(self, path, signature):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "rows.npy"), self.rows)
+        np.save(os.path.join(path, "labels.npy"), self.labels)
+        for name, weights in self.weights.items():
+            postings = self.inverted_indexes[name]
+            for part, array in (("data", weights.data), ("indices", weights.indices),
+                                ("indptr", weights.indptr), ("postings_indptr", postings.indptr),
+                                ("postings_indices", postings.indices),
+                                ("postings_data", postings.data)):
+                np.save(os.path.join(path, f"{name}_{part}.npy"), array)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump({"signature": signature, "scorers": sorted(self.weights),
+                       "n_terms": next(iter(self.weights.values())).shape[1]}, file)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Carga una partición guardada; los arreglos se abren como memoria mapeada.
+        """
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        index_shard = cls()
+        index_shard.rows = np.load(os.path.join(path, "rows.npy"))
+        index_shard.labels = np.load(os.path.join(path, "labels.npy"))
+
+        for name in meta["scorers"]:
+            def load_array(part):
+                return np.load(os.path.join(path, f"{name}_{part}.npy"), mmap_mode="r")
+
+            shape = (len(index_shard.rows), meta["n_terms"])
+            index_shard.weights[name] = csr_matrix(
+                (load_array("data"), load_array("indices"), load_array("indptr")),
+                shape=shape, copy=False)
+            index_shard.inverted_indexes[name] = InvertedIndex(
+                load_array("postings_indptr"), load_array("postings_indices"),
+                load_array("postings_data"), shape[0])
+        return index_shard
+
+
+def serve_shard(path, connection):
+    """
+    Bucle de un proceso de búsqueda: carga su partición y responde a las
+    peticiones de puntuación que recibe por la conexión hasta recibir None.
+    """
+    index_shard = IndexShard.load(path)
+    connection.send(("ok", None))
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        indices, data, n_terms, *params = request
+        query_vector = csr_matrix(
+            (data, indices, [0, len(indices)]), shape=(1, n_terms))
+        try:
+            connection.send(("ok", index_shard.score(query_vector, *params)))
+        except Exception as error:  # El error se devuelve al proceso principal
+            connection.send(("error", repr(error)))
+    connection.close()
+
+
+class ShardPool:
+    """
+    Un proceso de búsqueda por partición del índice (cada uno carga solo la
+    suya). score reparte la consulta a todos los procesos a la vez y mezcla
+    sus k mejores resultados en el ranking global, que coincide con el del
+    índice sin particionar. Los procesos se crean con "spawn" para que no
+    hereden la memoria del proceso principal.
+    """
+
+    def __init__(self, index_path, n_shards):
+        context = multiprocessing.get_context("spawn")
+        self.n_shards = n_shards
+        self._connections = []
+        self._processes = []
+        # Las conexiones no admiten peticiones simultáneas de varios hilos
+        self._lock = threading.Lock()
+        for shard in range(n_shards):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=serve_shard, args=(shard_path(index_path, shard), worker_connection),
+                daemon=True)
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+        for shard, connection in enumerate(self._connections):
+            self._receive(shard, connection)
+
+    def score(self, query_vector, scorer, mode, probed, threshold, k=None):
+        """
+        Puntúa la consulta en todas las particiones en paralelo y devuelve
+        (filas globales, puntajes) ordenados, con como mucho k documentos.
+        """
+        query_vector = query_vector.tocsr()
+        request = (query_vector.indices, query_vector.data, query_vector.shape[1],
+                   scorer, mode, [int(cluster_id) for cluster_id in probed], threshold, k)
+        with self._lock:
+            for connection in self._connections:
+                connection.send(request)
+            results = [self._receive(shard, connection)
+                       for shard, connection in enumerate(self._connections)]
+        rows = np.concatenate([rows for rows, _ in results])
+        scores = np.concatenate([scores for _, scores in results])
+        return InvertedIndex.top_k(rows, scores, k)
+
+    def close(self):
+        with self._lock:
+            for connection, process in zip(self._connections, self._processes):
+                try:
+                    connection.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+                process.join(timeout=5)
+                connection.close()
+            self._connections, self._processes = [], []
+
+    def _receive(self, shard, connection):
+        try:
+            status, result = connection.recv()
+        except EOFError:
+            raise RuntimeError(f"El proceso de la partición {shard} terminó inesperadamente")
+        if status != "ok":
+            raise RuntimeError(f"Error en la partición {shard}: {result}")
+        return result
@@ -0,0 +1,87 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from classes.metrics import metrics
+from functions.disk_arrays import batch_ranges, bucket_positions, empty_array, index_dtype
+
+
+class InvertedIndex:
+    """ Índice invertido sobre la matriz TF-IDF: una lista de postings (documentos y pesos) por término """
+
+    def __init__(self, indptr, indices, data, n_documents):
+        # Formato CSC: los postings del término t son indices/data[indptr[t]:indptr[t + 1]]
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.n_documents = n_documents
+
+    @classmethod
+    def from_matrix(cls, document_matrix, path=None, name="postings", batch_tokens=1 << 20):
+        """
+        Construye el índice invertido a partir de la matriz de documentos,
+        trasponiéndola por bloques de filas de como mucho batch_tokens
+        elementos en dos pasadas (ordenación por conteo): la primera cuenta los
+        postings de cada término y la segunda los escribe en su lugar, por fila
+        dentro de cada término. Con path, los postings se escriben en disco.
+        """
+        matrix = csr_matrix(document_matrix)
+        n_documents, n_terms = matrix.shape
+        batches = list(batch_ranges(np.diff(matrix.indptr), batch_tokens))
+        term_counts = np.zeros(n_terms, dtype=np.int64)
+        for start, end in batches:
+            term_counts += np.bincount(
+                matrix.indices[matrix.indptr[start]:matrix.indptr[end]], minlength=n_terms)
+        index_type = index_dtype(max(matrix.nnz, n_documents))
+        indptr = np.concatenate([[0], np.cumsum(term_counts)]).astype(index_type)
+
+        indices = empty_array(matrix.nnz, index_type, path, f"{name}_indices")
+        data = empty_array(matrix.nnz, matrix.dtype, path, f"{name}_data")
+        # Siguiente posición libre de cada término
+        cursor = indptr[:-1].astype(np.int64)
+        for start, end in batches:
+            begin, finish = matrix.indptr[start], matrix.indptr[end]
+            destination = bucket_positions(np.asarray(matrix.indices[begin:finish]), cursor)
+            indices[destination] = np.repeat(
+                np.arange(start, end), np.diff(matrix.indptr[start:end + 1]))
+            data[destination] = matrix.data[begin:finish]
+        return cls(indptr, indices, data, n_documents)
+
+    def score(self, query_vector):
+        """
+        Calcula el producto escalar entre la consulta y los documentos que
+        comparten al menos un término con ella, recorriendo solo los postings
+        de los términos de la consulta. Como la consulta y los documentos están
+        normalizados (L2), el resultado es la similitud de coseno.
+        Devuelve (filas de los documentos tocados, puntajes).
+        """
+        query_vector = query_vector.tocsr()
+        rows, weights = [], []
+        for term, weight in zip(query_vector.indices, query_vector.data):
+            start, end = self.indptr[term], self.indptr[term + 1]
+            rows.append(self.indices[start:end])
+            weights.append(self.data[start:end] * weight)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        if metrics.enabled:
+            metrics.count("inverted_index.postings", sum(len(postings) for postings in rows))
+
+        touched, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+        return touched, scores
+
+    @staticmethod
+    def top_k(rows, scores, k=None):
+        """
+        Ordena los documentos por puntaje descendente (y por fila en caso de
+        empate). Con k, selecciona primero con partition los candidatos con
+        puntaje mayor o igual al k-ésimo para no ordenar todos; los empates en
+        el corte también se resuelven por fila, así que el resultado no depende
+        del orden de los candidatos (mezclar los k mejores de varias
+        particiones da el mismo ranking que el índice completo).
+        """
+        if k is not None and k < len(scores):
+            kth = np.partition(-scores, k - 1)[k - 1]
+            candidates = np.flatnonzero(-scores <= kth)
+            rows, scores = rows[candidates], scores[candidates]
+        order = np.lexsort((rows, -scores))[:k]
+        return rows[order], scores[order]
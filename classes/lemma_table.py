@@ -0,0 +1,103 @@
+import json
+import os
+import string
+
+from spacy.lang.es.stop_words import STOP_WORDS
+
+# Signos que se quitan de los extremos de cada palabra de la consulta
+PUNCTUATION = string.punctuation + "¿¡«»“”‘’…–—"
+
+
+class LemmaTable:
+    """
+    Tabla forma -> lema construida durante la ingesta con las palabras del
+    corpus. Permite lematizar las consultas sin pasar por el modelo de spaCy:
+    solo las palabras que no están en la tabla se lematizan con spaCy.
+    Guarda, para cada forma, cuántas veces apareció con cada lema; al consultar
+    se usa el lema más frecuente.
+    """
+
+    def __init__(self, path="./processed_files/lemmas.json"):
+        self.path = path
+        self.counts = {}  # forma -> {lema: apariciones}
+        self.lemmas = {}  # forma -> lema más frecuente
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.counts = json.load(file)
+            self._refresh()
+
+    def __len__(self):
+        return len(self.lemmas)
+
+    def update(self, lemma_counts):
+        """
+        Añade los pares (forma, lema) contados por PDFProcessor durante la ingesta.
+        """
+        for (form, lemma), count in lemma_counts.items():
+            lemmas = self.counts.setdefault(form, {})
+            lemmas[lemma] = lemmas.get(lemma, 0) + count
+        self._refresh()
+
+    def lemmatize(self, text, processor):
+        """
+        Preprocesa una consulta igual que PDFProcessor.preprocess_text: minúsculas,
+        sin stopwords ni signos y con cada palabra sustituida por su lema.
+        Las palabras conocidas se resuelven con la tabla; el resto se lematiza
+        con spaCy (el modelo solo se carga si hace falta). Sin tabla, toda la
+        consulta se procesa con spaCy.
+        """
+        if not self.lemmas:
+            return processor.preprocess_text(text)
+        return self.lemmatize_many([text], processor)[0]
+
+    def lemmatize_many(self, texts, processor):
+        """
+        Igual que lemmatize para varias consultas: las palabras desconocidas de
+        todas ellas se lematizan juntas con una sola llamada a nlp.pipe.
+        """
+        if not self.lemmas:
+            # Las consultas caben en un solo fragmento de preprocess_text
+            return list(processor.preprocess_texts(texts))
+
+        parsed = [self._lookup(text) for text in texts]
+        unknown = [word for _, words in parsed for word in words]
+        # Lematizar con spaCy solo las palabras desconocidas, en su orden
+        unknown_lemmas = iter(processor.preprocess_texts(unknown))
+        results = []
+        for lemmas, _ in parsed:
+            lemmas = [next(unknown_lemmas) if lemma is None else lemma for lemma in lemmas]
+            results.append(" ".join(lemma for lemma in lemmas if lemma))
+        return results
+
+    def _lookup(self, text):
+        """
+        Lemas de las palabras conocidas del texto, con None en el lugar de las
+        desconocidas, y la lista de palabras desconocidas.
+        """
+        lemmas = []
+        unknown = []
+        for word in text.lower().split():
+            word = word.strip(PUNCTUATION)
+            if not any(char.isalpha() for char in word):
+                continue  # Números y signos: spaCy no los conserva
+            if word.isalpha():
+                if word in STOP_WORDS:
+                    continue
+                if word in self.lemmas:
+                    lemmas.append(self.lemmas[word])
+                    continue
+            lemmas.append(None)
+            unknown.append(word)
+        return lemmas, unknown
+
+    def save(self):
+        """
+        Guarda la tabla de forma atómica.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.counts, file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def _refresh(self):
+        self.lemmas = {form: max(lemmas, key=lemmas.get) for form, lemmas in self.counts.items()}
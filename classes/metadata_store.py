@@ -0,0 +1,38 @@
+import json
+import os
+
+
+class MetadataStore:
+    """ Almacén de los metadatos de los PDFs (título, páginas, autor...) indexado por id de documento """
+
+    def __init__(self, path="./processed_files/metadata.json"):
+        self.path = path
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                self.records = json.load(file)
+
+    @staticmethod
+    def document_id(path):
+        """
+        Id estable de un documento: el nombre del PDF (o de su .txt) sin extensión.
+        """
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def get(self, doc_id, default=None):
+        return self.records.get(doc_id, default)
+
+    def put(self, doc_id, metadata):
+        self.records[doc_id] = metadata
+
+    def remove(self, doc_id):
+        self.records.pop(doc_id, None)
+
+    def save(self):
+        """
+        Guarda el almacén de forma atómica.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.records, file, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
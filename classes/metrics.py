@@ -0,0 +1,158 @@
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+from functions.benchmark import current_rss
+
+logger = logging.getLogger("document_search.metrics")
+
+# Contexto vacío que se devuelve cuando las métricas están desactivadas
+_NULL_TIMER = contextlib.nullcontext()
+
+
+class _Timer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """
+    Registro de métricas del proceso: duración y memoria residente al terminar
+    cada etapa (timer) y contadores (count). Desactivado, timer devuelve un
+    contexto vacío y count retorna de inmediato, así que el coste es mínimo.
+    Las métricas se exportan en formato de texto de Prometheus y, con
+    log_events, cada evento se escribe además como una línea JSON en el log.
+    Se activan para todo el proceso (enable) o solo para el hilo de una
+    traza (trace(enable=True)).
+    """
+
+    def __init__(self, enabled=False, log_events=False):
+        self._enabled = enabled
+        self.log_events = log_events
+        self.timers = {}  # etapa -> [llamadas, segundos totales, máximo]
+        self.counters = {}  # nombre -> total
+        self.memory = {}  # etapa -> RSS (bytes) al terminar la última llamada
+        self._lock = threading.Lock()
+        self._local = threading.local()  # eventos y activación de la traza de cada hilo
+
+    @property
+    def enabled(self):
+        return self._enabled or getattr(self._local, "enabled", False)
+
+    def enable(self, log_events=None):
+        self._enabled = True
+        if log_events is not None:
+            self.log_events = log_events
+
+    def disable(self):
+        self._enabled = False
+
+    def timer(self, name):
+        """
+        Contexto que mide la duración de una etapa.
+        """
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def observe(self, name, seconds):
+        if not self.enabled:
+            return
+        rss = current_rss()
+        with self._lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+            self.memory[name] = rss
+        self._record({"stage": name, "seconds": seconds, "rss_mb": rss / 2**20})
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        self._record({"counter": name, "value": value})
+
+    @contextlib.contextmanager
+    def trace(self, enable=False):
+        """
+        Recoge los eventos del hilo actual dentro del bloque (p. ej. una búsqueda)
+        en la lista que devuelve. Con enable=True las métricas se activan solo
+        en este hilo mientras dura el bloque, sin afectar a los demás.
+        """
+        events = []
+        previous = getattr(self._local, "events", None), getattr(self._local, "enabled", False)
+        self._local.events = events
+        self._local.enabled = previous[1] or enable
+        try:
+            yield events
+        finally:
+            self._local.events, self._local.enabled = previous
+
+    def reset(self):
+        with self._lock:
+            self.timers, self.counters, self.memory = {}, {}, {}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "timers": {name: {"count": count, "seconds": total, "max_seconds": maximum}
+                           for name, (count, total, maximum) in self.timers.items()},
+                "counters": dict(self.counters),
+                "rss_bytes": dict(self.memory),
+            }
+
+    def to_prometheus(self, caches=None, prefix="document_search"):
+        """
+        Exporta las métricas en el formato de texto de Prometheus. caches es un
+        diccionario opcional nombre -> estadísticas de QueryCache.
+        """
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Duración de las etapas del buscador.",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for name, timer in sorted(snapshot["timers"].items()):
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {timer["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {timer["seconds"]:.6f}')
+        lines += [f"# TYPE {prefix}_stage_max_seconds gauge"]
+        lines += [f'{prefix}_stage_max_seconds{{stage="{name}"}} {timer["max_seconds"]:.6f}'
+                  for name, timer in sorted(snapshot["timers"].items())]
+        lines += [f"# TYPE {prefix}_stage_rss_bytes gauge"]
+        lines += [f'{prefix}_stage_rss_bytes{{stage="{name}"}} {rss}'
+                  for name, rss in sorted(snapshot["rss_bytes"].items())]
+        lines += [f"# TYPE {prefix}_events_total counter"]
+        lines += [f'{prefix}_events_total{{name="{name}"}} {value}'
+                  for name, value in sorted(snapshot["counters"].items())]
+        if caches:
+            for metric in ("hits", "misses", "size"):
+                kind = "gauge" if metric == "size" else "counter"
+                lines.append(f"# TYPE {prefix}_cache_{metric} {kind}")
+                lines += [f'{prefix}_cache_{metric}{{cache="{name}"}} {stats[metric]}'
+                          for name, stats in sorted(caches.items())]
+        return "\n".join(lines) + "\n"
+
+    def _record(self, event):
+        events = getattr(self._local, "events", None)
+        if events is not None:
+            events.append(event)
+        if self.log_events:
+            logger.info(json.dumps(event, ensure_ascii=False))
+
+
+# Métricas compartidas por todo el proceso. Se activan con SEARCH_METRICS=1
+# (o SEARCH_METRICS=log para escribir además cada evento en el log)
+metrics = Metrics(
+    enabled=os.environ.get("SEARCH_METRICS", "") not in ("", "0"),
+    log_events=os.environ.get("SEARCH_METRICS") == "log")
@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class NeighborGraph:
+    """
+    Tabla precalculada con los k documentos más similares (coseno) a cada
+    documento del índice. Las filas siguen el orden de la matriz y los vecinos
+    se guardan por id de documento, por lo que recomendar es una consulta O(1).
+    """
+
+    def __init__(self, k=20, block_size=256, max_cells=1 << 22):
+        self.k = k
+        self.block_size = block_size
+        # Similitudes por bloque: con muchos documentos el bloque tiene menos filas
+        self.max_cells = max_cells
+        self.ids = np.empty(0, dtype=np.int64)  # fila -> id
+        self.neighbors = np.empty((0, k), dtype=np.int64)  # ids vecinos, -1 si no hay
+        self.scores = np.empty((0, k), dtype=np.float32)
+
+    def build(self, document_matrix, ids, inverted_index=None):
+        """
+        Calcula los vecinos de todos los documentos multiplicando la matriz por
+        su traspuesta por bloques de filas, sin materializar la matriz n x n.
+        Los postings de la matriz (inverted_index) son su traspuesta ya
+        calculada; sin ellos se traspone la matriz en memoria.
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        n_documents = document_matrix.shape[0]
+        self.neighbors = np.full((n_documents, self.k), -1, dtype=np.int64)
+        self.scores = np.zeros((n_documents, self.k), dtype=np.float32)
+        for rows, similarities in self._similarity_blocks(
+                document_matrix, np.arange(n_documents), inverted_index):
+            similarities[np.arange(len(rows)), rows] = -np.inf  # Excluir el propio documento
+            columns = np.broadcast_to(self.ids, similarities.shape)
+            self.neighbors[rows], self.scores[rows] = self._top_k(columns, similarities)
+
+    def update(self, document_matrix, ids, changed_ids, inverted_index=None):
+        """
+        Actualiza la tabla tras una actualización incremental del índice.
+        Solo se calculan similitudes de los documentos nuevos o modificados
+        (changed_ids) y de los que perdieron un vecino eliminado; las listas
+        de los demás documentos se conservan y se mezclan con los nuevos
+        candidatos. Las similitudes ya guardadas no se recalculan con el nuevo IDF.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        changed_ids = np.asarray(changed_ids, dtype=np.int64)
+        removed = np.union1d(np.setdiff1d(self.ids, ids), changed_ids)
+
+        # Recalcular desde cero si cambia gran parte del corpus
+        if len(self.ids) == 0 or len(changed_ids) > len(ids) // 2:
+            self.build(document_matrix, ids, inverted_index)
+            return
+
+        # Copiar las listas de los documentos que no cambiaron a su nueva fila
+        sorter = np.argsort(self.ids)
+        positions = np.minimum(np.searchsorted(self.ids, ids, sorter=sorter), len(self.ids) - 1)
+        old_rows = sorter[positions]
+        kept = (self.ids[old_rows] == ids) & ~np.isin(ids, changed_ids)
+        neighbors = np.full((len(ids), self.k), -1, dtype=np.int64)
+        scores = np.zeros((len(ids), self.k), dtype=np.float32)
+        neighbors[kept] = self.neighbors[old_rows[kept]]
+        scores[kept] = self.scores[old_rows[kept]]
+        stale = np.isin(neighbors, removed)
+
+        # Se recalculan por completo los documentos nuevos o modificados y los
+        # que perdieron algún vecino (su siguiente candidato no está guardado)
+        changed = np.isin(ids, changed_ids)
+        recompute = changed | stale.any(axis=1)
+        recompute_rows = np.flatnonzero(recompute)
+        other_rows = np.flatnonzero(~recompute)
+        for rows, similarities in self._similarity_blocks(
+                document_matrix, recompute_rows, inverted_index):
+            own = similarities.copy()
+            own[np.arange(len(rows)), rows] = -np.inf
+            neighbors[rows], scores[rows] = self._top_k(
+                np.broadcast_to(ids, own.shape), own)
+
+            # Los documentos nuevos son candidatos para los vecinos del resto
+            new_rows = rows[changed[rows]]
+            candidates = similarities[changed[rows]][:, other_rows].T
+            merged_ids = np.hstack([neighbors[other_rows],
+                                    np.broadcast_to(ids[new_rows], candidates.shape)])
+            merged_scores = np.hstack([
+                np.where(neighbors[other_rows] >= 0, scores[other_rows], -np.inf),
+                candidates])
+            neighbors[other_rows], scores[other_rows] = self._top_k(
+                merged_ids, merged_scores)
+
+        self.ids, self.neighbors, self.scores = ids, neighbors, scores
+
+    def lookup(self, doc_id, row, threshold=0.0):
+        """
+        Devuelve (ids, similitudes) de los vecinos del documento de la fila
+        indicada con similitud mayor o igual al umbral, de mayor a menor.
+        """
+        neighbors = np.asarray(self.neighbors[row])
+        scores = np.asarray(self.scores[row])
+        valid = (neighbors >= 0) & (neighbors != doc_id) & (scores >= threshold)
+        return neighbors[valid], scores[valid]
+
+    def _similarity_blocks(self, document_matrix, rows, inverted_index=None):
+        """
+        Genera (filas, similitudes densas del bloque contra todos los documentos).
+        Las filas de la matriz están normalizadas, así que el producto es el coseno.
+        """
+        n_documents, n_terms = document_matrix.shape
+        if inverted_index is None:
+            transposed = document_matrix.T.tocsr()
+        else:
+            transposed = csr_matrix(
+                (inverted_index.data, inverted_index.indices, inverted_index.indptr),
+                shape=(n_terms, n_documents), copy=False)
+        block_size = max(1, min(self.block_size, self.max_cells // max(1, n_documents)))
+        for start in range(0, len(rows), block_size):
+            block = rows[start:start + block_size]
+            yield block, (document_matrix[block] @ transposed).toarray()
+
+    def _top_k(self, ids, scores):
+        """
+        Selecciona por fila los k mayores puntajes (argpartition) y los ordena.
+        """
+        k = min(self.k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        top_ids = np.take_along_axis(np.asarray(ids), top, axis=1)
+        top_ids[~np.isfinite(top_scores)] = -1
+
+        neighbors = np.full((scores.shape[0], self.k), -1, dtype=np.int64)
+        result = np.zeros((scores.shape[0], self.k), dtype=np.float32)
+        neighbors[:, :k] = top_ids
+        result[:, :k] = np.where(np.isfinite(top_scores), top_scores, 0)
+        return neighbors, result
+
+    def save(self, path):
+        np.save(os.path.join(path, "neighbor_ids.npy"), self.ids)
+        np.save(os.path.join(path, "neighbors.npy"), self.neighbors)
+        np.save(os.path.join(path, "neighbor_scores.npy"), self.scores)
+
+    def load(self, path):
+        self.ids = np.load(os.path.join(path, "neighbor_ids.npy"))
+        self.neighbors = np.load(os.path.join(path, "neighbors.npy"), mmap_mode="r")
+        self.scores = np.load(os.path.join(path, "neighbor_scores.npy"), mmap_mode="r")
+        self.k = self.neighbors.shape[1]
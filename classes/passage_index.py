@@ -0,0 +1,182 @@
+import os
+
+import numpy as np
+
+from functions.disk_arrays import batch_ranges, bucket_positions, empty_array
+
+# Tokens por pasaje: los documentos se dividen en ventanas fijas de este tamaño
+PASSAGE_SIZE = 50
+
+
+class PassageIndex:
+    """
+    Índice posicional del corpus: para cada término, las filas de los
+    documentos y las posiciones (en tokens) donde aparece, ordenadas por fila y
+    posición. Permite puntuar pasajes (ventanas fijas de passage_size tokens)
+    y encontrar frases sin recorrer el texto de los documentos en la consulta.
+    Guarda también dónde empieza cada página de los documentos que la conocen
+    (los importados de .txt no la tienen).
+    """
+
+    # Saturación de la frecuencia del término en un pasaje, como en BM25
+    k1 = 1.2
+
+    def __init__(self, passage_size=PASSAGE_SIZE):
+        self.passage_size = passage_size
+        # Formato CSC: las posiciones del término t son rows/offsets[indptr[t]:indptr[t + 1]]
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.rows = np.empty(0, dtype=np.int32)
+        self.offsets = np.empty(0, dtype=np.int32)
+        # Inicio (en tokens) de cada página: page_offsets[page_indptr[fila]:page_indptr[fila + 1]]
+        self.page_indptr = np.zeros(1, dtype=np.int64)
+        self.page_offsets = np.empty(0, dtype=np.int32)
+
+    def build(self, token_arrays, columns, n_terms, pages=None, path=None, batch_tokens=1 << 20):
+        """
+        Construye el índice a partir de los ids de términos de cada documento
+        (en el orden de las filas de la matriz). columns traduce los ids del
+        almacén del corpus a columnas del vocabulario del índice; pages tiene,
+        por documento, la posición en tokens donde empieza cada página.
+        Los documentos se recorren por lotes de como mucho batch_tokens tokens
+        en dos pasadas (ordenación por conteo): la primera cuenta las posiciones de cada
+        término y la segunda las escribe en su lugar, así que solo los tokens
+        de un lote están en memoria. Con path, las posiciones se escriben en disco.
+        """
+        batches = list(batch_ranges([len(tokens) for tokens in token_arrays], batch_tokens))
+        term_counts = np.zeros(n_terms, dtype=np.int64)
+        for start, end in batches:
+            terms, _, _ = self._batch_positions(token_arrays[start:end], columns, start)
+            term_counts += np.bincount(terms, minlength=n_terms)
+        self.indptr = np.concatenate([[0], np.cumsum(term_counts)]).astype(np.int64)
+
+        self.rows = empty_array(self.indptr[-1], np.int32, path, "positions_rows")
+        self.offsets = empty_array(self.indptr[-1], np.int32, path, "positions_offsets")
+        # Siguiente posición libre de cada término
+        cursor = self.indptr[:-1].copy()
+        for start, end in batches:
+            terms, rows, offsets = self._batch_positions(token_arrays[start:end], columns, start)
+            # Orden estable por término: dentro de cada término queda por fila y posición
+            destination = bucket_positions(terms, cursor)
+            self.rows[destination], self.offsets[destination] = rows, offsets
+
+        pages = pages or [[] for _ in token_arrays]
+        self.page_indptr = np.concatenate(
+            [[0], np.cumsum([len(starts) for starts in pages])]).astype(np.int64)
+        self.page_offsets = np.array(
+            [offset for starts in pages for offset in starts], dtype=np.int32)
+
+    @staticmethod
+    def _batch_positions(token_arrays, columns, first_row):
+        """
+        Columna, fila y posición de cada token de un lote de documentos cuya
+        primera fila es first_row.
+        """
+        if not len(token_arrays):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        lengths = np.array([len(tokens) for tokens in token_arrays], dtype=np.int64)
+        terms = columns[np.concatenate(token_arrays).astype(np.int64)]
+        starts = np.cumsum(lengths) - lengths
+        rows = np.repeat(np.arange(first_row, first_row + len(lengths), dtype=np.int32), lengths)
+        offsets = (np.arange(len(terms)) - np.repeat(starts, lengths)).astype(np.int32)
+        return terms, rows, offsets
+
+    def postings(self, term, rows=None):
+        """
+        Filas y posiciones del término, opcionalmente solo en las filas indicadas.
+        """
+        start, end = self.indptr[term], self.indptr[term + 1]
+        term_rows, term_offsets = self.rows[start:end], self.offsets[start:end]
+        if rows is not None:
+            inside = np.isin(term_rows, rows)
+            term_rows, term_offsets = term_rows[inside], term_offsets[inside]
+        return term_rows, term_offsets
+
+    def score_passages(self, terms, weights, rows=None):
+        """
+        Puntúa los pasajes que contienen algún término de la consulta: suma
+        por término de peso * tf * (k1 + 1) / (tf + k1), dividida por el máximo
+        posible para que quede entre 0 y 1. Devuelve (filas, número de pasaje
+        dentro del documento, puntajes), ordenados por fila y pasaje.
+        """
+        keys, contributions = [], []
+        for term, weight in zip(terms, weights):
+            term_rows, term_offsets = self.postings(term, rows)
+            # Clave del pasaje: fila en los 32 bits altos, número de pasaje en los bajos
+            passage_keys, tf = np.unique(
+                (term_rows.astype(np.int64) << 32) | (term_offsets // self.passage_size),
+                return_counts=True)
+            keys.append(passage_keys)
+            contributions.append(weight * tf * (self.k1 + 1) / (tf + self.k1))
+        if not keys:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+        passages, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions)).astype(np.float64)
+        scores /= max(float(np.sum(weights)) * (self.k1 + 1), 1e-12)
+        return passages >> 32, passages & 0xFFFFFFFF, scores
+
+    def document_scores(self, terms, weights, rows=None):
+        """
+        Puntaje de cada documento tocado por la consulta: el de su mejor pasaje.
+        Así un documento largo que menciona la consulta una sola vez no puntúa
+        como uno centrado en ella. Devuelve (filas, puntajes).
+        """
+        passage_rows, _, scores = self.score_passages(terms, weights, rows)
+        if not len(passage_rows):
+            return passage_rows, scores
+        touched, first = np.unique(passage_rows, return_index=True)
+        return touched, np.maximum.reduceat(scores, first)
+
+    def phrase_matches(self, terms, rows=None):
+        """
+        Posiciones donde aparece la frase (términos consecutivos). Devuelve
+        (filas, posición del primer término).
+        """
+        matches = None
+        for position, term in enumerate(terms):
+            term_rows, term_offsets = self.postings(term, rows)
+            valid = term_offsets >= position
+            keys = ((term_rows[valid].astype(np.int64) << 32)
+                    | (term_offsets[valid].astype(np.int64) - position))
+            matches = keys if matches is None else np.intersect1d(matches, keys, assume_unique=True)
+            if not len(matches):
+                break
+        if matches is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return matches >> 32, matches & 0xFFFFFFFF
+
+    def page(self, row, offset):
+        """
+        Página (desde 1) en la que está la posición indicada del documento, o
+        None si no se conocen sus páginas.
+        """
+        starts = self.page_offsets[self.page_indptr[row]:self.page_indptr[row + 1]]
+        if not len(starts):
+            return None
+        return int(np.searchsorted(starts, offset, side="right"))
+
+    @staticmethod
+    def highlight(text, spans, before="**", after="**"):
+        """
+        Marca en el texto los rangos de caracteres indicados (p. ej. en negrita de Markdown).
+        """
+        parts, last = [], 0
+        for start, end in spans:
+            parts += [text[last:start], before, text[start:end], after]
+            last = end
+        return "".join(parts + [text[last:]])
+
+    def save(self, path):
+        np.save(os.path.join(path, "positions_indptr.npy"), self.indptr)
+        np.save(os.path.join(path, "positions_rows.npy"), self.rows)
+        np.save(os.path.join(path, "positions_offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "page_indptr.npy"), self.page_indptr)
+        np.save(os.path.join(path, "page_offsets.npy"), self.page_offsets)
+
+    def load(self, path, passage_size=PASSAGE_SIZE):
+        self.passage_size = passage_size
+        self.indptr = np.load(os.path.join(path, "positions_indptr.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(path, "positions_rows.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "positions_offsets.npy"), mmap_mode="r")
+        self.page_indptr = np.load(os.path.join(path, "page_indptr.npy"))
+        self.page_offsets = np.load(os.path.join(path, "page_offsets.npy"), mmap_mode="r")
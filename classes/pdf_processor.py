@@ -1,8 +1,17 @@
+from bisect import bisect_right
+
 # PyMuPDF para extracción de texto de PDFs.
 import fitz
 # Para procesamiento de texto, incluyendo tokenización y lematización.
 import spacy
 
+from classes.metrics import metrics
+
+# Tamaño máximo (en caracteres) de cada fragmento de texto que se pasa a spaCy.
+# Mantiene acotada la memoria con documentos muy largos y queda muy por debajo
+# del límite nlp.max_length.
+CHUNK_SIZE = 100000
+
 """ Clase encargada de extraer y preprocesar texto de PDFs """
 
 
@@ -12,8 +21,25 @@ class PDFProcessor:
     Este modelo incluye herramientas para analizar texto en español, como lematización 
     y detección de palabras vacías."""
 
-    def __init__(self):
-        self.nlp = spacy.load("es_core_news_sm")
+    def __init__(self, lazy=False):
+        # Con lazy=True el modelo se carga la primera vez que se necesita
+        self._nlp = None
+        # Si es un Counter, _lemma_tokens cuenta los pares (forma, lema) vistos
+        self.lemma_counts = None
+        if not lazy:
+            self._nlp = self._load_model()
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            with metrics.timer("pdf.load_model"):
+                self._nlp = self._load_model()
+        return self._nlp
+
+    @staticmethod
+    def _load_model():
+        # El parser y el NER no intervienen en la lematización ni en las stopwords
+        return spacy.load("es_core_news_sm", disable=["parser", "ner"])
 
     """ 
         Este método extrae el texto de un archivo PDF utilizando la biblioteca PyMuPDF (fitz). 
@@ -30,13 +56,55 @@ class PDFProcessor:
     # Devuelve el texto completo del PDF como una cadena.
 
     def extract_text(self, pdf_path):
+        with metrics.timer("pdf.extract"):
+            return " ".join(self.iter_pages(pdf_path))
+
+    def iter_pages(self, pdf_path):
+        """
+        Generador que devuelve el texto de cada página del PDF, ya limpio
+        (solo ASCII y sin saltos de línea), sin cargar el documento completo en memoria.
+        """
         # Abrir el PDF
-        doc = fitz.open(pdf_path)
-        text = " ".join([
-            page.get_text("text") for page in doc
-        ])
-        text = text.encode("ascii", "ignore").decode("ascii")
-        return text.replace("\n", " ")
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                text = page.get_text("text")
+                text = text.encode("ascii", "ignore").decode("ascii")
+                yield text.replace("\n", " ")
+
+    def split_chunks(self, parts, chunk_size=CHUNK_SIZE):
+        """
+        Une las partes (por ejemplo, páginas) separadas por un espacio y las
+        vuelve a cortar en fragmentos de como máximo chunk_size caracteres,
+        cortando en un espacio para no partir palabras. Devuelve siempre al
+        menos un fragmento, aunque sea vacío.
+        """
+        for chunk, _ in self.split_pages(parts, chunk_size):
+            yield chunk
+
+    def split_pages(self, pages, chunk_size=CHUNK_SIZE):
+        """
+        Igual que split_chunks, pero devuelve cada fragmento con la lista de
+        (posición en el fragmento, número de página desde 1) de las páginas que
+        contiene; la primera es la página en curso al inicio del fragmento.
+        """
+        buffer = None
+        starts = []
+        for number, page in enumerate(pages, start=1):
+            if buffer is None:
+                buffer, starts = page, [(0, number)]
+            else:
+                starts.append((len(buffer) + 1, number))
+                buffer = buffer + " " + page
+            while len(buffer) > chunk_size:
+                cut = buffer.rfind(" ", 0, chunk_size)
+                if cut <= 0:
+                    cut = chunk_size
+                yield buffer[:cut], [(start, page_number) for start, page_number in starts if start < cut]
+                buffer = buffer[cut:]
+                current = [page_number for start, page_number in starts if start <= cut][-1]
+                starts = [(0, current)] + [(start - cut, page_number)
+                                           for start, page_number in starts if start > cut]
+        yield buffer or "", starts or [(0, 1)]
 
     """
         Este método procesa el texto extraído del PDF. Convierte el texto a minúsculas, 
@@ -53,13 +121,93 @@ class PDFProcessor:
     # Devuelve el texto procesado como una cadena.
 
     def preprocess_text(self, text):
-        doc = self.nlp(text.lower())
-        return " ".join([token.lemma_ for token in doc if not token.is_stop and token.is_alpha])
+        with metrics.timer("pdf.preprocess"):
+            chunks = self.nlp.pipe(chunk.lower() for chunk in self.split_chunks([text]))
+            return " ".join(processed for processed in map(self._lemmas, chunks) if processed)
+
+    def preprocess_texts(self, texts, batch_size=8):
+        """
+        Igual que preprocess_text pero para varios textos, procesándolos por
+        lotes con nlp.pipe. Devuelve la lista de textos procesados en orden.
+        """
+        with metrics.timer("pdf.preprocess"):
+            return [self._lemmas(doc) for doc in
+                    self.nlp.pipe((text.lower() for text in texts), batch_size=batch_size)]
+
+    def preprocess_pdfs(self, pdf_paths, batch_size=8, chunk_size=CHUNK_SIZE):
+        """
+        Extrae y preprocesa varios PDFs en streaming: cada PDF se lee página a
+        página y se corta en fragmentos que se lematizan por lotes con nlp.pipe.
+        Devuelve un generador de (ruta del PDF, página, fragmento procesado), en
+        orden, con al menos un fragmento por PDF; los fragmentos de spaCy se
+        dividen por la página de la que viene cada token. Unir con espacios los
+        fragmentos no vacíos de un PDF da el mismo resultado que
+        preprocess_text(extract_text(pdf)).
+        """
+        chunks = (
+            (chunk.lower(), (pdf_path, starts))
+            for pdf_path in pdf_paths
+            for chunk, starts in self.split_pages(self.iter_pages(pdf_path), chunk_size)
+        )
+        for doc, (pdf_path, starts) in self.nlp.pipe(chunks, as_tuples=True, batch_size=batch_size):
+            metrics.count("pdf.chunks")
+            for page, processed in self._page_lemmas(doc, starts):
+                yield pdf_path, page, processed
+
+    def _lemmas(self, doc):
+        """
+        Devuelve los lemas de un documento de spaCy, sin stopwords ni signos, separados por espacios.
+        """
+        return " ".join([token.lemma_ for token in self._lemma_tokens(doc)])
+
+    def _page_lemmas(self, doc, starts):
+        """
+        Lemas de un fragmento agrupados por página: lista de (página, lemas
+        separados por espacios) con al menos un elemento. starts es la lista de
+        (posición, página) de split_pages.
+        """
+        positions = [start for start, _ in starts]
+        groups = []
+        for token in self._lemma_tokens(doc):
+            page = starts[bisect_right(positions, token.idx) - 1][1]
+            if not groups or groups[-1][0] != page:
+                groups.append((page, []))
+            groups[-1][1].append(token.lemma_)
+        return [(page, " ".join(lemmas)) for page, lemmas in groups] or [(starts[0][1], "")]
+
+    def _lemma_tokens(self, doc):
+        """
+        Tokens de un documento de spaCy sin stopwords ni signos. Si
+        lemma_counts está activo, cuenta además los pares (forma, lema) con
+        los que se construye la tabla de lemas de las consultas (LemmaTable).
+        """
+        tokens = [token for token in doc if not token.is_stop and token.is_alpha]
+        if self.lemma_counts is not None:
+            self.lemma_counts.update((token.text, token.lemma_) for token in tokens)
+        return tokens
     
     def extract_title(self, pdf_path):
         """Extrae el título del documento PDF analizando la primera página."""
-        doc = fitz.open(pdf_path)
-        
+        with fitz.open(pdf_path) as doc:
+            return self._title_from_document(doc)
+
+    def extract_metadata(self, pdf_path):
+        """
+        Extrae en una sola apertura del PDF el título, el número de páginas y
+        los metadatos del documento (autor, asunto, fecha de creación).
+        """
+        with metrics.timer("pdf.metadata"), fitz.open(pdf_path) as doc:
+            info = doc.metadata or {}
+            return {
+                "title": self._title_from_document(doc),
+                "pages": len(doc),
+                "author": info.get("author", ""),
+                "subject": info.get("subject", ""),
+                "created": info.get("creationDate", ""),
+            }
+
+    def _title_from_document(self, doc):
+        """Obtiene el título a partir de los bloques de texto de la primera página."""
         if len(doc) == 0:
             return "Título no disponible"
 
@@ -89,4 +237,4 @@ class PDFProcessor:
         # Unir líneas del título y asegurarse de que está en UTF-8
         title = " ".join(title_lines)
         
-        return title
\ No newline at end of file
+        return title
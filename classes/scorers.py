@@ -0,0 +1,196 @@
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.feature_extraction.text import CountVectorizer
+from classes.inverted_index import InvertedIndex
+from functions.disk_arrays import stack_rows
+
+
+class Scorer:
+    """
+    Interfaz de los algoritmos de puntuación del índice. Cada algoritmo
+    precalcula en fit una matriz de pesos (documentos x términos), de modo que
+    puntuar una consulta es un producto disperso entre esa matriz y el vector
+    de la consulta, sin normalizaciones por consulta.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.weights = None
+        self.inverted_index = None
+
+    def fit(self, indexer, path=None):
+        """
+        Precalcula los pesos a partir de las frecuencias guardadas en el
+        indexador. Con path, los pesos y sus postings se escriben en disco.
+        """
+        raise NotImplementedError
+
+    def query_vector(self, indexer, query):
+        """
+        Convierte la consulta preprocesada en un vector disperso sobre el vocabulario.
+        """
+        return self.query_matrix(indexer, [query])
+
+    def query_matrix(self, indexer, queries):
+        """
+        Vectoriza varias consultas preprocesadas a la vez: una fila por consulta.
+        Por defecto usa las frecuencias de los términos de cada consulta.
+        """
+        return CountVectorizer(vocabulary=indexer.vectorizer.vocabulary_).transform(queries)
+
+    def score(self, query_vector):
+        """
+        Devuelve el puntaje de todos los documentos para la consulta.
+        """
+        return np.asarray((self.weights @ query_vector.T).todense()).ravel()
+
+    def save(self, path):
+        """
+        Guarda la matriz de pesos y sus postings en la carpeta del índice.
+        """
+        for name, array in (("data", self.weights.data), ("indices", self.weights.indices),
+                            ("indptr", self.weights.indptr),
+                            ("postings_indptr", self.inverted_index.indptr),
+                            ("postings_indices", self.inverted_index.indices),
+                            ("postings_data", self.inverted_index.data)):
+            np.save(os.path.join(path, f"{self.name}_{name}.npy"), array)
+
+    def load(self, path, indexer):
+        """
+        Carga la matriz de pesos y sus postings como memoria mapeada.
+        """
+        def load_array(name):
+            return np.load(os.path.join(path, f"{self.name}_{name}.npy"), mmap_mode="r")
+
+        shape = indexer.document_matrix.shape
+        self.weights = csr_matrix(
+            (load_array("data"), load_array("indices"), load_array("indptr")), shape=shape, copy=False)
+        self.inverted_index = InvertedIndex(
+            load_array("postings_indptr"), load_array("postings_indices"),
+            load_array("postings_data"), shape[0])
+
+
+class TfidfScorer(Scorer):
+    """ TF-IDF normalizado: el producto con la consulta es la similitud de coseno """
+
+    name = "tfidf"
+
+    def fit(self, indexer, path=None):
+        # Reutiliza la matriz y el índice invertido del indexador
+        self.weights = indexer.document_matrix
+        self.inverted_index = indexer.inverted_index
+
+    def query_matrix(self, indexer, queries):
+        return indexer.vectorizer.transform(queries)
+
+    def save(self, path):
+        pass
+
+    def load(self, path, indexer):
+        self.fit(indexer)
+
+
+class BM25Scorer(Scorer):
+    """ Okapi BM25 sobre el contenido de los documentos """
+
+    name = "bm25"
+
+    def __init__(self, k1=1.2, b=0.75):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+
+    @staticmethod
+    def idf(document_frequency, n_documents):
+        """
+        IDF de BM25 (siempre positivo).
+        """
+        return np.log(1 + (n_documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    @staticmethod
+    def length_norms(counts, b):
+        """
+        Normalización por longitud de cada documento: 1 - b + b * longitud / longitud media.
+        """
+        lengths = np.asarray(counts.sum(axis=1)).ravel()
+        average = lengths.mean() if lengths.size and lengths.mean() > 0 else 1.0
+        return 1 - b + b * lengths / average
+
+    @staticmethod
+    def scale_rows(counts, factors):
+        """
+        Divide cada fila de la matriz dispersa por su factor.
+        """
+        counts = csr_matrix(counts, dtype=np.float64, copy=True)
+        counts.data /= np.repeat(factors, np.diff(counts.indptr))
+        return counts
+
+    def saturate(self, tf, idf):
+        """
+        Aplica la saturación de BM25 a las frecuencias (ya normalizadas por longitud) y multiplica por el IDF.
+        """
+        weights = tf.copy()
+        weights.data = weights.data * (self.k1 + 1) / (weights.data + self.k1)
+        weights.data *= idf[weights.indices]
+        weights.eliminate_zeros()
+        return weights
+
+    def fit(self, indexer, path=None):
+        counts = indexer.term_counts
+        idf = self.idf(indexer.document_frequency, counts.shape[0])
+        norms = self.length_norms(counts, self.b)
+
+        def block(start, end):
+            return self.saturate(self.scale_rows(counts[start:end], norms[start:end]), idf)
+
+        self._set_weights(indexer, block, path)
+
+    def _set_weights(self, indexer, block, path=None):
+        """
+        Calcula la matriz de pesos por bloques de filas de como mucho
+        batch_tokens frecuencias (block(inicio, fin) devuelve los pesos de esas
+        filas) y sus postings.
+        """
+        counts = indexer.term_counts
+        self.weights = stack_rows(block, indexer.row_batches(counts), counts.shape,
+                                  np.float64, path, self.name)
+        self.inverted_index = InvertedIndex.from_matrix(
+            self.weights, path, f"{self.name}_postings", indexer.batch_tokens)
+
+
+class BM25FScorer(BM25Scorer):
+    """ BM25F con dos campos: título y contenido, cada uno con su peso y su normalización por longitud """
+
+    name = "bm25f"
+
+    def __init__(self, k1=1.2, body_weight=1.0, title_weight=3.0, body_b=0.75, title_b=0.5):
+        super().__init__(k1=k1, b=body_b)
+        self.body_weight = body_weight
+        self.title_weight = title_weight
+        self.title_b = title_b
+
+    def fit(self, indexer, path=None):
+        counts = indexer.term_counts
+        title_counts = indexer.title_counts()
+        idf = self.idf(indexer.document_frequency, counts.shape[0])
+        body_norms = self.length_norms(counts, self.b)
+        title_norms = self.length_norms(title_counts, self.title_b)
+
+        def block(start, end):
+            # Frecuencia combinada de los campos, normalizada por la longitud de cada campo
+            tf = (self.scale_rows(counts[start:end], body_norms[start:end]) * self.body_weight
+                  + self.scale_rows(title_counts[start:end], title_norms[start:end]) * self.title_weight)
+            return self.saturate(csr_matrix(tf), idf)
+
+        self._set_weights(indexer, block, path)
+
+
+# Algoritmos de puntuación disponibles, por nombre
+SCORERS = {
+    TfidfScorer.name: TfidfScorer,
+    BM25Scorer.name: BM25Scorer,
+    BM25FScorer.name: BM25FScorer,
+}
@@ -0,0 +1,104 @@
+import requests
+
+
+class SearchClient:
+    """
+    Cliente del servidor de búsqueda (server.py). Ofrece la misma interfaz que
+    SearchService, de modo que la aplicación puede usar el servicio local o el
+    remoto indistintamente; los textos de los documentos se reciben como fragmentos.
+    """
+
+    def __init__(self, base_url="http://127.0.0.1:8000", timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def reindex(self, **config):
+        """
+        Pide al servidor que actualice el índice si los documentos procesados
+        o la configuración de clustering cambiaron. Devuelve True si se reconstruyó.
+        """
+        return self._request("post", "/reindex", json=config)["rebuilt"]
+
+    def search(self, query, threshold=0.009, mode="cosine", k=None, scorer="tfidf", n_probe=1):
+        params = {"q": query, "threshold": threshold, "mode": mode,
+                  "scorer": scorer, "n_probe": n_probe}
+        if k is not None:
+            params["k"] = k
+        response = self._request("get", "/search", params=params)
+        results = [
+            (result["snippet"], result["score"], result["pdf"], result["title"], result["id"])
+            for result in response["results"]
+        ]
+        clusters_scores = {
+            int(cluster_id): score for cluster_id, score in response["clusters_scores"].items()}
+        return results, clusters_scores
+
+    def search_many(self, queries, threshold=0.009, mode="cosine", k=None, scorer="tfidf", n_probe=1):
+        response = self._request("post", "/search_many", json={
+            "queries": list(queries), "threshold": threshold, "mode": mode, "k": k,
+            "scorer": scorer, "n_probe": n_probe})
+        return [
+            [(result["snippet"], result["score"], result["pdf"], result["title"], result["id"])
+             for result in results]
+            for results in response["results"]
+        ]
+
+    def similar(self, doc_id, threshold=0.1, mode="sparse"):
+        response = self._request(
+            "get", f"/similar/{doc_id}", params={"threshold": threshold, "mode": mode})
+        return [
+            (result["snippet"], result["score"], result["pdf"], result["id"])
+            for result in response["results"]
+        ]
+
+    def passages(self, query, doc_ids, n=1):
+        response = self._request("get", "/passages", params={
+            "q": query, "ids": ",".join(str(doc_id) for doc_id in doc_ids), "n": n})
+        return {
+            int(doc_id): [{**passage, "highlights": [tuple(span) for span in passage["highlights"]]}
+                          for passage in passages]
+            for doc_id, passages in response["passages"].items()
+        }
+
+    def pdf_url(self, doc_id):
+        """
+        URL de descarga del PDF de un documento en el servidor (admite Range).
+        """
+        return f"{self.base_url}/pdf/{doc_id}"
+
+    def pdf(self, doc_id):
+        """
+        Descarga el PDF de un documento por bloques y devuelve sus bytes.
+        """
+        with requests.get(self.pdf_url(doc_id), stream=True, timeout=self.timeout) as response:
+            if response.status_code >= 400:
+                raise ValueError(response.json().get("error", response.text))
+            return b"".join(response.iter_content(chunk_size=1 << 20))
+
+    def clusters(self):
+        return {
+            cluster["id"]: {"size": cluster["size"], "titles": cluster["titles"]}
+            for cluster in self._request("get", "/clusters")["clusters"]
+        }
+
+    def relevant(self, query):
+        return self._request("get", "/relevant", params={"q": query})["ids"]
+
+    def cache_stats(self):
+        return self._request("get", "/stats")["caches"]
+
+    def metrics_text(self):
+        response = requests.get(self.base_url + "/metrics", timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+    def _request(self, method, path, **kwargs):
+        """
+        Realiza la petición y devuelve la respuesta JSON. Los errores del
+        servidor se devuelven como ValueError, igual que en la fachada.
+        """
+        response = requests.request(
+            method, self.base_url + path, timeout=self.timeout, **kwargs)
+        if response.status_code >= 400:
+            raise ValueError(response.json().get("error", response.text))
+        return response.json()
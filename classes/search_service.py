@@ -0,0 +1,194 @@
+import os
+import threading
+
+from classes.document_search_facade import DocumentSearchFacade
+from classes.file_cache import FileCache
+from classes.metrics import metrics
+from classes.pdf_processor import PDFProcessor
+
+
+class SearchService:
+    """
+    Servicio de búsqueda de larga duración: mantiene un único modelo de spaCy y
+    un único índice cargados por proceso y los comparte entre todos los clientes.
+    Las consultas se atienden con la fachada actual; la reindexación construye
+    una fachada nueva en segundo plano y la sustituye de forma atómica, de modo
+    que las búsquedas en curso nunca ven un índice a medio construir.
+    """
+
+    # Longitud del fragmento de texto devuelto con cada resultado
+    snippet_length = 300
+    # Parámetros de indexación de la fachada que se pueden cambiar al reindexar
+    config_params = ("clustering", "eps", "min_samples", "n_clusters", "n_components",
+                     "dense_components", "dense_quantize", "dense_probe", "hybrid_weight",
+                     "n_shards")
+
+    def __init__(self, index_path="./index", processed_folder_path="./processed_files", processor=None,
+                 pdf_cache_bytes=256 * 2**20):
+        self.index_path = index_path
+        self.processed_folder_path = processed_folder_path
+        # spaCy se carga solo si hace falta: las consultas usan la tabla de lemas
+        self.processor = processor or PDFProcessor(lazy=True)
+        self.config = {}
+        # PDFs servidos para descarga, abiertos como memoria mapeada solo al pedirlos
+        self.files = FileCache(pdf_cache_bytes)
+        self.facade = None
+        # Sello de versión del índice cargado (firma del corpus y del clustering)
+        self.version = None
+        # Sello del almacén del corpus con el que se comprobó el índice por última vez
+        self.corpus_stamp = None
+        # La fachada guarda estado de la última consulta (clusters_scores) y
+        # el modelo de spaCy se carga en el primer uso: las lecturas de la
+        # fachada se hacen con este cerrojo, que también protege el cambio de índice
+        self._search_lock = threading.Lock()
+        # Evita dos reindexaciones simultáneas
+        self._reindex_lock = threading.Lock()
+
+    def start(self, **config):
+        """
+        Carga (o construye) el índice antes de aceptar consultas; config se
+        pasa a reindex (por ejemplo, n_shards).
+        """
+        self.reindex(**config)
+
+    def reindex(self, **config):
+        """
+        Vuelve a cargar el índice con los documentos procesados actuales,
+        actualizándolo si cambiaron; si el índice actual sigue vigente no se
+        hace nada. config permite cambiar el algoritmo de
+        clustering y sus parámetros (clustering, eps, min_samples, n_clusters,
+        n_components) y los demás parámetros de config_params; cualquier otro
+        nombre produce ValueError. Devuelve True si el índice se reconstruyó.
+        Si la configuración y el sello del almacén no cambiaron, no se vuelve
+        a leer el almacén para comprobarlo.
+        """
+        unknown = sorted(set(config) - set(self.config_params))
+        if unknown:
+            raise ValueError(f"Parámetros de indexación desconocidos: {', '.join(unknown)}")
+        with self._reindex_lock:
+            config = {**self.config, **config}
+            stamp = self._corpus_stamp()
+            if self.facade is not None and config == self.config:
+                if stamp is not None and stamp == self.corpus_stamp:
+                    return False
+                if self.facade.is_current(self.processed_folder_path):
+                    self.corpus_stamp = stamp
+                    return False
+            # Las cachés de consultas se conservan: sus entradas llevan la versión del índice
+            facade = DocumentSearchFacade(
+                self.index_path, processor=self.processor,
+                caches=self.facade.caches if self.facade is not None else None)
+            for name, value in config.items():
+                setattr(facade, name, value)
+            rebuilt = facade.load_index(self.processed_folder_path)
+            with self._search_lock:
+                previous, self.facade, self.config = self.facade, facade, config
+                self.version = facade.indexer.signature
+            # Sello tomado antes de cargar: un cambio durante la carga se detecta en la siguiente llamada
+            self.corpus_stamp = stamp
+            if previous is not None:
+                # Ninguna búsqueda usa ya la fachada anterior: detener sus particiones
+                previous.close()
+            return rebuilt
+
+    def _corpus_stamp(self):
+        """
+        Sello barato del almacén del corpus: su tabla de documentos se reemplaza
+        en cada guardado, así que basta con el inodo, el tamaño y la fecha del
+        archivo. None si el almacén todavía no existe.
+        """
+        try:
+            stat = os.stat(os.path.join(self.processed_folder_path, "corpus", "documents.json"))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _current(self):
+        """
+        Fachada actual; el índice se carga en el primer uso si no se llamó a start().
+        """
+        if self.facade is None:
+            self.reindex()
+        return self.facade
+
+    def search(self, query, **params):
+        """
+        Busca la consulta y devuelve (resultados, puntaje de cada cluster).
+        """
+        self._current()
+        with self._search_lock:
+            results = self.facade.search_documents(query, **params)
+            return results, dict(self.facade.clusters_scores)
+
+    def search_many(self, queries, **params):
+        """
+        Busca varias consultas de una vez; devuelve la lista de resultados de cada una.
+        """
+        self._current()
+        with self._search_lock:
+            return self.facade.search_many(queries, **params)
+
+    def similar(self, doc_id, threshold=0.1, mode="sparse"):
+        self._current()
+        with self._search_lock:
+            if doc_id not in self.facade.indexer.registry:
+                raise KeyError(doc_id)
+            return self.facade.recommend_similar_documents(doc_id, threshold, mode)
+
+    def passages(self, query, doc_ids, n=1):
+        """
+        Mejores pasajes de los documentos indicados para la consulta.
+        """
+        self._current()
+        with self._search_lock:
+            for doc_id in doc_ids:
+                if doc_id not in self.facade.indexer.registry:
+                    raise KeyError(doc_id)
+            return self.facade.passages(query, doc_ids, n)
+
+    def clusters(self):
+        self._current()
+        with self._search_lock:
+            return self.facade.cluster_summary()
+
+    def relevant(self, query):
+        self._current()
+        with self._search_lock:
+            return self.facade.relevant_documents(query)
+
+    def pdf_path(self, doc_id):
+        """
+        Ruta del PDF de un documento del índice. Lanza KeyError si el documento
+        no existe o su PDF ya no está en disco.
+        """
+        facade = self._current()
+        if doc_id not in facade.indexer.registry:
+            raise KeyError(doc_id)
+        path = facade.indexer.registry.record(doc_id)["pdf"]
+        if not os.path.isfile(path):
+            raise KeyError(doc_id)
+        return path
+
+    def open_pdf(self, doc_id):
+        """
+        Contenido del PDF de un documento como memoria mapeada (de la caché de archivos).
+        """
+        return self.files.get(self.pdf_path(doc_id))
+
+    def pdf(self, doc_id):
+        """
+        Bytes del PDF de un documento; se leen solo cuando se pide la descarga.
+        """
+        return bytes(self.open_pdf(doc_id))
+
+    def cache_stats(self):
+        return {**self._current().cache_stats(), "pdfs": self.files.stats()}
+
+    def metrics_text(self):
+        """
+        Métricas del proceso y de las cachés en formato de texto de Prometheus.
+        """
+        return metrics.to_prometheus(self.cache_stats())
+
+    def snippet(self, text):
+        return text[:self.snippet_length]
@@ -0,0 +1,165 @@
+import argparse
+import itertools
+import json
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from classes.document_search_facade import DocumentSearchFacade
+from classes.pdf_processor import PDFProcessor
+from functions.benchmark import percentiles, save_results
+from functions.evaluation import evaluate_rankings
+
+
+def load_judgments(path):
+    """
+    Lee el archivo de consultas juzgadas: una línea JSON por consulta con la
+    forma {"query": "...", "relevant": [...]} o {"query": "...", "relevant": {doc: grado}}.
+    Los documentos se indican por su nombre sin extensión (clave estable) o por
+    su id entero en el índice.
+    """
+    queries = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            relevant = entry["relevant"]
+            if not isinstance(relevant, dict):
+                relevant = {doc: 1 for doc in relevant}
+            queries.append((entry["query"], relevant))
+    return queries
+
+
+def resolve_judgments(queries, registry):
+    """
+    Convierte los documentos juzgados de cada consulta a ids del índice.
+    Los documentos que no están en el índice se conservan con un id negativo
+    para que sigan contando como relevantes no recuperados.
+    """
+    judgments = []
+    missing = 0
+    for _, relevant in queries:
+        judged = {}
+        for doc, grade in relevant.items():
+            doc_id = doc if isinstance(doc, int) else registry.id_for_key(str(doc))
+            if doc_id is None or doc_id not in registry:
+                missing += 1
+                doc_id = -1 - len(judged)
+            judged[doc_id] = grade
+        judgments.append(judged)
+    return judgments, missing
+
+
+def clustering_configs(args):
+    """
+    Configuraciones de clustering a evaluar: eps para DBSCAN y número de
+    clusters para SVD + MiniBatchKMeans.
+    """
+    configs = []
+    for clustering in args.clustering:
+        if clustering == "dbscan":
+            configs += [{"clustering": clustering, "eps": eps} for eps in args.eps]
+        else:
+            configs += [{"clustering": clustering, "n_clusters": n_clusters}
+                        for n_clusters in args.n_clusters]
+    return configs
+
+
+def run(args):
+    """
+    Indexa el corpus una sola vez y evalúa todas las combinaciones de clustering
+    y de parámetros de búsqueda con las mismas consultas. Devuelve una fila de
+    resultados por combinación.
+    """
+    queries = load_judgments(args.queries)
+    # El índice no se guarda: su carpeta temporal y la de los arreglos de la
+    # construcción se borran al terminar
+    index_path = tempfile.mkdtemp(prefix="evaluate_")
+    facade = DocumentSearchFacade(index_path, processor=PDFProcessor(lazy=True))
+    try:
+        facade.add_documents(args.processed)
+        judgments, missing = resolve_judgments(queries, facade.indexer.registry)
+        if missing:
+            print(f"Aviso: {missing} documentos juzgados no están en el índice.")
+
+        rows = []
+        for cluster_config in clustering_configs(args):
+            for name, value in cluster_config.items():
+                setattr(facade, name, value)
+            facade.perform_clustering()
+
+            for scorer, mode, threshold, n_probe in itertools.product(
+                    args.scorer, args.mode, args.threshold, args.n_probe):
+                rankings = []
+                latencies = []
+                for query, _ in queries:
+                    # Sin cachés: los resultados dependen del clustering actual y la
+                    # latencia debe medir la búsqueda completa
+                    for cache in facade.caches.values():
+                        cache.clear()
+                    start = time.perf_counter()
+                    results = facade.search_documents(
+                        query, threshold=threshold, mode=mode, k=args.k, scorer=scorer,
+                        n_probe=n_probe)
+                    latencies.append(time.perf_counter() - start)
+                    rankings.append([doc_id for _, _, _, _, doc_id in results])
+
+                metrics = evaluate_rankings(rankings, judgments, args.k)
+                rows.append({
+                    **cluster_config, "scorer": scorer, "mode": mode, "threshold": threshold,
+                    "n_probe": n_probe,
+                    **{name: float(np.mean(values)) for name, values in metrics.items()},
+                    **percentiles(latencies),
+                    "qps": len(latencies) / sum(latencies) if sum(latencies) else 0.0,
+                })
+    finally:
+        facade.close()
+        shutil.rmtree(index_path + ".build", ignore_errors=True)
+        shutil.rmtree(index_path, ignore_errors=True)
+    return rows
+
+
+def print_rows(rows, k):
+    print(f"{'configuración':<44} {'P@' + str(k):>7} {'R@' + str(k):>7} {'F1':>7} "
+          f"{'NDCG':>7} {'MRR':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for row in rows:
+        cluster = (f"dbscan eps={row['eps']}" if row["clustering"] == "dbscan"
+                   else f"svd_kmeans n={row['n_clusters']}")
+        config = (f"{cluster} {row['scorer']} {row['mode']} "
+                  f"t={row['threshold']} p={row['n_probe']}")
+        print(f"{config:<44} {row['precision']:>7.4f} {row['recall']:>7.4f} "
+              f"{row['f1_score']:>7.4f} {row['ndcg']:>7.4f} {row['mrr']:>7.4f} "
+              f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluación de relevancia en bloque con consultas juzgadas")
+    parser.add_argument("queries", help="Archivo JSONL con las consultas y sus documentos relevantes")
+    parser.add_argument("--processed", default="./processed_files",
+                        help="Carpeta de los documentos procesados")
+    parser.add_argument("--k", type=int, default=10, help="Resultados evaluados por consulta")
+    parser.add_argument("--clustering", nargs="+", default=["dbscan"],
+                        choices=["dbscan", "svd_kmeans"])
+    parser.add_argument("--eps", nargs="+", type=float, default=[0.816])
+    parser.add_argument("--n-clusters", nargs="+", type=int, default=[8])
+    parser.add_argument("--scorer", nargs="+", default=["tfidf"],
+                        choices=["tfidf", "bm25", "bm25f"])
+    parser.add_argument("--mode", nargs="+", default=["cosine"],
+                        choices=["cosine", "inverted", "passage", "dense", "hybrid"])
+    parser.add_argument("--threshold", nargs="+", type=float, default=[0.009])
+    parser.add_argument("--n-probe", nargs="+", type=int, default=[1])
+    parser.add_argument("--output", help="Guardar los resultados en este archivo JSON")
+    args = parser.parse_args()
+
+    rows = run(args)
+    print_rows(rows, args.k)
+    if args.output:
+        save_results({"k": args.k, "queries": args.queries, "results": rows}, args.output)
+
+
+if __name__ == "__main__":
+    main()
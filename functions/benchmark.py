@@ -0,0 +1,145 @@
+import json
+import os
+import platform
+import resource
+import threading
+import time
+
+import numpy as np
+
+
+def percentiles(latencies):
+    """
+    Resume una lista de latencias (segundos) en media y percentiles 50/95/99, en milisegundos.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64) * 1000
+    if not len(latencies):
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"mean_ms": float(latencies.mean()), "p50_ms": float(p50),
+            "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+# Descriptor de /proc/self/statm, abierto una vez por proceso (se lee con pread);
+# se guarda el pid porque un proceso hijo heredaría el del padre
+_statm = None
+_statm_pid = None
+
+
+def current_rss():
+    """
+    Memoria residente actual del proceso en bytes (Linux); si no está
+    disponible, el máximo alcanzado según getrusage.
+    """
+    global _statm, _statm_pid
+    try:
+        if _statm_pid != os.getpid():
+            _statm, _statm_pid = os.open("/proc/self/statm", os.O_RDONLY), os.getpid()
+        return int(os.pread(_statm, 64, 0).split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakRSS:
+    """
+    Mide el pico de memoria residente de un bloque muestreando la RSS del
+    proceso en un hilo: getrusage solo da el máximo de toda la vida del proceso.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+
+def run_batch_stage(function, items):
+    """
+    Ejecuta una etapa que procesa un lote completo (ingesta, indexación...)
+    y devuelve su duración, rendimiento (elementos/s) y pico de memoria.
+    """
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+    return {"items": items, "seconds": seconds,
+            "throughput": items / seconds if seconds else 0.0,
+            "peak_rss_mb": rss.peak / 2**20}
+
+
+def run_item_stage(function, items):
+    """
+    Ejecuta una función por cada elemento (consultas, documentos a recomendar)
+    y devuelve rendimiento (elementos/s), percentiles de latencia y pico de memoria.
+    """
+    latencies = []
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        for item in items:
+            item_start = time.perf_counter()
+            function(item)
+            latencies.append(time.perf_counter() - item_start)
+        seconds = time.perf_counter() - start
+    return {"items": len(latencies), "seconds": seconds,
+            "throughput": len(latencies) / seconds if seconds else 0.0,
+            **percentiles(latencies), "peak_rss_mb": rss.peak / 2**20}
+
+
+def environment():
+    """
+    Datos de la máquina para identificar una ejecución del benchmark.
+    """
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def save_results(results, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(results, file, ensure_ascii=False, indent=1)
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+# Métricas que se comparan entre ejecuciones y si un valor mayor es mejor
+COMPARED_METRICS = {"throughput": True, "p50_ms": False, "p95_ms": False,
+                    "p99_ms": False, "seconds": False, "peak_rss_mb": False}
+
+
+def compare_results(baseline, candidate, tolerance=10.0):
+    """
+    Compara dos ejecuciones etapa por etapa. Devuelve una lista de
+    (etapa, métrica, valor base, valor nuevo, cambio en %, empeora) donde
+    empeora indica un cambio desfavorable mayor que la tolerancia (en %).
+    """
+    rows = []
+    for stage, base_metrics in baseline["stages"].items():
+        new_metrics = candidate["stages"].get(stage)
+        if new_metrics is None:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in base_metrics or metric not in new_metrics:
+                continue
+            old, new = base_metrics[metric], new_metrics[metric]
+            change = (new - old) / old * 100 if old else 0.0
+            regression = (-change if higher_is_better else change) > tolerance
+            rows.append((stage, metric, old, new, change, regression))
+    return rows
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+def empty_array(shape, dtype, path=None, name=None):
+    """
+    Arreglo sin inicializar para rellenarlo por bloques: en memoria o, si se
+    indica una carpeta, como archivo name.npy abierto como memoria mapeada, de
+    modo que lo ya escrito no tiene que quedar en la memoria del proceso.
+    """
+    shape = tuple(int(size) for size in np.atleast_1d(shape))
+    if path is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(
+        os.path.join(path, name + ".npy"), mode="w+", dtype=dtype, shape=shape)
+
+
+def index_dtype(n_values):
+    """
+    Tipo de los índices de una matriz dispersa con n_values elementos: scipy
+    copia en memoria los arreglos de índices si no tienen el tipo que espera.
+    """
+    return np.int32 if n_values <= np.iinfo(np.int32).max else np.int64
+
+
+def batch_ranges(sizes, max_size):
+    """
+    Divide elementos consecutivos con los tamaños indicados en rangos
+    (inicio, fin) cuyo tamaño total no pasa de max_size; un elemento que ya lo
+    supera por sí solo forma su propio rango.
+    """
+    ends = np.cumsum(np.asarray(sizes, dtype=np.int64))
+    start = 0
+    while start < len(ends):
+        offset = ends[start - 1] if start else 0
+        end = max(start + 1, int(np.searchsorted(ends, offset + max_size, side="right")))
+        yield start, end
+        start = end
+
+
+def bucket_positions(keys, cursor):
+    """
+    Posiciones de destino de un lote en una ordenación por conteo: los
+    elementos con la clave c ocupan, en el orden del lote, las posiciones
+    libres a partir de cursor[c], que se avanza.
+    """
+    order = np.argsort(keys, kind="stable")
+    counts = np.bincount(keys, minlength=len(cursor))
+    # Posición de cada elemento dentro de su clave en el orden del lote
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys))
+    del order
+    rank -= (np.cumsum(counts) - counts)[keys]
+    rank += cursor[keys]
+    cursor += counts
+    return rank
+
+
+def stack_rows(block, ranges, shape, dtype, path=None, name=None):
+    """
+    Matriz CSR calculada por bloques de filas: block(inicio, fin) devuelve las
+    filas [inicio, fin) con los índices ordenados. Se recorre en dos pasadas
+    (elementos de cada fila; después las filas en su lugar), así que solo un
+    bloque está en memoria; con path, la matriz se escribe en disco
+    (name_data.npy, name_indices.npy y name_indptr.npy).
+    """
+    ranges = list(ranges)
+    row_sizes = np.zeros(shape[0], dtype=np.int64)
+    for start, end in ranges:
+        row_sizes[start:end] = np.diff(block(start, end).indptr)
+    nnz = int(row_sizes.sum())
+    index_type = index_dtype(max(nnz, *shape))
+    indptr = empty_array(shape[0] + 1, index_type, path, f"{name}_indptr")
+    indptr[0] = 0
+    indptr[1:] = np.cumsum(row_sizes)
+    indices = empty_array(nnz, index_type, path, f"{name}_indices")
+    data = empty_array(nnz, dtype, path, f"{name}_data")
+    for start, end in ranges:
+        rows = block(start, end)
+        indices[indptr[start]:indptr[end]] = rows.indices
+        data[indptr[start]:indptr[end]] = rows.data
+    return csr_matrix((data, indices, indptr), shape=shape, copy=False)
@@ -63,3 +63,54 @@ def ndcg(recommended_docs, relevant_docs, k=10):
 
     # Calcular NDCG
     return dcg / idcg if idcg > 0 else 0.0
+
+
+def evaluate_rankings(rankings, judgments, k=10):
+    """
+    Evalúa en bloque los resultados de varias consultas con precisión, cobertura,
+    F1-Score y NDCG en los k primeros resultados y MRR (rango recíproco medio).
+
+    Args:
+        rankings (list): Para cada consulta, la lista ordenada de ids de documentos devueltos.
+        judgments (list): Para cada consulta, un diccionario id -> grado de relevancia
+            (mayor que 0 si el documento es relevante).
+        k (int): Número máximo de documentos a considerar.
+
+    Returns:
+        dict: Arreglos con el valor de cada métrica por consulta.
+    """
+    n_queries = len(rankings)
+    # Matrices consultas x posiciones con el grado de relevancia de cada resultado
+    # y con los grados ideales (los juicios ordenados de mayor a menor)
+    gains = np.zeros((n_queries, k))
+    ideal = np.zeros((n_queries, k))
+    retrieved = np.zeros(n_queries)
+    for i, (ranking, judged) in enumerate(zip(rankings, judgments)):
+        ranking = list(ranking)[:k]
+        gains[i, :len(ranking)] = [judged.get(doc_id, 0) for doc_id in ranking]
+        grades = sorted((grade for grade in judged.values() if grade > 0), reverse=True)[:k]
+        ideal[i, :len(grades)] = grades
+        retrieved[i] = len(ranking)
+
+    hits = gains > 0
+    n_hits = hits.sum(axis=1)
+    n_relevant = np.array([sum(grade > 0 for grade in judged.values()) for judged in judgments])
+
+    # Calcular precisión y cobertura (0 si no hay resultados o documentos relevantes)
+    precision = np.divide(n_hits, retrieved, out=np.zeros(n_queries), where=retrieved > 0)
+    recall = np.divide(n_hits, n_relevant, out=np.zeros(n_queries), where=n_relevant > 0)
+    f1_score = np.divide(2 * precision * recall, precision + recall,
+                         out=np.zeros(n_queries), where=(precision + recall) > 0)
+
+    # Calcular NDCG con el mismo descuento logarítmico que ndcg()
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    dcg = gains @ discounts
+    idcg = ideal @ discounts
+    ndcg_scores = np.divide(dcg, idcg, out=np.zeros(n_queries), where=idcg > 0)
+
+    # Rango recíproco del primer resultado relevante (0 si no hay ninguno)
+    first_hit = hits.argmax(axis=1)
+    mrr = np.where(hits.any(axis=1), 1 / (first_hit + 1), 0.0)
+
+    return {"precision": precision, "recall": recall, "f1_score": f1_score,
+            "ndcg": ndcg_scores, "mrr": mrr}
@@ -1,16 +1,49 @@
+from classes.corpus_store import CorpusStore, TokenEncoder
+from classes.lemma_table import LemmaTable
+from classes.metadata_store import MetadataStore
 from classes.pdf_processor import PDFProcessor
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+import hashlib
+import json
 import os
 
+import numpy as np
+
 # Rutas de las carpetas
 folder_path = "./files"  # Carpeta donde están los PDFs
 # Carpeta donde se guardarán los archivos procesados
 processed_folder_path = "./processed_files"
+# Almacén del corpus: ids de términos de cada documento procesado y vocabulario común
+corpus_path = os.path.join(processed_folder_path, "corpus")
+# Manifiesto con el estado de cada PDF procesado
+manifest_path = os.path.join(processed_folder_path, "manifest.json")
+# Metadatos (título, páginas...) de cada PDF, extraídos una sola vez al procesarlo
+metadata_path = os.path.join(processed_folder_path, "metadata.json")
+# Tabla forma -> lema del corpus, usada para lematizar las consultas sin spaCy
+lemmas_path = os.path.join(processed_folder_path, "lemmas.json")
+
+# Versión del pipeline de extracción y preprocesamiento. Cambiarla obliga a
+# reprocesar todos los PDFs en la siguiente ingesta.
+PIPELINE_VERSION = 2
 
 # Crear la carpeta de salida si no existe
 os.makedirs(processed_folder_path, exist_ok=True)
 
-# Instanciar el procesador de PDFs
-process = PDFProcessor()
+# Procesador de PDFs del proceso; se instancia al usarlo por primera vez para
+# no cargar el modelo de spaCy al importar el módulo (p. ej. desde el servidor)
+process = None
+
+
+def get_processor():
+    """
+    Devuelve el procesador de PDFs del proceso, creándolo si no existe.
+    """
+    global process
+    if process is None:
+        process = PDFProcessor()
+    return process
 
 
 def get_pdf_files():
@@ -21,22 +54,187 @@ def get_pdf_files():
         "\\", "/") for file in os.listdir(folder_path) if file.endswith(".pdf")]
 
 
-def process_pdfs(pdf_files):
+def load_manifest():
+    """
+    Carga el manifiesto de ingesta (ruta del PDF -> tamaño, fecha de modificación,
+    hash del contenido, versión del pipeline y clave del documento en el almacén del corpus).
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_manifest(manifest):
+    """
+    Guarda el manifiesto de ingesta de forma atómica.
     """
-    Procesa una lista de archivos PDF y guarda los textos procesados en archivos .txt.
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    Calcula el hash SHA-256 del contenido de un archivo leyéndolo por bloques.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def process_batch(pdf_files, batch_size=8):
+    """
+    Extrae y preprocesa un lote de PDFs y codifica cada texto como ids de términos.
+    Los PDFs se procesan en streaming por fragmentos (PDFProcessor.preprocess_pdfs),
+    codificando los lemas a medida que se generan, de modo que solo se guarda
+    un arreglo de ids por documento y no su texto.
+    Se ejecuta tanto en el proceso principal como en los procesos del pool;
+    cada proceso usa su propia instancia de PDFProcessor (y su modelo de spaCy).
+    Devuelve una lista de (ruta del PDF, ids de términos, posición donde empieza
+    cada página, hash del contenido, metadatos),
+    el vocabulario del lote al que se refieren los ids y el contador de pares
+    (forma, lema) del lote para la tabla de lemas.
+    """
+    results = []
+    encoder = TokenEncoder()
+    chunks = []
+    page_starts = []
+    n_tokens = 0
+    current_pdf = None
+    processor = get_processor()
+    processor.lemma_counts = Counter()
+    try:
+        for pdf_file, page, processed_chunk in processor.preprocess_pdfs(pdf_files, batch_size):
+            if pdf_file != current_pdf:
+                if current_pdf is not None:
+                    results.append(_batch_result(current_pdf, chunks, page_starts))
+                current_pdf = pdf_file
+                chunks, page_starts, n_tokens = [], [], 0
+            # Las páginas sin texto empiezan donde empieza la siguiente
+            while len(page_starts) < page:
+                page_starts.append(n_tokens)
+            # Codificar el fragmento procesado con el vocabulario del lote
+            chunks.append(encoder.encode(processed_chunk))
+            n_tokens += len(chunks[-1])
+        if current_pdf is not None:
+            results.append(_batch_result(current_pdf, chunks, page_starts))
+    finally:
+        lemma_counts, processor.lemma_counts = processor.lemma_counts, None
+    return results, encoder.terms, lemma_counts
+
+
+def _batch_result(pdf_file, chunks, page_starts):
     """
+    Resultado de un PDF procesado: ruta, ids de términos, inicio de cada página,
+    hash del contenido y metadatos.
+    """
+    return (pdf_file, np.concatenate(chunks), page_starts, file_hash(pdf_file),
+            get_processor().extract_metadata(pdf_file))
+
+
+def _ensure_metadata(metadata, pdf_file):
+    """
+    Extrae los metadatos de un PDF ya procesado si todavía no están en el almacén.
+    """
+    doc_id = MetadataStore.document_id(pdf_file)
+    if metadata.get(doc_id) is None:
+        metadata.put(doc_id, get_processor().extract_metadata(pdf_file))
+
+
+def process_pdfs(pdf_files, workers=1, batch_size=8):
+    """
+    Procesa una lista de archivos PDF y guarda los textos procesados en el almacén del corpus.
+    Solo se extraen y lematizan los PDFs nuevos o modificados según el manifiesto;
+    los PDFs eliminados se quitan del almacén.
+    Con workers > 1 los PDFs se reparten por lotes entre varios procesos.
+    Devuelve un diccionario con las rutas añadidas, actualizadas, eliminadas y sin cambios.
+    """
+    manifest = load_manifest()
+    metadata = MetadataStore(metadata_path)
+    lemma_table = LemmaTable(lemmas_path)
+    store = CorpusStore.open(corpus_path, processed_folder_path)
+    changes = {"added": [], "updated": [], "removed": [], "unchanged": []}
+
+    # Detectar qué PDFs hay que procesar
+    pending = []
     for pdf_file in pdf_files:
-        # Extraer el texto del PDF y preprocesarlo
-        processed_text = process.preprocess_text(
-            process.extract_text(pdf_file)
-        )
-
-        # Nombre del archivo de salida
-        output_file_name = os.path.splitext(
-            os.path.basename(pdf_file))[0] + ".txt"
-        output_file_path = os.path.join(
-            processed_folder_path, output_file_name)
-
-        # Guardar el texto procesado en un archivo .txt
-        with open(output_file_path, "w", encoding="utf-8") as output_file:
-            output_file.write(processed_text)
+        stat = os.stat(pdf_file)
+        entry = manifest.get(pdf_file)
+
+        if (entry and entry["pipeline_version"] == PIPELINE_VERSION
+                and MetadataStore.document_id(pdf_file) in store):
+            # Comprobación rápida por tamaño y fecha de modificación
+            if entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime_ns:
+                _ensure_metadata(metadata, pdf_file)
+                changes["unchanged"].append(pdf_file)
+                continue
+            # La fecha cambió: solo se reprocesa si cambió el contenido
+            if file_hash(pdf_file) == entry["hash"]:
+                entry["size"] = stat.st_size
+                entry["mtime"] = stat.st_mtime_ns
+                _ensure_metadata(metadata, pdf_file)
+                changes["unchanged"].append(pdf_file)
+                continue
+
+        pending.append(pdf_file)
+
+    batches = [pending[i:i + batch_size]
+               for i in range(0, len(pending), batch_size)]
+
+    try:
+        with tqdm(total=len(pending), desc="Procesando PDFs", unit="pdf") as progress:
+            if workers > 1 and len(batches) > 1:
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    futures = [executor.submit(process_batch, batch, batch_size)
+                               for batch in batches]
+                    for future in as_completed(futures):
+                        batch_results, terms, lemma_counts = future.result()
+                        _record_results(manifest, metadata, store, changes, batch_results, terms)
+                        lemma_table.update(lemma_counts)
+                        progress.update(len(batch_results))
+            else:
+                for batch in batches:
+                    batch_results, terms, lemma_counts = process_batch(batch, batch_size)
+                    _record_results(manifest, metadata, store, changes, batch_results, terms)
+                    lemma_table.update(lemma_counts)
+                    progress.update(len(batch_results))
+
+        # Eliminar los documentos de los PDFs que ya no existen
+        for pdf_file in list(manifest):
+            if not os.path.exists(pdf_file):
+                manifest.pop(pdf_file)
+                store.remove(MetadataStore.document_id(pdf_file))
+                metadata.remove(MetadataStore.document_id(pdf_file))
+                changes["removed"].append(pdf_file)
+    finally:
+        # El almacén se guarda antes que el manifiesto, que solo registra documentos ya guardados
+        store.save()
+        save_manifest(manifest)
+        metadata.save()
+        lemma_table.save()
+
+    return changes
+
+
+def _record_results(manifest, metadata, store, changes, batch_results, terms):
+    """
+    Registra en el almacén del corpus, en el manifiesto y en el almacén de
+    metadatos los PDFs procesados en un lote (terms es el vocabulario del lote).
+    """
+    for pdf_file, token_ids, page_starts, content_hash, pdf_metadata in batch_results:
+        stat = os.stat(pdf_file)
+        key = MetadataStore.document_id(pdf_file)
+        store.add(key, token_ids, terms, page_starts)
+        changes["updated" if pdf_file in manifest else "added"].append(pdf_file)
+        manifest[pdf_file] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "hash": content_hash,
+            "pipeline_version": PIPELINE_VERSION,
+            "key": key,
+        }
+        metadata.put(key, pdf_metadata)
@@ -0,0 +1,259 @@
+import argparse
+import json
+import logging
+import os
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+from classes.metrics import metrics
+from classes.pdf_processor import PDFProcessor
+from classes.search_service import SearchService
+
+# Parámetros de /search y su tipo
+SEARCH_PARAMS = {"threshold": float, "mode": str, "k": int, "scorer": str, "n_probe": int}
+
+# Bytes escritos por vez al enviar un PDF
+STREAM_CHUNK_SIZE = 1 << 20
+
+# Resultados de /search cuyo fragmento es su mejor pasaje; los demás usan el comienzo del texto
+PASSAGE_RESULTS = 10
+
+
+class SearchRequestHandler(BaseHTTPRequestHandler):
+    """
+    API HTTP/JSON del buscador:
+      GET  /search?q=...&threshold=&mode=&k=&scorer=&n_probe=
+      GET  /similar/{doc_id}?threshold=&mode=  (mode: sparse o dense)
+      GET  /passages?q=...&ids=1,2&n=  (mejores pasajes de cada documento)
+      GET  /pdf/{doc_id}  (descarga del PDF, admite cabecera Range; también HEAD)
+      GET  /relevant?q=...
+      GET  /clusters
+      GET  /health
+      GET  /stats  (aciertos y fallos de las cachés de consultas)
+      GET  /metrics  (métricas por etapa en formato de texto de Prometheus)
+      POST /search_many  (cuerpo JSON: {"queries": [...], más los parámetros de /search})
+      POST /reindex  (cuerpo JSON opcional con los parámetros del clustering)
+    """
+
+    service = None  # SearchService compartido por todos los hilos
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split("/") if part]
+        try:
+            if parts == ["search"]:
+                self._send(self._search(query))
+            elif len(parts) == 2 and parts[0] == "similar":
+                self._send(self._similar(int(parts[1]), query))
+            elif len(parts) == 2 and parts[0] == "pdf":
+                self._send_pdf(int(parts[1]))
+            elif parts == ["passages"]:
+                self._send(self._passages(query))
+            elif parts == ["relevant"]:
+                self._send({"ids": self.service.relevant(query.get("q", ""))})
+            elif parts == ["clusters"]:
+                self._send({"clusters": [
+                    {"id": cluster_id, **summary}
+                    for cluster_id, summary in self.service.clusters().items()
+                ]})
+            elif parts == ["health"]:
+                self._send({"status": "ok", "version": self.service.version,
+                            "documents": len(self.service.facade.indexer.registry)})
+            elif parts == ["metrics"]:
+                self._send_text(self.service.metrics_text())
+            elif parts == ["stats"]:
+                self._send({"caches": self.service.cache_stats()})
+            else:
+                self._send({"error": "Ruta no encontrada"}, 404)
+        except KeyError as error:
+            self._send({"error": f"Documento no encontrado: {error}"}, 404)
+        except ValueError as error:
+            self._send({"error": str(error)}, 400)
+        except Exception:
+            self._send_error()
+
+    def do_HEAD(self):
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        try:
+            if len(parts) == 2 and parts[0] == "pdf":
+                self._send_pdf(int(parts[1]), head=True)
+            else:
+                self._send_body(b"", "text/plain", 404)
+        except (KeyError, ValueError):
+            self._send_body(b"", "text/plain", 404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path not in ("/reindex", "/search_many"):
+            self._send({"error": "Ruta no encontrada"}, 404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise ValueError("El cuerpo debe ser un objeto JSON.")
+            if path == "/search_many":
+                self._send(self._search_many(body))
+                return
+            rebuilt = self.service.reindex(**body)
+            self._send({"rebuilt": rebuilt, "documents": len(self.service.facade.indexer.registry)})
+        except ValueError as error:
+            self._send({"error": str(error)}, 400)
+        except Exception:
+            self._send_error()
+
+    def _search(self, query):
+        if not query.get("q", "").strip():
+            raise ValueError("La consulta está vacía.")
+        params = {name: cast(query[name]) for name, cast in SEARCH_PARAMS.items() if name in query}
+        results, clusters_scores = self.service.search(query["q"], **params)
+        # El fragmento de los primeros resultados es su mejor pasaje para la
+        # consulta; se acota para que el trabajo no crezca con el número de resultados
+        passages = self.service.passages(
+            query["q"], [doc_id for *_, doc_id in results[:PASSAGE_RESULTS]])
+        return {
+            "results": [
+                {"id": doc_id, "score": float(score), "pdf": pdf, "title": title,
+                 "snippet": (passages[doc_id][0]["text"] if passages.get(doc_id)
+                             else self.service.snippet(doc)),
+                 "passages": passages.get(doc_id, [])}
+                for doc, score, pdf, title, doc_id in results
+            ],
+            "clusters_scores": {
+                str(cluster_id): float(score) for cluster_id, score in clusters_scores.items()},
+        }
+
+    def _search_many(self, body):
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not all(isinstance(query, str) for query in queries):
+            raise ValueError("queries debe ser una lista de consultas.")
+        params = {name: cast(body[name]) for name, cast in SEARCH_PARAMS.items()
+                  if body.get(name) is not None}
+        return {"results": [
+            [{"id": doc_id, "score": float(score), "pdf": pdf, "title": title,
+              "snippet": self.service.snippet(doc)}
+             for doc, score, pdf, title, doc_id in results]
+            for results in self.service.search_many(queries, **params)
+        ]}
+
+    def _passages(self, query):
+        if not query.get("q", "").strip():
+            raise ValueError("La consulta está vacía.")
+        doc_ids = [int(doc_id) for doc_id in query.get("ids", "").split(",") if doc_id.strip()]
+        passages = self.service.passages(query["q"], doc_ids, int(query.get("n", 1)))
+        return {"passages": {str(doc_id): items for doc_id, items in passages.items()}}
+
+    def _similar(self, doc_id, query):
+        threshold = float(query.get("threshold", 0.1))
+        mode = query.get("mode", "sparse")
+        return {"results": [
+            {"id": similar_id, "score": float(score), "pdf": pdf,
+             "snippet": self.service.snippet(doc)}
+            for doc, score, pdf, similar_id in self.service.similar(doc_id, threshold, mode)
+        ]}
+
+    def _send_pdf(self, doc_id, head=False):
+        """
+        Envía el PDF de un documento desde la caché de archivos (memoria
+        mapeada) por bloques, sin cargarlo completo. Con una cabecera
+        Range de un solo rango responde 206 con ese rango.
+        """
+        path = self.service.pdf_path(doc_id)
+        try:
+            content = self.service.files.get(path)
+        except FileNotFoundError:
+            raise KeyError(doc_id)
+        size = len(content)
+        start, end, status = 0, size - 1, 200
+        requested = self.headers.get("Range")
+        if requested:
+            match = re.fullmatch(r"bytes=(\d*)-(\d*)", requested.strip())
+            if match and match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            elif match and match.group(2):
+                start = max(size - int(match.group(2)), 0)
+            if not match or not any(match.groups()) or start > end or start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(end - start + 1 if size else 0))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Disposition",
+                         f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}")
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if head:
+            return
+        try:
+            for offset in range(start, end + 1, STREAM_CHUNK_SIZE):
+                self.wfile.write(content[offset:min(offset + STREAM_CHUNK_SIZE, end + 1)])
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # El cliente canceló la descarga
+
+    def _send(self, payload, status=200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self._send_body(body, "application/json; charset=utf-8", status)
+
+    def _send_error(self):
+        """
+        Responde 500 con un error JSON ante un fallo inesperado, en lugar de
+        cerrar la conexión sin respuesta; el detalle queda en el log.
+        """
+        logging.exception("Error al atender %s %s", self.command, self.path)
+        self._send({"error": "Error interno del servidor"}, 500)
+
+    def _send_text(self, text, status=200):
+        self._send_body(text.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8", status)
+
+    def _send_body(self, body, content_type, status):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor HTTP/JSON del buscador de documentos")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--index", default="./index", help="Carpeta del índice persistido")
+    parser.add_argument("--processed", default="./processed_files",
+                        help="Carpeta de los documentos procesados")
+    parser.add_argument("--preload-spacy", action="store_true",
+                        help="Cargar el modelo de spaCy al arrancar en lugar de en el primer uso")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Particiones del índice, cada una buscada en su propio proceso")
+    parser.add_argument("--metrics", choices=["on", "log"],
+                        help="Registrar métricas por etapa (log: escribir además cada evento en el log)")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable(log_events=args.metrics == "log")
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    # Un único servicio (modelo de spaCy e índice) compartido por todas las conexiones
+    SearchRequestHandler.service = SearchService(
+        args.index, args.processed, processor=PDFProcessor(lazy=not args.preload_spacy))
+    SearchRequestHandler.service.start(n_shards=args.shards)
+    server = ThreadingHTTPServer((args.host, args.port), SearchRequestHandler)
+    print(f"Servidor de búsqueda escuchando en http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()